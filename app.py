@@ -1,5 +1,7 @@
 import dash
+from os import environ
 from dash import Dash
+from flask import Response, jsonify, abort
 
 from layout.appshell import create_appshell
 from dotenv import load_dotenv
@@ -20,5 +22,26 @@ app.layout = create_appshell(dash.page_registry.values())
 
 server = app.server
 
+
+@server.route("/stats/db")
+def db_stats():
+    # Connection pool usage of this worker, for monitoring (db is imported here, after load_dotenv)
+    from db import get_pool_stats
+    return jsonify(get_pool_stats())
+
+
+@server.route("/data/airports/<name>.json")
+def airport_options(name):
+    # Preserialized option lists of the airport dropdowns ("from_fl", "from_ap" or "to")
+    from utils.airport_utils import get_airport_options_json
+    if name not in ["from_fl", "from_ap", "to"]:
+        abort(404)
+    return Response(get_airport_options_json(name), mimetype="application/json")
+
+
 if __name__ == "__main__":
+    # Under gunicorn, the indexes are checked once in the master process (see gunicorn.conf.py)
+    if environ.get("INDEX_CHECK", "true").lower() == "true":
+        from indexes import log_index_problems
+        log_index_problems(server.logger)
     app.run_server(debug=True)
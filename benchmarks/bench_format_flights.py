@@ -0,0 +1,244 @@
+"""
+Benchmark of the itinerary formatter in lib/flights.py on a synthetic 100k-row result. The column-by-column
+formatter that was used before is kept below for comparison.
+
+Run from the repository root: python -m benchmarks.bench_format_flights [rows]
+"""
+import sys
+import time
+import numpy as np
+import pandas as pd
+from lib.flights import format_flights, add_display_columns, get_leg_count
+
+
+def get_timedelta(tsd_from, tsd_to, convert=False):
+    """
+    Get the timedelta between tsd_to and tsd_from. Convert to "x hr y min" if needed
+    """
+    duration = (tsd_to - tsd_from).dt.total_seconds()
+    if convert:
+        duration = convert_duration(duration)
+    return duration
+
+
+def convert_duration(duration):
+    """
+    Convert duration in seconds to "x hr y min"
+    """
+    irrelevant_seconds = duration % 60
+    duration = duration - irrelevant_seconds
+    hrs, mins = divmod(duration / 60, 60)
+    hrs = hrs.astype("Int64").astype(str)
+    mins = mins.astype("Int64").astype(str)
+
+    dur_formatted = hrs + " hr " + mins + " min"
+    dur_formatted = dur_formatted.replace(r"\A0 hr ", "", regex=True)
+    dur_formatted = dur_formatted.replace(r"<NA> hr <NA> min", np.nan, regex=True)
+    return dur_formatted
+
+
+def get_airline_code(df, column, none_value):
+    """
+    Return airline code
+    """
+    col_exists = check_if_exists(df, column, none_value)
+    if col_exists.isnull().values.all():
+        return np.nan
+    else:
+        return col_exists.str[:3]
+
+
+def check_if_exists(df, column, none_value):
+    """
+    Check if column exists in df; if yes, return the column as a series, if not, return NaN/NaT
+    """
+    if column in df.columns:
+        if none_value == "NaT":
+            return pd.to_datetime(df[column])
+        else:
+            return df[column]
+    else:
+        if none_value == "NaT":
+            return pd.Series(pd.to_datetime(np.nan))
+        else:
+            return pd.Series(np.nan)
+
+
+def convert_time(column):
+    """
+    Convert datetime to HH:MM format
+    """
+    if column.isnull().values.all():
+        return column
+    else:
+        column = pd.to_datetime(column).dt.strftime("%H:%M")
+        return column
+
+
+def format_flights_legacy(df_all, flight_filter="unique"):
+    """
+    Previous formatter: format the raw legs in df_all into one row per itinerary. There are always at least 3 flight columns
+    (f1, f2, f3), longer itineraries add f4, f5, ...
+    """
+    df_all = df_all.reset_index(drop=True)
+    legs = max(3, get_leg_count(df_all))
+
+    df_formatted_columns = []
+    for leg in range(1, legs + 1):
+        f = "f" + str(leg)
+        df_formatted_columns += [
+            f + "_airline_code", f + "_airport_from", f + "_airport_to",
+            f + "_time_from", f + "_time_from_str", f + "_time_to", f + "_time_to_str",
+            f + "_duration", f + "_duration_s"
+        ]
+    df_formatted_columns += ["total_duration", "total_duration_s", "stop_count", "stop_count_str", "arr_time"]
+    for stop in range(1, legs):
+        df_formatted_columns += ["layover_duration_" + str(stop), "layover_duration_" + str(stop) + "_s"]
+    df_formatted_columns += ["layover_duration_sum"]
+
+    df_formatted = pd.DataFrame(columns=df_formatted_columns)
+
+    if df_all.empty:
+        df_final = df_all
+        return df_final
+
+    # 1st, 2nd, 3rd, ... flight
+    for leg in range(legs):
+        f = "f" + str(leg + 1)
+        suffix = "" if leg == 0 else "_" + str(leg)
+        df_formatted[f + "_airline_code"] = get_airline_code(df_all, "callsign" + suffix, "NaN")
+        df_formatted[f + "_airport_from"] = check_if_exists(df_all, "origin" + suffix, "NaN")
+        df_formatted[f + "_airport_to"] = check_if_exists(df_all, "destination" + suffix, "NaN")
+        df_formatted[f + "_time_from"] = check_if_exists(df_all, "firstseen" + suffix, "NaT")
+        df_formatted[f + "_time_from_str"] = convert_time(df_formatted[f + "_time_from"])
+        df_formatted[f + "_time_to"] = check_if_exists(df_all, "lastseen" + suffix, "NaT")
+        df_formatted[f + "_time_to_str"] = convert_time(df_formatted[f + "_time_to"])
+        df_formatted[f + "_duration"] = get_timedelta(
+          check_if_exists(df_all, "firstseen" + suffix, "NaT"),
+          check_if_exists(df_all, "lastseen" + suffix, "NaT"),
+          convert=True
+        )
+        df_formatted[f + "_duration_s"] = get_timedelta(
+          check_if_exists(df_all, "firstseen" + suffix, "NaT"),
+          check_if_exists(df_all, "lastseen" + suffix, "NaT"),
+          convert=False
+        )
+
+    # Duration if flight has 0, 1, 2, ... stops; the max value is the total duration
+    df_td = pd.DataFrame()
+    for leg in range(1, legs + 1):
+        time_to = df_formatted["f" + str(leg) + "_time_to"]
+        if time_to.isnull().values.all():
+            df_td[str(leg - 1) + "stop"] = np.nan
+        else:
+            df_td[str(leg - 1) + "stop"] = get_timedelta(
+                df_formatted["f1_time_from"],
+                time_to,
+                convert=False
+            ).reset_index(drop=True)
+
+    # Set max value to df_formatted
+    df_formatted["total_duration_s"] = df_td.max(axis=1)
+    df_formatted["total_duration"] = convert_duration(df_formatted["total_duration_s"])
+
+    # Layover Duration 1, 2, ...
+    for stop in range(1, legs):
+        time_to = df_formatted["f" + str(stop) + "_time_to"]
+        time_from = df_formatted["f" + str(stop + 1) + "_time_from"]
+        if time_to.isnull().values.all() or time_from.isnull().values.all():
+            layover = np.nan
+        else:
+            layover = get_timedelta(time_to, time_from, convert=False).reset_index(drop=True)
+
+        # Add Layover Duration to df_formatted
+        df_formatted["layover_duration_" + str(stop) + "_s"] = layover
+        df_formatted["layover_duration_" + str(stop)] = convert_duration(
+            df_formatted["layover_duration_" + str(stop) + "_s"]
+        )
+
+    # Add Stop Count to df_formatted
+    layovers = df_formatted[["layover_duration_" + str(stop) + "_s" for stop in range(1, legs)]]
+    stop_count = layovers.notnull().sum(axis=1).to_numpy()
+    df_formatted["stop_count"] = stop_count
+
+    cond = [stop_count == 0, stop_count == 1]
+    out = ["Nonstop", "1 stop"]
+    stop_count_str = np.select(cond, out, pd.Series(stop_count).astype(str) + " stops")
+    df_formatted["stop_count_str"] = stop_count_str
+
+    # Add arrival time
+    cond = [df_formatted["stop_count"] == stop for stop in range(legs)]
+    out = [df_formatted["f" + str(stop + 1) + "_time_to"] for stop in range(legs)]
+    arr_time = np.select(cond, out)
+    df_formatted["arr_time"] = arr_time
+
+    if flight_filter == "unique":
+        # Sort duration ascending to drop longer flights flying the same route
+        route = ["f" + str(leg) + "_airport_from" for leg in range(1, legs + 1)] + ["f" + str(legs) + "_airport_to"]
+        df_sorted = df_formatted.sort_values(
+            route + ["total_duration_s"],
+            ascending=[True] * (len(route) + 1)
+        )
+        df_final = df_sorted.drop_duplicates(
+            subset=route,
+            keep="first"
+        )
+    else:
+        df_final = df_formatted
+
+    return df_final
+
+
+def get_synthetic_flights(rows, seed=0):
+    """
+    Raw legs shaped like the result of get_flights_from_sql: a third each with 0, 1 and 2 stops
+    """
+    rng = np.random.default_rng(seed)
+    airports = np.array(["AP" + str(i).zfill(2) for i in range(50)], dtype=object)
+    airlines = np.array(["SWR", "DLH", "AFR", "UAL", "BAW"], dtype=object)
+    stops = rng.integers(0, 3, rows)
+    dep = pd.Timestamp("2022-03-01", tz="UTC") + pd.to_timedelta(rng.integers(0, 7 * 86400, rows), unit="s")
+
+    columns = {}
+    for leg in range(3):
+        suffix = "" if leg == 0 else "_" + str(leg)
+        exists = stops >= leg
+        arr = dep + pd.to_timedelta(rng.integers(3600, 10 * 3600, rows), unit="s")
+        columns["callsign" + suffix] = np.where(exists, airlines[rng.integers(0, 5, rows)] + "123", None)
+        columns["origin" + suffix] = np.where(exists, airports[rng.integers(0, 50, rows)], None)
+        columns["destination" + suffix] = np.where(exists, airports[rng.integers(0, 50, rows)], None)
+        columns["firstseen" + suffix] = pd.Series(dep).where(exists)
+        columns["lastseen" + suffix] = pd.Series(arr).where(exists)
+        dep = arr + pd.to_timedelta(rng.integers(3600, 5 * 3600, rows), unit="s")
+
+    return pd.DataFrame(columns)
+
+
+def measure(function, *args, repeat=3):
+    """
+    Best wall time of repeat calls in seconds
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    df_all = get_synthetic_flights(rows)
+
+    for flight_filter in ["all", "unique"]:
+        legacy = measure(format_flights_legacy, df_all, flight_filter)
+        vectorized = measure(format_flights, df_all, flight_filter)
+        rendered = measure(lambda: add_display_columns(format_flights(df_all, flight_filter).head(10)))
+        print(
+            f"{rows} rows, {flight_filter}: legacy {legacy:.3f}s, vectorized {vectorized:.3f}s "
+            f"({legacy / vectorized:.1f}x), vectorized + display strings for 10 rows {rendered:.3f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
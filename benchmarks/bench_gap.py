@@ -0,0 +1,160 @@
+"""
+Query time of get_gap on a synthetic flight table: the previous three filtered scans (plus value_counts in
+pandas), the single-scan statement from get_gap_stmt and the concurrent per-KPI statements from get_gap_kpi_stmts
+that get_gap uses for ranges longer than GAP_SINGLE_SCAN_DAYS. The table is created as bench_flight in the
+database from DATABASE_URL and dropped afterwards.
+
+Run from the repository root: python -m benchmarks.bench_gap [rows]
+"""
+import sys
+import time
+import pandas as pd
+import pytz
+from datetime import datetime
+from sqlalchemy import MetaData, Index, ForeignKeyConstraint, select, func, text
+from sqlalchemy.orm import aliased
+from db import engine
+from lib.executor import read_sql_all
+from lib.gap import get_gap_stmt, get_gap_kpi_stmts
+from models import Flight
+
+
+# Every airport is served by a few airlines and destinations, like in the real data
+AIRPORTS = 1000
+AIRLINES = 100
+AIRLINES_PER_AIRPORT = 20
+DESTINATIONS_PER_AIRPORT = 60
+DAYS = 365
+
+
+def create_bench_flight(rows):
+    """
+    Create bench_flight with rows random flights over DAYS days, indexed like the flight table
+    """
+    table = Flight.__table__.to_metadata(MetaData(), name="bench_flight")
+    # A plain table: the synthetic flights span months without partitions
+    table.dialect_options["postgresql"]["partition_by"] = None
+    # The synthetic airports are not in the airport table, and the index names of flight are taken
+    for constraint in [c for c in table.constraints if isinstance(c, ForeignKeyConstraint)]:
+        table.constraints.remove(constraint)
+    indexes = list(table.indexes)
+    table.indexes.clear()
+    for index in indexes:
+        Index(index.name.replace("ix_flight", "bench_flight"), *index.expressions, **index.dialect_kwargs)
+    # Used by the previous statements, which filter by airport code
+    Index("bench_flight_origin_firstseen", table.c.origin, table.c.firstseen)
+    table.drop(engine, checkfirst=True)
+    table.create(engine)
+
+    with engine.begin() as connection:
+        connection.execute(text(f"""
+            insert into bench_flight (flight_id, callsign, origin, destination, origin_id, destination_id,
+                                      airline_prefix, firstseen, lastseen)
+            select i, callsign, 'AP' || o, 'AP' || d, o, d, substr(callsign, 1, 3),
+                   firstseen, firstseen + interval '2 hours'
+            from (
+                select i, o, firstseen,
+                       'A' || lpad(((o * 7 + random() * {AIRLINES_PER_AIRPORT})::int % {AIRLINES})::text, 2, '0') ||
+                       (random() * 999)::int as callsign,
+                       (o + 1 + random() * {DESTINATIONS_PER_AIRPORT})::int % {AIRPORTS} as d
+                from (
+                    select i,
+                           (random() * ({AIRPORTS} - 1))::int as o,
+                           timestamptz '2022-01-01 00:00+00' + random() * interval '{DAYS} days' as firstseen
+                    from generate_series(1, {rows}) i
+                ) s
+            ) t
+        """))
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text("vacuum analyze bench_flight"))
+
+    return table
+
+
+def get_gap_legacy(a, origin, start, end):
+    """
+    Previous get_gap: three filtered scans, distinct counts rebuilt with value_counts
+    """
+    stmt = select(a.origin, func.count(a.origin)).\
+        where(a.firstseen.between(start, end), a.origin.in_(origin)).\
+        group_by(a.origin)
+    gap_flights = pd.read_sql(stmt, engine).\
+        rename(columns={"origin": "f1_airport_from", "count_1": "kpi1"}).\
+        set_index("f1_airport_from")
+
+    stmt = select(a.origin, func.substr(a.callsign, 1, 3), func.count(a.origin)).\
+        where(a.firstseen.between(start, end), a.origin.in_(origin)).\
+        group_by(a.origin, func.substr(a.callsign, 1, 3))
+    gap_airlines = pd.read_sql(stmt, engine)["origin"].value_counts().rename("kpi2")
+
+    stmt = select(a.origin, a.destination, func.count(a.origin)).\
+        where(a.firstseen.between(start, end), a.origin.in_(origin)).\
+        group_by(a.origin, a.destination)
+    gap_destinations = pd.read_sql(stmt, engine)["origin"].value_counts().rename("kpi3")
+
+    return pd.concat([gap_flights, gap_airlines, gap_destinations], axis=1)
+
+
+def get_gap_single(a, origin, start, end):
+    """
+    Current get_gap without the rollup (the synthetic airport "APi" has the id i)
+    """
+    origin_ids = [int(airport[2:]) for airport in origin]
+    return pd.read_sql(get_gap_stmt(a, origin_ids, start, end), engine).set_index("f1_airport_from")
+
+
+def get_gap_per_kpi(a, origin, start, end):
+    """
+    Current get_gap for long ranges without the rollup: one statement per KPI, sent at the same time
+    """
+    origin_ids = [int(airport[2:]) for airport in origin]
+    frames = read_sql_all(get_gap_kpi_stmts(a, origin_ids, start, end))
+    return pd.concat([df.set_index("f1_airport_from") for df in frames], axis=1)
+
+
+def measure(function, *args, repeat=3):
+    """
+    Best wall time of repeat calls in seconds, plus the last result
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10000000
+    print("Creating bench_flight with", rows, "rows ...")
+    table = create_bench_flight(rows)
+    a = aliased(Flight, table, adapt_on_names=True)
+
+    cases = [
+        ("20 origins, 7 days", 20, "2022-03-01", "2022-03-07"),
+        ("100 origins, 30 days", 100, "2022-03-01", "2022-03-30"),
+        ("20 origins, 365 days", 20, "2022-01-01", "2022-12-31"),
+        ("all origins, 90 days", AIRPORTS, "2022-01-01", "2022-03-31"),
+        ("all origins, 365 days", AIRPORTS, "2022-01-01", "2022-12-31")
+    ]
+    try:
+        for name, origins, day_from, day_to in cases:
+            origin = ["AP" + str(i) for i in range(origins)]
+            start = pytz.utc.localize(datetime.fromisoformat(day_from))
+            end = pytz.utc.localize(datetime.fromisoformat(day_to + "T23:59:59"))
+
+            legacy, df_legacy = measure(get_gap_legacy, a, origin, start, end)
+            single, df_single = measure(get_gap_single, a, origin, start, end)
+            per_kpi, df_per_kpi = measure(get_gap_per_kpi, a, origin, start, end)
+            same = df_legacy.sort_index().astype("int64").equals(df_single.sort_index()) and \
+                df_single.sort_index().equals(df_per_kpi.sort_index())
+            print(
+                f"{name}: three scans {legacy:.3f}s, single scan {single:.3f}s, per-KPI statements {per_kpi:.3f}s, "
+                f"same: {same}"
+            )
+    finally:
+        table.drop(engine)
+
+
+if __name__ == "__main__":
+    main()
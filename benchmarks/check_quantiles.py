@@ -0,0 +1,82 @@
+"""
+Parity check of the KPI normalization in lib/kpi.py against scikit-learn's QuantileTransformer, which it replaced:
+get_uniform_quantiles has to match QuantileTransformer(output_distribution="uniform").fit_transform for ties,
+missing values and fewer or more rows than n_quantiles. Needs scikit-learn, which the app does not install.
+
+Run from the repository root: python -m benchmarks.check_quantiles
+"""
+import sys
+import warnings
+import numpy as np
+from lib.kpi import get_uniform_quantiles
+
+try:
+    from sklearn.preprocessing import QuantileTransformer
+except ImportError:
+    QuantileTransformer = None
+
+
+def get_cases(rng):
+    """
+    (name, values, n_quantiles) test cases; every case has several columns
+    """
+    def with_nan(values, share=0.1):
+        values = values.copy()
+        values[rng.random(values.shape) < share] = np.nan
+        return values
+
+    return [
+        ("continuous, n < n_quantiles", rng.normal(size=(50, 4)), 1000),
+        ("continuous, n > n_quantiles", rng.normal(size=(3000, 4)), 1000),
+        ("continuous, n > small n_quantiles", rng.normal(size=(500, 4)), 20),
+        ("ties, n < n_quantiles", rng.integers(0, 5, size=(60, 4)).astype(float), 1000),
+        ("ties, n > n_quantiles", rng.integers(0, 20, size=(2500, 4)).astype(float), 1000),
+        ("ties, n > small n_quantiles", rng.integers(0, 7, size=(300, 4)).astype(float), 25),
+        ("NaNs, n < n_quantiles", with_nan(rng.normal(size=(80, 4))), 1000),
+        ("NaNs, n > n_quantiles", with_nan(rng.normal(size=(2000, 4))), 1000),
+        ("NaNs and ties", with_nan(rng.integers(0, 4, size=(400, 4)).astype(float), 0.2), 30),
+        ("n equal to n_quantiles", rng.normal(size=(100, 4)), 100),
+        ("constant column", np.column_stack([np.full(40, 3.0), rng.normal(size=40)]), 1000),
+        ("single row", rng.normal(size=(1, 4)), 1000),
+        ("airport KPIs", np.column_stack([
+            rng.integers(1, 2000, size=150), rng.integers(1, 40, size=150), rng.integers(1, 120, size=150),
+            rng.integers(0, 500, size=150), rng.integers(0, 30, size=150), rng.normal(30000, 8000, size=150),
+            rng.choice([0, 1, 1.5, 2], size=150), np.where(rng.random(150) < 0.3, 0, rng.normal(5000, 2000, 150))
+        ]).astype(float), 1000)
+    ]
+
+
+def get_sklearn_quantiles(values, n_quantiles):
+    # subsample above the number of rows, so that scikit-learn uses all of them like get_uniform_quantiles
+    transformer = QuantileTransformer(
+        n_quantiles=n_quantiles, output_distribution="uniform", subsample=max(len(values), 10000)
+    )
+    with warnings.catch_warnings():
+        # n_quantiles larger than the number of rows
+        warnings.simplefilter("ignore", UserWarning)
+        return transformer.fit_transform(values)
+
+
+def main():
+    if QuantileTransformer is None:
+        print("scikit-learn is not installed, skipping the parity check (pip install scikit-learn)")
+        return 0
+
+    cases = get_cases(np.random.default_rng(42))
+    failed = 0
+    for name, values, n_quantiles in cases:
+        expected = get_sklearn_quantiles(values, n_quantiles)
+        actual = get_uniform_quantiles(values, n_quantiles)
+        same_nan = np.array_equal(np.isnan(expected), np.isnan(actual))
+        difference = np.nanmax(np.abs(expected - actual), initial=0)
+        ok = same_nan and difference < 1e-9
+        failed += not ok
+        print(f"{'ok' if ok else 'FAILED':6} {name}: max difference {difference:.2e}"
+              + ("" if same_nan else ", NaNs differ"))
+
+    print(f"\n{failed} of {len(cases)} cases failed" if failed else "\nAll cases match")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""
+Startup report of the app: wall time of "import app" (what a gunicorn worker does before it can serve), resident
+memory after boot and the modules that take the longest to import (from python -X importtime). Every run starts a
+fresh interpreter; the report shows the median of the runs.
+
+Run from the repository root: python -m benchmarks.startup_report [runs] [modules]
+"""
+import json
+import re
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+
+# Executed in a fresh interpreter: boot the app, then report boot time and memory as JSON on stdout
+BOOT = """
+import json, resource, time
+start = time.perf_counter()
+import app
+boot_s = time.perf_counter() - start
+with open("/proc/self/status") as status:
+    rss_kb = next(int(line.split()[1]) for line in status if line.startswith("VmRSS:"))
+print(json.dumps({
+    "boot_s": boot_s,
+    "rss_mb": rss_kb / 1024,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "modules": len(__import__("sys").modules)
+}))
+"""
+
+# "import time: self [us] | cumulative | imported package", indented by import depth
+IMPORTTIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+
+def run_boot():
+    """
+    Boot the app once, returning the boot stats and the import times per module (self and cumulative, in ms)
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", BOOT],
+        capture_output=True, text=True, check=True
+    )
+
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            modules[module] = (int(self_us) / 1000, int(cumulative_us) / 1000, len(indent) // 2)
+
+    return json.loads(result.stdout.splitlines()[-1]), modules
+
+
+def main(runs=5, top=25):
+    boots = []
+    times = defaultdict(list)
+    for _ in range(runs):
+        boot, modules = run_boot()
+        boots.append(boot)
+        for module, (self_ms, cumulative_ms, depth) in modules.items():
+            times[module].append((self_ms, cumulative_ms, depth))
+
+    print(f"runs:            {runs}")
+    for key, label in [("boot_s", "boot (s)"), ("rss_mb", "rss (MB)"), ("max_rss_mb", "max rss (MB)"),
+                       ("modules", "modules loaded")]:
+        print(f"{label + ':':<17}{statistics.median(boot[key] for boot in boots):g}")
+
+    # Top-level packages (first name) by self time, then single modules by cumulative time
+    packages = defaultdict(float)
+    for module, values in times.items():
+        packages[module.split(".")[0]] += statistics.median(value[0] for value in values)
+
+    print(f"\n{'package':<40}{'self (ms)':>12}")
+    for package, self_ms in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+        print(f"{package:<40}{self_ms:>12.1f}")
+
+    print(f"\n{'module':<40}{'cumulative (ms)':>16}{'self (ms)':>12}{'depth':>7}")
+    medians = [
+        (module, statistics.median(value[1] for value in values), statistics.median(value[0] for value in values),
+         values[0][2])
+        for module, values in times.items()
+    ]
+    for module, cumulative_ms, self_ms, depth in sorted(medians, key=lambda item: -item[1])[:top]:
+        print(f"{module:<40}{cumulative_ms:>16.1f}{self_ms:>12.1f}{depth:>7}")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -1,13 +1,77 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
+from contextlib import contextmanager
 from os import environ
+import threading
+import time
 
 uri = environ.get("DATABASE_URL").replace("postgres://", "postgresql://")
-engine = create_engine(uri)
+
+# Connection pool per process (every gunicorn worker has its own), see README for the settings
+engine = create_engine(
+    uri,
+    pool_size=int(environ.get("DB_POOL_SIZE", 10)),
+    max_overflow=int(environ.get("DB_MAX_OVERFLOW", 5)),
+    pool_timeout=float(environ.get("DB_POOL_TIMEOUT", 30)),
+    pool_recycle=int(environ.get("DB_POOL_RECYCLE", 1800)),
+    pool_pre_ping=environ.get("DB_POOL_PRE_PING", "true").lower() == "true"
+)
 Session = sessionmaker(engine)
 Base = declarative_base()
 
+# Checkout statistics of read_only_connection, see get_pool_stats
+_stats_lock = threading.Lock()
+_stats = {"waiting": 0, "checkouts": 0, "checkout_time": 0.0, "max_checkout_time": 0.0}
+
 
 def init_db():
+    # partitions imports the models, so that all tables are known; the flight table needs its monthly partitions
+    from partitions import create_partitions
     Base.metadata.create_all(engine)
+    create_partitions()
+
+
+@contextmanager
+def read_only_connection(**execution_options):
+    """
+    Check out a pooled connection for read-only queries and return it to the pool when the block ends
+    """
+    with _stats_lock:
+        _stats["waiting"] += 1
+    start = time.perf_counter()
+    try:
+        connection = engine.connect()
+    finally:
+        elapsed = time.perf_counter() - start
+        with _stats_lock:
+            _stats["waiting"] -= 1
+            _stats["checkouts"] += 1
+            _stats["checkout_time"] += elapsed
+            _stats["max_checkout_time"] = max(_stats["max_checkout_time"], elapsed)
+
+    try:
+        yield connection.execution_options(postgresql_readonly=True, **execution_options)
+    finally:
+        connection.close()
+
+
+def get_pool_stats():
+    """
+    Pool usage of this process: connections checked out and idle, threads waiting for a connection and the
+    average and maximum checkout latency in milliseconds
+    """
+    pool = engine.pool
+    with _stats_lock:
+        stats = dict(_stats)
+
+    return {
+        "pool_size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "waiting": stats["waiting"],
+        "checkouts": stats["checkouts"],
+        "checkout_ms_avg": round(1000 * stats["checkout_time"] / max(stats["checkouts"], 1), 3),
+        "checkout_ms_max": round(1000 * stats["max_checkout_time"], 3)
+    }
@@ -1,5 +1,4 @@
 import numpy as np
-import plotly.express as px
 
 
 kpi = [
@@ -9,6 +8,9 @@ kpi = [
 
 
 def create_corr_heatmap(df, method):
+    # plotly.express is slow to import, so it is loaded with the first figure instead of at startup
+    import plotly.express as px
+
     # Create correlation matrix
     df_corr = df[["kpi1", "kpi2", "kpi3", "kpi4", "kpi5", "kpi6", "kpi7", "kpi8"]].corr(method=method)
 
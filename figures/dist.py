@@ -1,5 +1,5 @@
+import numpy as np
 import plotly.graph_objects as go
-import scipy.stats as stats
 import pandas as pd
 
 from config.kpi_config import kpi_config
@@ -10,7 +10,9 @@ def create_dist(df, kpi):
     if kpi == "all":
         # Normalize values
         columns = ["kpi1", "kpi2", "kpi3", "kpi4", "kpi5", "kpi6", "kpi7", "kpi8"]
-        np_z = stats.zscore(df[columns])
+        values = df[columns].to_numpy(dtype=float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            np_z = (values - values.mean(axis=0)) / values.std(axis=0)
         df_z = pd.DataFrame(data=np_z, columns=columns)
 
         # Add trace per indicator
@@ -1,6 +1,3 @@
-import plotly.express as px
-
-
 kpi = [
     "Flights (GAP)", "Airlines (GAP)", "Destinations", "Flights (ODP)",
     "Airlines (ODP)", "Flight Duration", "Stops", "Layover Time"
@@ -8,6 +5,9 @@ kpi = [
 
 
 def create_heatmap(df):
+    # plotly.express is slow to import, so it is loaded with the first figure instead of at startup
+    import plotly.express as px
+
     df = df.set_index("airport")
 
     # Create customdata
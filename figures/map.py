@@ -4,7 +4,7 @@ import dash_mantine_components as dmc
 from dash import dcc
 from os import environ
 
-from utils.map_utils import get_map_lines, get_map_markers
+from utils.map_utils import get_map_lines, get_map_markers, get_map_traces
 
 MAPBOX_KEY = environ.get("MAPBOX_KEY")
 MAPBOX_STYLE = environ.get("MAPBOX_STYLE")
@@ -15,22 +15,21 @@ config = {
 }
 
 
-def create_map(df_flights, df_airports):
-    # Get map lines and map markers
-    df_map_lines = get_map_lines(df_flights, df_airports)
-    df_map_markers = get_map_markers(df_map_lines, df_airports)
+def create_map(df_flights, df_airports, top=10):
+    # Get map lines (first top itineraries) and map markers
+    df_map_lines = get_map_lines(df_flights, df_airports, top)
+    df_map_markers = get_map_markers(df_map_lines)
 
     # Create map
     fig = go.Figure()
-    grouped = df_map_lines.groupby("flight", sort=False)
 
-    # Create lines (flight paths)
-    for name, group in grouped:
+    # Create lines (flight paths), one per itinerary
+    for trace in get_map_traces(df_map_lines):
         fig.add_trace(
             go.Scattermapbox(
                 mode="lines",
-                lon=group.lon,
-                lat=group.lat,
+                lon=trace["lon"],
+                lat=trace["lat"],
                 legendgrouptitle={
                     "text": "Flights",
                     "font": {
@@ -39,9 +38,9 @@ def create_map(df_flights, df_airports):
                     },
                 },
                 line={
-                    "color": group.color.iloc[0]
+                    "color": trace["color"]
                 },
-                name=name,
+                name=trace["flight"],
             )
         )
 
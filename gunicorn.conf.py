@@ -0,0 +1,11 @@
+from os import environ
+from dotenv import load_dotenv
+
+
+# gunicorn settings (see Procfile)
+def when_ready(server):
+    # Check the indexes once in the master, before the workers are forked (not in every worker's boot)
+    load_dotenv()
+    if environ.get("INDEX_CHECK", "true").lower() == "true":
+        from indexes import log_index_problems
+        log_index_problems(server.log)
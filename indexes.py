@@ -0,0 +1,161 @@
+from datetime import datetime, timedelta
+from sqlalchemy import select, func, text, inspect
+from sqlalchemy.orm import aliased
+import pytz
+import re
+from db import engine, Base
+from models import Flight, Airport
+
+
+# Tables whose planner statistics are refreshed by create_indexes
+ANALYZE_TABLES = ["flight", "flight_daily", "flight_connection", "airport", "airline"]
+
+# Below this many flights the planner prefers sequential scans anyway, so the query plans are not checked
+MIN_PLAN_ROWS = 100000
+
+
+def get_declared_indexes():
+    """
+    Indexes declared in models.py, for the tables that exist in the database
+    """
+    tables = set(inspect(engine).get_table_names())
+    return [index for table in Base.metadata.sorted_tables if table.name in tables for index in table.indexes]
+
+
+def get_definition(index):
+    """
+    Access method, key columns and included columns of a declared index
+    """
+    options = index.dialect_options["postgresql"]
+    return options["using"] or "btree", [column.name for column in index.columns], list(options["include"] or [])
+
+
+def get_existing_definitions(connection):
+    """
+    Access method, key columns and included columns of all indexes in the database, by index name
+    """
+    stmt = text(
+        "select i.relname, am.amname, x.indnkeyatts, "
+        "array(select a.attname from unnest(x.indkey) with ordinality k(attnum, n) "
+        "join pg_attribute a on a.attrelid = x.indrelid and a.attnum = k.attnum order by k.n) "
+        "from pg_index x join pg_class i on i.oid = x.indexrelid join pg_am am on am.oid = i.relam "
+        "join pg_namespace s on s.oid = i.relnamespace where s.nspname = current_schema()"
+    )
+    return {
+        name: (method, columns[:keys], columns[keys:])
+        for name, method, keys, columns in connection.execute(stmt)
+    }
+
+
+def verify_indexes(connection):
+    """
+    Status of every declared index: "ok", "missing" or "different" (exists with another definition)
+    """
+    existing = get_existing_definitions(connection)
+    status = {}
+    for index in get_declared_indexes():
+        if index.name not in existing:
+            status[index] = "missing"
+        elif existing[index.name] != tuple(get_definition(index)):
+            status[index] = "different"
+        else:
+            status[index] = "ok"
+    return status
+
+
+def create_indexes(rebuild=False):
+    """
+    Create the missing indexes (and with rebuild, recreate the ones with another definition), then ANALYZE the
+    tables. On the partitioned flight table, the index is created on every partition. Returns the index status
+    before the changes.
+    """
+    with engine.connect() as connection:
+        status = verify_indexes(connection)
+
+    for index, state in status.items():
+        if state == "missing" or (state == "different" and rebuild):
+            with engine.begin() as connection:
+                if state == "different":
+                    index.drop(connection)
+                index.create(connection)
+            print("Created", index.name)
+
+    tables = set(inspect(engine).get_table_names())
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        for table in ANALYZE_TABLES:
+            if table in tables:
+                connection.execute(text(f"analyze {table}"))
+
+    return status
+
+
+def get_plan_statements(connection):
+    """
+    A one-day search and the airport KPIs of that day for the busiest airport of the last loaded day, or an
+    empty list if there are too few flights for a meaningful plan
+    """
+    from lib.flights import get_sql, get_airport_ids
+    from lib.gap import get_gap_stmt
+
+    rows = connection.execute(text(
+        "select coalesce(sum(c.reltuples), 0) from pg_class c "
+        "where (c.oid = to_regclass('flight') and c.relkind = 'r') or c.oid in (select inhrelid from pg_inherits "
+        "where inhparent = to_regclass('flight'))"
+    )).scalar()
+    if rows < MIN_PLAN_ROWS:
+        return []
+
+    last = connection.execute(select(func.max(Flight.firstseen))).scalar()
+    start = pytz.utc.localize(datetime.combine(last.astimezone(pytz.utc).date(), datetime.min.time()))
+    end = start + timedelta(days=1) - timedelta(seconds=1)
+    airport = connection.execute(
+        select(Airport.airport_ident).
+        join(Flight, Flight.origin_id == Airport.airport_id).
+        where(Flight.firstseen.between(start, end)).
+        group_by(Airport.airport_ident).
+        order_by(func.count().desc()).
+        limit(1)
+    ).scalar()
+
+    statements = list(get_sql([airport], [airport], start, end, 6))
+    statements.append(get_gap_stmt(aliased(Flight), get_airport_ids([airport]), start, end))
+    return statements
+
+
+def check_indexes():
+    """
+    Warnings for missing indexes and for sequential scans of the flights in the plans of the main queries
+    """
+    problems = []
+    with engine.connect() as connection:
+        for index, state in verify_indexes(connection).items():
+            if state != "ok":
+                problems.append(f"Index {index.name} on {index.table.name} is {state}")
+
+        for stmt in get_plan_statements(connection):
+            compiled = stmt.compile(engine, compile_kwargs={"render_postcompile": True})
+            cursor = connection.connection.cursor()
+            cursor.execute("explain " + str(compiled), compiled.params)
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+            for table in sorted(set(re.findall(r"Seq Scan on (flight\w*)", plan))):
+                problem = f"Sequential scan of {table} in the plans of the flight search"
+                if problem not in problems:
+                    problems.append(problem)
+
+    if problems:
+        problems.append("Run python -m loaders.create_indexes to create the indexes and update the statistics")
+    return problems
+
+
+def log_index_problems(logger):
+    """
+    Log the warnings of check_indexes, then close the pooled connections: the gunicorn master runs the check
+    before it forks the workers (see gunicorn.conf.py), which must not share its connections
+    """
+    try:
+        for problem in check_indexes():
+            logger.warning(problem)
+    except Exception as error:
+        logger.warning("Index check failed: %s", error)
+    finally:
+        engine.dispose()
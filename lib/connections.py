@@ -0,0 +1,74 @@
+from sqlalchemy import select, func, delete, insert, extract, Integer
+from sqlalchemy.orm import aliased
+from datetime import datetime, time, timedelta
+import pytz
+from db import engine, read_only_connection
+from models import Flight, FlightConnection
+
+
+# Layover window of the materialized connections; 24 hours is the maximum layover in the form
+MIN_LAYOVER = timedelta(hours=1)
+MAX_LAYOVER = timedelta(hours=24)
+
+
+def get_days(day_from=None, day_to=None):
+    """
+    Days (UTC) between day_from and day_to, defaulting to the first and last day in the flight table
+    """
+    if day_from is None or day_to is None:
+        with read_only_connection() as connection:
+            first, last = connection.execute(select(func.min(Flight.firstseen), func.max(Flight.firstseen))).one()
+        if first is None:
+            return []
+        day_from = day_from or first.astimezone(pytz.utc).date()
+        day_to = day_to or last.astimezone(pytz.utc).date()
+
+    return [day_from + timedelta(days=i) for i in range((day_to - day_from).days + 1)]
+
+
+def refresh_connections(day_from=None, day_to=None):
+    """
+    Rebuild the one-stop connections whose first flight departs between day_from and day_to (all days if not
+    set). Every day is replaced in its own transaction. Returns the number of connections written per day.
+    """
+    a = aliased(Flight)
+    b = aliased(Flight)
+    r = FlightConnection.__table__
+
+    with engine.begin() as connection:
+        r.create(connection, checkfirst=True)
+
+    rows = {}
+    for day in get_days(day_from, day_to):
+        start = pytz.utc.localize(datetime.combine(day, time.min))
+        end = start + timedelta(days=1)
+
+        stmt = \
+            select(
+              a.flight_id, b.flight_id, a.origin, a.destination, b.destination, a.firstseen,
+              func.cast(extract("epoch", b.firstseen - a.lastseen), Integer),
+              func.cast(extract("epoch", b.lastseen - a.firstseen), Integer)
+            ).\
+            join(b, a.destination_id == b.origin_id).\
+            where(
+              a.firstseen >= start,
+              a.firstseen < end,
+              a.origin.is_not(None),
+              b.destination.is_not(None),
+              # b departs after a has landed, so the partitions before the day can be skipped
+              b.firstseen >= start + MIN_LAYOVER,
+              b.firstseen.between(a.lastseen + MIN_LAYOVER, a.lastseen + MAX_LAYOVER)
+            )
+
+        with engine.begin() as connection:
+            connection.execute(delete(r).where(r.c.firstseen >= start, r.c.firstseen < end))
+            result = connection.execute(
+                insert(r).from_select(
+                    ["first_flight_id", "second_flight_id", "origin", "hub", "destination", "firstseen",
+                     "layover_s", "total_s"],
+                    stmt
+                )
+            )
+        rows[day] = result.rowcount
+
+    return rows
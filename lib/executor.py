@@ -0,0 +1,38 @@
+from concurrent.futures import ThreadPoolExecutor
+from os import environ
+import pandas as pd
+from db import read_only_connection
+
+
+# Statements run on their own pooled connection, so keep QUERY_THREADS below the size of the pool
+# (DB_POOL_SIZE). Tasks (functions that send statements themselves) get a separate pool so that
+# a task waiting for its statements never blocks the threads those statements need.
+QUERY_THREADS = int(environ.get("QUERY_THREADS", 10))
+TASK_THREADS = int(environ.get("TASK_THREADS", 4))
+
+_query_executor = ThreadPoolExecutor(max_workers=QUERY_THREADS, thread_name_prefix="query")
+_task_executor = ThreadPoolExecutor(max_workers=TASK_THREADS, thread_name_prefix="task")
+
+
+def read_sql(stmt):
+    """
+    Run one statement on a pooled connection and return the result as a dataframe
+    """
+    with read_only_connection() as connection:
+        return pd.read_sql(stmt, connection)
+
+
+def read_sql_all(statements):
+    """
+    Run the statements at the same time and return their dataframes in the same order
+    """
+    futures = [_query_executor.submit(read_sql, stmt) for stmt in statements]
+    return [future.result() for future in futures]
+
+
+def run_all(tasks):
+    """
+    Run the (function, args) tasks at the same time and return their results in the same order
+    """
+    futures = [_task_executor.submit(function, *args) for function, args in tasks]
+    return [future.result() for future in futures]
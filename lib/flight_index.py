@@ -0,0 +1,187 @@
+from sqlalchemy import select
+from sqlalchemy.orm import aliased
+import pandas as pd
+import numpy as np
+import threading
+from db import read_only_connection
+from models import Flight
+
+
+# Resident copy of the flight table, loaded on first use (see load_flight_index)
+_index = None
+_index_lock = threading.Lock()
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+
+def encode(values, lookup):
+    """
+    Map values to integer codes, adding unseen values to lookup
+    """
+    for value in pd.unique(values):
+        if value not in lookup:
+            lookup[value] = len(lookup)
+    return pd.Series(values).map(lookup).to_numpy(dtype=np.int32)
+
+
+def load_flight_index(chunksize=500000):
+    """
+    Load the flight table into columnar NumPy arrays sorted by (origin, firstseen)
+    """
+    global _index
+
+    a = aliased(Flight)
+    stmt = select(
+        a.airline_prefix.label("airline"), a.origin, a.destination, a.firstseen, a.lastseen
+    )
+
+    with read_only_connection(stream_results=True) as connection:
+        _index = build_flight_index(pd.read_sql(stmt, connection, chunksize=chunksize))
+
+    return _index
+
+
+def build_flight_index(dfs):
+    """
+    Build the index from dataframes with the columns airline, origin, destination, firstseen and lastseen
+    """
+    airport_codes = {}
+    airline_codes = {}
+    chunks = {"origin": [], "destination": [], "airline": [], "firstseen": [], "lastseen": []}
+
+    for df in dfs:
+        df = df.dropna(subset=["origin", "destination", "firstseen", "lastseen"])
+        chunks["airline"].append(encode(df["airline"].fillna("").to_numpy(), airline_codes))
+        chunks["origin"].append(encode(df["origin"].to_numpy(), airport_codes))
+        chunks["destination"].append(encode(df["destination"].to_numpy(), airport_codes))
+        chunks["firstseen"].append(to_epoch(df["firstseen"]))
+        chunks["lastseen"].append(to_epoch(df["lastseen"]))
+
+    arrays = {key: np.concatenate(value) if value else np.empty(0, dtype=np.int64) for key, value in chunks.items()}
+
+    # Renumber the codes alphabetically so that sorting by code equals sorting by name
+    airport_rank, airports = sort_codes(airport_codes)
+    airline_rank, airlines = sort_codes(airline_codes)
+    arrays["origin"] = airport_rank[arrays["origin"]]
+    arrays["destination"] = airport_rank[arrays["destination"]]
+    arrays["airline"] = airline_rank[arrays["airline"]]
+
+    # Sort by (origin, firstseen) and combine both into one searchable key
+    order = np.lexsort((arrays["firstseen"], arrays["origin"]))
+    index = {key: value[order] for key, value in arrays.items()}
+    index["key"] = (index["origin"].astype(np.int64) << 32) + index["firstseen"]
+    index["airports"] = airports
+    index["airlines"] = airlines
+    index["airport_codes"] = {airport: code for code, airport in enumerate(airports)}
+
+    # Distinct (origin, destination) pairs, used to prune connections that cannot reach the destination
+    routes = np.unique((index["origin"].astype(np.int64) << 32) | index["destination"])
+    index["routes"] = (routes >> 32, routes & 0xFFFFFFFF)
+
+    return index
+
+
+def sort_codes(lookup):
+    """
+    Return the alphabetical rank per code and the sorted values of lookup
+    """
+    values = np.array(list(lookup), dtype=object)
+    order = np.argsort(values)
+    rank = np.empty(len(order), dtype=np.int32)
+    rank[order] = np.arange(len(order), dtype=np.int32)
+    return rank, values[order]
+
+
+def get_flight_index():
+    """
+    Return the resident flight index, loading it on first use
+    """
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                load_flight_index()
+    return _index
+
+
+def to_epoch(column):
+    """
+    Convert a datetime series to int64 epoch seconds
+    """
+    return pd.to_datetime(column, utc=True).to_numpy(dtype="datetime64[s]").astype(np.int64)
+
+
+def expand(lo, hi):
+    """
+    Expand the half-open ranges [lo, hi) into (owner, position) pairs
+    """
+    counts = np.clip(hi - lo, 0, None)
+    owner = np.repeat(np.arange(len(lo)), counts)
+    offset = np.repeat(np.cumsum(counts) - counts, counts)
+    position = np.arange(counts.sum()) - offset + np.repeat(lo, counts)
+    return owner, position
+
+
+def find_departures(index, airports, dep_from, dep_to):
+    """
+    Binary search the legs departing from airports[i] between dep_from[i] and dep_to[i] (inclusive)
+    """
+    airports = airports.astype(np.int64) << 32
+    lo = np.searchsorted(index["key"], airports + dep_from, side="left")
+    hi = np.searchsorted(index["key"], airports + dep_to, side="right")
+    return expand(lo, hi)
+
+
+def get_legs(index, positions, suffix):
+    """
+    Build the columns of one leg in the same shape as the SQL result
+    """
+    return {
+        "callsign" + suffix: index["airlines"][index["airline"][positions]],
+        "origin" + suffix: index["airports"][index["origin"][positions]],
+        "destination" + suffix: index["airports"][index["destination"][positions]],
+        "firstseen" + suffix: pd.to_datetime(index["firstseen"][positions], unit="s", utc=True),
+        "lastseen" + suffix: pd.to_datetime(index["lastseen"][positions], unit="s", utc=True)
+    }
+
+
+def get_itineraries(index, paths):
+    """
+    Convert leg positions (one array per leg) into a dataframe sorted like the SQL statements
+    """
+    sort_keys = []
+    for positions in reversed(paths):
+        sort_keys += [
+            index["lastseen"][positions], index["firstseen"][positions], index["destination"][positions],
+            index["origin"][positions], index["airline"][positions]
+        ]
+    order = np.lexsort(sort_keys) if len(paths[0]) else np.empty(0, dtype=np.int64)
+
+    columns = {}
+    for leg, positions in enumerate(paths):
+        suffix = "" if leg == 0 else "_" + str(leg)
+        columns.update(get_legs(index, positions[order], suffix))
+    return pd.DataFrame(columns)
+
+
+def get_airport_codes(index, airports):
+    """
+    Integer codes of the given airports (airports without flights are skipped)
+    """
+    codes = index["airport_codes"]
+    return np.array([codes[airport] for airport in airports if airport in codes], dtype=np.int64)
+
+
+def get_distance_to(index, destination_codes, max_legs):
+    """
+    Minimum number of legs from every airport to one of the destinations (max_legs + 1 if not reachable)
+    """
+    distance = np.full(len(index["airports"]), max_legs + 1)
+    distance[destination_codes] = 0
+    route_origin, route_destination = index["routes"]
+
+    for legs in range(1, max_legs):
+        reached = route_origin[distance[route_destination] == legs - 1]
+        distance[reached] = np.minimum(distance[reached], legs)
+
+    return distance
@@ -2,12 +2,27 @@ from sqlalchemy import select, func, Interval
 from sqlalchemy.sql.functions import concat
 from sqlalchemy.orm import aliased
 import pandas as pd
-from db import Session
-from models import Flight
+from db import read_only_connection
+from models import Flight, FlightConnection, Airport
+from lib.executor import read_sql_all
+from lib.flight_index import HOUR, DAY, build_flight_index, get_flight_index, get_airport_codes, \
+    get_distance_to, find_departures, get_itineraries
+from datetime import timedelta
+from itertools import islice, repeat
+from os import environ
+import heapq
 import numpy as np
 import warnings
 warnings.simplefilter(action="ignore", category=pd.errors.PerformanceWarning)
 
+# "sql" runs the self-joins in the database, "connections" reads the first two legs from the materialized
+# one-stop connections (see lib/connections.py), "index" searches the resident in-memory flight index
+FLIGHT_BACKEND = environ.get("FLIGHT_BACKEND", "sql")
+
+# Partial paths the in-memory search extends per level at most, and per step (see search_connections)
+SEARCH_MAX_PATHS = int(environ.get("SEARCH_MAX_PATHS", 20000))
+SEARCH_CHUNK_PATHS = int(environ.get("SEARCH_CHUNK_PATHS", 2000))
+
 
 """
 pd.set_option('display.max_rows', None)
@@ -17,13 +32,19 @@ pd.set_option('display.max_colwidth', None)
 """
 
 
-def get_sql(origin, destination, start, end, stop_duration):
+def get_sql(origin, destination, start, end, stop_duration, flight_duration=None, flight_filter="all",
+            sort_by="dur", limit=None):
     """
-    Prepare the SQL statements for the flights based on the input parameters
+    Prepare the SQL statements for the flights based on the input parameters. If flight_duration (hours) is
+    given, longer itineraries are dropped in the database. With flight_filter "unique", only the fastest
+    itinerary per route is returned. With a limit, every statement returns only its first limit itineraries
+    according to sort_by.
     """
     a = aliased(Flight)
     b = aliased(Flight)
     c = aliased(Flight)
+    origin_ids = get_airport_ids(origin)
+    destination_ids = get_airport_ids(destination)
 
     stmt0stop = \
         select(
@@ -31,8 +52,8 @@ def get_sql(origin, destination, start, end, stop_duration):
         ).\
         where(
           a.firstseen.between(start, end),
-          a.destination.in_(destination),
-          a.origin.in_(origin)
+          a.destination_id.in_(destination_ids),
+          a.origin_id.in_(origin_ids)
         ).\
         order_by(
           a.callsign, a.origin, a.destination, a.firstseen, a.lastseen
@@ -43,19 +64,19 @@ def get_sql(origin, destination, start, end, stop_duration):
           a.callsign, a.origin, a.destination, a.firstseen, a.lastseen,
           b.callsign, b.origin, b.destination, b.firstseen, b.lastseen
         ).\
-        join(b, a.destination == b.origin).\
+        join(b, a.destination_id == b.origin_id).\
         where(
           a.firstseen.between(start, end),
           b.firstseen.between(
             start,
-            end + func.cast(concat(1, ' DAYS'), Interval)
+            end + timedelta(days=1)
           ),
           b.firstseen.between(
             a.lastseen + func.cast(concat(1, ' HOURS'), Interval),
             a.lastseen + func.cast(concat(stop_duration, ' HOURS'), Interval)
           ),
-          b.destination.in_(destination),
-          a.origin.in_(origin)
+          b.destination_id.in_(destination_ids),
+          a.origin_id.in_(origin_ids)
         ).\
         order_by(
           a.callsign, a.origin, a.destination, a.firstseen, a.lastseen,
@@ -68,17 +89,17 @@ def get_sql(origin, destination, start, end, stop_duration):
           b.callsign, b.origin, b.destination, b.firstseen, b.lastseen,
           c.callsign, c.origin, c.destination, c.firstseen, c.lastseen
         ).\
-        join(b, a.destination == b.origin).\
-        join(c, b.destination == c.origin).\
+        join(b, a.destination_id == b.origin_id).\
+        join(c, b.destination_id == c.origin_id).\
         where(
           a.firstseen.between(start, end),
           b.firstseen.between(
             start,
-            end + func.cast(concat(1, ' DAYS'), Interval)
+            end + timedelta(days=1)
           ),
           c.firstseen.between(
             start,
-            end + func.cast(concat(2, ' DAYS'), Interval)
+            end + timedelta(days=2)
           ),
           b.firstseen.between(
             a.lastseen + func.cast(concat(1, ' HOURS'), Interval),
@@ -88,8 +109,8 @@ def get_sql(origin, destination, start, end, stop_duration):
             b.lastseen + func.cast(concat(1, ' HOURS'), Interval),
             b.lastseen + func.cast(concat(stop_duration, ' HOURS'), Interval)
           ),
-          c.destination.in_(destination),
-          a.origin.in_(origin)
+          c.destination_id.in_(destination_ids),
+          a.origin_id.in_(origin_ids)
         ).\
         order_by(
           a.callsign, a.origin, a.destination, a.firstseen, a.lastseen,
@@ -97,261 +118,666 @@ def get_sql(origin, destination, start, end, stop_duration):
           c.callsign, c.origin, c.destination, c.firstseen, c.lastseen
         )
 
+    if FLIGHT_BACKEND == "connections":
+        stmt1stop, stmt2stop = get_connection_sql(a, b, c, origin, destination, start, end, stop_duration)
+
+    if flight_duration is not None:
+        # Drop itineraries that take longer than flight_duration
+        max_duration = func.cast(concat(flight_duration, ' HOURS'), Interval)
+        stmt0stop = stmt0stop.where(a.lastseen - a.firstseen <= max_duration)
+        stmt1stop = stmt1stop.where(b.lastseen - a.firstseen <= max_duration)
+        stmt2stop = stmt2stop.where(c.lastseen - a.firstseen <= max_duration)
+
+    if flight_filter == "unique":
+        # Keep the fastest itinerary per route (f1_airport_from, f2_airport_from, f3_airport_from, f3_airport_to)
+        stmt0stop = get_unique(stmt0stop, [a.origin_id], a.lastseen - a.firstseen)
+        stmt1stop = get_unique(stmt1stop, [a.origin_id, b.origin_id], b.lastseen - a.firstseen)
+        stmt2stop = get_unique(
+            stmt2stop, [a.origin_id, b.origin_id, c.origin_id, c.destination_id], c.lastseen - a.firstseen
+        )
+
+    if limit is not None:
+        # Only the first itineraries per stop level are needed, the levels are combined in merge_top_k
+        stmt0stop, stmt1stop, stmt2stop = [
+            get_top(stmt, sort_by, limit, flight_filter == "unique") for stmt in [stmt0stop, stmt1stop, stmt2stop]
+        ]
+
     return stmt0stop, stmt1stop, stmt2stop
 
 
-def get_timedelta(tsd_from, tsd_to, convert=False):
+def get_airport_ids(airports):
     """
-    Get the timedelta between tsd_to and tsd_from. Convert to "x hr y min" if needed
+    Ids of the airports with the given ICAO codes, to filter flights on origin_id/destination_id
     """
-    duration = (tsd_to - tsd_from).dt.total_seconds()
-    if convert:
-        duration = convert_duration(duration)
-    return duration
+    return select(Airport.airport_id).where(Airport.airport_ident.in_(airports))
 
 
-def convert_duration(duration):
+def get_connection_sql(a, b, c, origin, destination, start, end, stop_duration):
     """
-    Convert duration in seconds to "x hr y min"
+    Same 1-stop and 2-stop statements as in get_sql, but the first two legs come from an indexed range lookup
+    in flight_connection instead of a self-join. Only valid for stop_duration <= 24 (see MAX_LAYOVER). The
+    departure window is repeated on a (equal to k.firstseen), so that only its flight partitions are read.
     """
-    irrelevant_seconds = duration % 60
-    duration = duration - irrelevant_seconds
-    hrs, mins = divmod(duration / 60, 60)
-    hrs = hrs.astype("Int64").astype(str)
-    mins = mins.astype("Int64").astype(str)
+    k = aliased(FlightConnection)
 
-    dur_formatted = hrs + " hr " + mins + " min"
-    dur_formatted = dur_formatted.replace(r"\A0 hr ", "", regex=True)
-    dur_formatted = dur_formatted.replace(r"<NA> hr <NA> min", np.nan, regex=True)
-    return dur_formatted
+    stmt1stop = \
+        select(
+          a.callsign, a.origin, a.destination, a.firstseen, a.lastseen,
+          b.callsign, b.origin, b.destination, b.firstseen, b.lastseen
+        ).\
+        select_from(k).\
+        join(a, a.flight_id == k.first_flight_id).\
+        join(b, b.flight_id == k.second_flight_id).\
+        where(
+          k.firstseen.between(start, end),
+          a.firstseen.between(start, end),
+          k.origin.in_(origin),
+          k.destination.in_(destination),
+          k.layover_s <= stop_duration * 3600,
+          b.firstseen.between(
+            start,
+            end + timedelta(days=1)
+          )
+        ).\
+        order_by(
+          a.callsign, a.origin, a.destination, a.firstseen, a.lastseen,
+          b.callsign, b.origin, b.destination, b.firstseen, b.lastseen
+        )
+
+    stmt2stop = \
+        select(
+          a.callsign, a.origin, a.destination, a.firstseen, a.lastseen,
+          b.callsign, b.origin, b.destination, b.firstseen, b.lastseen,
+          c.callsign, c.origin, c.destination, c.firstseen, c.lastseen
+        ).\
+        select_from(k).\
+        join(a, a.flight_id == k.first_flight_id).\
+        join(b, b.flight_id == k.second_flight_id).\
+        join(c, b.destination_id == c.origin_id).\
+        where(
+          k.firstseen.between(start, end),
+          a.firstseen.between(start, end),
+          k.origin.in_(origin),
+          k.layover_s <= stop_duration * 3600,
+          b.firstseen.between(
+            start,
+            end + timedelta(days=1)
+          ),
+          c.firstseen.between(
+            start,
+            end + timedelta(days=2)
+          ),
+          c.firstseen.between(
+            b.lastseen + func.cast(concat(1, ' HOURS'), Interval),
+            b.lastseen + func.cast(concat(stop_duration, ' HOURS'), Interval)
+          ),
+          c.destination.in_(destination)
+        ).\
+        order_by(
+          a.callsign, a.origin, a.destination, a.firstseen, a.lastseen,
+          b.callsign, b.origin, b.destination, b.firstseen, b.lastseen,
+          c.callsign, c.origin, c.destination, c.firstseen, c.lastseen
+        )
+
+    return stmt1stop, stmt2stop
 
 
-def get_airline_code(df, column, none_value):
+def get_unique(stmt, route, duration):
     """
-    Return airline code
+    Keep only the first row per route when ordered by duration (ties are broken by the selected columns)
     """
-    col_exists = check_if_exists(df, column, none_value)
-    if col_exists.isnull().values.all():
-        return np.nan
-    else:
-        return col_exists.str[:3]
+    return stmt.\
+        order_by(None).\
+        distinct(*route).\
+        order_by(*route, duration, *stmt.selected_columns)
 
 
-def check_if_exists(df, column, none_value):
+def get_top(stmt, sort_by, limit, distinct=False):
     """
-    Check if column exists in df; if yes, return the column as a series, if not, return NaN/NaT
+    Order the itineraries of stmt by sort_by ("dur", "dep", "arr" or "stp") and keep the first limit rows.
+    The order of a DISTINCT ON statement is needed to pick the rows, otherwise it is dropped.
     """
-    if column in df.columns:
-        if none_value == "NaT":
-            return pd.to_datetime(df[column])
-        else:
-            return df[column]
+    if not distinct:
+        stmt = stmt.order_by(None)
+    subquery = stmt.subquery()
+    columns = list(subquery.c)
+
+    # callsign, origin, destination, firstseen, lastseen per leg
+    firstseen = columns[3]
+    lastseen = columns[-1]
+    duration = lastseen - firstseen
+
+    if sort_by == "dep":
+        keys = [firstseen, duration]
+    elif sort_by == "arr":
+        keys = [lastseen, duration]
     else:
-        if none_value == "NaT":
-            return pd.Series(pd.to_datetime(np.nan))
+        # "stp" has the same stop count for all rows of a statement
+        keys = [duration]
+
+    return select(subquery).order_by(*keys, *columns).limit(limit)
+
+
+def merge_top_k(frames, sort_by, limit):
+    """
+    Combine the per stop level results (each sorted by sort_by) into the first limit itineraries
+    """
+    def get_keys(stops, df, offset):
+        # (sort key, position in the combined dataframe) per row
+        last = "" if stops == 0 else "_" + str(stops)
+        duration = (df["lastseen" + last] - df["firstseen"]).dt.total_seconds()
+        if sort_by == "dep":
+            keys = zip(df["firstseen"], duration)
+        elif sort_by == "arr":
+            keys = zip(df["lastseen" + last], duration)
+        elif sort_by == "stp":
+            keys = zip(repeat(stops), duration)
         else:
-            return pd.Series(np.nan)
+            keys = zip(duration)
+        return zip(keys, range(offset, offset + len(df)))
 
+    offsets = np.cumsum([0] + [len(df) for df in frames])
+    merged = heapq.merge(*[get_keys(stops, df, offsets[stops]) for stops, df in enumerate(frames)])
+    positions = [position for key, position in islice(merged, limit)]
 
-def convert_time(column):
+    return pd.concat(frames).iloc[positions]
+
+
+def get_flights_from_sql(origin, destination, start, end, stop_duration, max_stops, flight_duration=None,
+                         flight_filter="all", sort_by="dur", limit=None):
     """
-    Convert datetime to HH:MM format
+    Get the flights from the database and combine them into one dataframe
     """
-    if column.isnull().values.all():
-        return column
-    else:
-        column = pd.to_datetime(column).dt.strftime("%H:%M")
-        return column
+    statements = get_sql(
+        origin, destination, start, end, stop_duration, flight_duration, flight_filter, sort_by, limit
+    )
 
+    # Send the statements of all stop levels at the same time
+    frames = read_sql_all(statements[:max_stops + 1])
 
-def get_flights(origin, destination, start, end, stop_duration, max_stops, flight_filter="unique"):
-    # Get the flights and combine them into df_all
-    stmt0stop, stmt1stop, stmt2stop = get_sql(origin, destination, start, end, stop_duration)
-    session = Session()
-
-    if max_stops == 0:
-        df_0stop = pd.read_sql(stmt0stop, session.bind)
-        df_all = df_0stop
-    elif max_stops == 1:
-        df_0stop = pd.read_sql(stmt0stop, session.bind)
-        df_1stop = pd.read_sql(stmt1stop, session.bind)
-        df_all = pd.concat([df_0stop, df_1stop])
+    if limit is not None:
+        df_all = merge_top_k(frames, sort_by, limit)
     else:
-        df_0stop = pd.read_sql(stmt0stop, session.bind)
-        df_1stop = pd.read_sql(stmt1stop, session.bind)
-        df_2stop = pd.read_sql(stmt2stop, session.bind)
-        df_all = pd.concat([df_0stop, df_1stop, df_2stop])
+        df_all = pd.concat(frames)
 
-    df_all = df_all.reset_index(drop=True)
+    return df_all
 
-    df_formatted_columns = [
-        "f1_airline_code", "f1_airport_from", "f1_airport_to",
-        "f1_time_from", "f1_time_from_str", "f1_time_to", "f1_time_to_str",
-        "f1_duration", "f1_duration_s",
 
-        "f2_airline_code", "f2_airport_from", "f2_airport_to",
-        "f2_time_from", "f2_time_from_str", "f2_time_to", "f2_time_to_str",
-        "f2_duration", "f2_duration_s",
+def get_window_index(origin, start, end, stop_duration, max_stops, max_duration=None):
+    """
+    Load the legs that can be part of an itinerary from origin departing between start and end into a flight
+    index. Every level is one range query on (origin_id, firstseen): the departures from the airports reached by
+    the legs of the previous level, between their earliest arrival and the end of their latest layover.
+    """
+    a = aliased(Flight)
+    airports = get_airport_ids(origin)
+    dep_from = start
+    dep_to = end
+
+    frames = []
+    for leg in range(max_stops + 1):
+        stmt = \
+            select(
+              a.flight_id, a.airline_prefix.label("airline"), a.origin, a.destination, a.destination_id,
+              a.firstseen, a.lastseen
+            ).\
+            where(
+              a.origin_id.in_(airports),
+              a.firstseen.between(dep_from, dep_to)
+            )
+        with read_only_connection() as connection:
+            df_legs = pd.read_sql(stmt, connection)
+        frames.append(df_legs)
+
+        # Layover window of the next leg, as in search_connections
+        arrival = pd.to_datetime(df_legs["lastseen"], utc=True).dropna()
+        airports = [int(airport) for airport in df_legs["destination_id"].dropna().unique()]
+        if arrival.empty or not airports:
+            break
+        dep_from = max(arrival.min() + timedelta(hours=1), start)
+        dep_to = min(arrival.max() + timedelta(hours=stop_duration), end + timedelta(days=leg + 1))
+        if max_duration is not None:
+            dep_to = min(dep_to, end + timedelta(seconds=max_duration))
+        if dep_from > dep_to:
+            break
+
+    # A leg can be reached on more than one level
+    return build_flight_index([pd.concat(frames).drop_duplicates("flight_id")])
+
+
+def search_connections(index, origin, destination, start, end, stop_duration, max_stops, max_duration=None,
+                       flight_filter="all", sort_by="dur", limit=None):
+    """
+    Breadth-first search for itineraries with up to max_stops stops over the departure-sorted legs in index.
+    Every level extends the partial paths of the previous level by one leg, so an additional stop costs one
+    more binary search per path instead of another self-join. Paths are pruned on the layover window, on
+    max_duration (seconds) and on airports that cannot reach a destination with the remaining legs. With a limit,
+    paths whose sort key (see get_search_key) cannot beat the limit-th itinerary found so far are dropped as well,
+    and only the first limit itineraries are kept.
+    With flight_filter "unique", only the fastest path per route prefix and last flight is extended. At most
+    SEARCH_MAX_PATHS paths (those with the best sort keys) are extended per level. Returns the same columns as
+    get_flights_from_sql.
+    """
+    origin_codes = get_airport_codes(index, origin)
+    destination_codes = get_airport_codes(index, destination)
+    max_legs = max_stops + 1
+    distance = get_distance_to(index, destination_codes, max_legs)
+    # For "unique", the itinerary of a route is the fastest one, so only the "dur" and "stp" keys bound the
+    # extensions of a path. The itineraries found are final either way: a route has a fixed number of legs.
+    bounded = limit is not None and (flight_filter != "unique" or sort_by in ["dur", "stp"])
+
+    start = int(start.timestamp())
+    end = int(end.timestamp())
+
+    frontier = []
+    complete = []
+    kth = None
+    bound = None
+    frames = []
+    for leg in range(max_legs):
+        next_frontier = []
+        found = []
+        # Key of the last path of a full frontier: paths beyond it can only be extended instead of one within
+        cap = None
+        # Paths are extended in chunks, so that the expanded paths of a level never have to fit in memory at once
+        chunks = range(0, len(frontier[0]), SEARCH_CHUNK_PATHS) if leg > 0 else [0]
+        for chunk in chunks:
+            if leg == 0:
+                # 1st flight: all departures from origin in the selected time window
+                owner, positions = find_departures(
+                    index, origin_codes, np.full(len(origin_codes), start), np.full(len(origin_codes), end)
+                )
+                paths = [positions]
+            else:
+                # Next flight: departures from the last destination within the layover window
+                part = [path[chunk:chunk + SEARCH_CHUNK_PATHS] for path in frontier]
+                arrival = index["lastseen"][part[-1]]
+                dep_from = np.maximum(arrival + HOUR, start)
+                dep_to = np.minimum(arrival + stop_duration * HOUR, end + leg * DAY)
+                if max_duration is not None:
+                    dep_to = np.minimum(dep_to, index["firstseen"][part[0]] + max_duration)
+                owner, positions = find_departures(index, index["destination"][part[-1]], dep_from, dep_to)
+                paths = [path[owner] for path in part] + [positions]
+
+            # Drop paths that cannot reach a destination in time
+            keep = distance[index["destination"][paths[-1]]] <= max_legs - leg - 1
+            if max_duration is not None:
+                keep &= index["lastseen"][paths[-1]] - index["firstseen"][paths[0]] <= max_duration
+            paths = [path[keep] for path in paths]
+
+            final = np.isin(index["destination"][paths[-1]], destination_codes)
+            found.append([path[final] for path in paths])
+
+            if leg < max_legs - 1:
+                if cap is not None:
+                    keep = ~is_beyond(get_search_key(index, paths, sort_by, leg + 1), cap)
+                    paths = [path[keep] for path in paths]
+                next_frontier = join_paths([next_frontier, paths])
+                # Reduce in between only when the frontier has grown well past its cap
+                if len(next_frontier[0]) > 2 * SEARCH_MAX_PATHS:
+                    next_frontier = reduce_frontier(index, next_frontier, leg, flight_filter, sort_by, bound)
+                    if len(next_frontier[0]) == SEARCH_MAX_PATHS:
+                        cap = get_last_key(get_search_key(index, next_frontier, sort_by, leg + 1))
+
+        # Itineraries with leg + 1 legs; for "unique" only the fastest ones per route can be picked
+        found = join_paths(found, leg + 1)
+        if flight_filter == "unique":
+            fastest = get_fastest_per_route(index, found, ties=True)
+            found = [path[fastest] for path in found]
+        complete.append(found)
+
+        if limit is not None:
+            kth = get_kth_key(index, complete, flight_filter, sort_by, limit)
+            if kth is not None:
+                for stops, paths in enumerate(complete):
+                    keep = ~is_beyond(get_search_key(index, paths, sort_by, stops), kth)
+                    complete[stops] = [path[keep] for path in paths]
+                if bounded:
+                    bound = kth
+
+        frontier = reduce_frontier(index, next_frontier, leg, flight_filter, sort_by, bound)
+        if not frontier or not len(frontier[0]):
+            break
+
+    for paths in complete:
+        frames.append(get_itineraries(index, paths))
+
+    return pd.concat(frames)
+
+
+def join_paths(batches, legs=None):
+    """
+    Concatenate batches of paths (one array of leg positions per leg), skipping empty batches
+    """
+    batches = [paths for paths in batches if paths]
+    if not batches:
+        return [np.empty(0, dtype=np.int64) for _ in range(legs)] if legs else []
+    return [np.concatenate(arrays) for arrays in zip(*batches)]
 
-        "f3_airline_code", "f3_airport_from", "f3_airport_to",
-        "f3_time_from", "f3_time_from_str", "f3_time_to", "f3_time_to_str",
-        "f3_duration", "f3_duration_s",
 
-        "total_duration", "total_duration_s", "stop_count", "stop_count_str", "arr_time",
-        "layover_duration_1", "layover_duration_1_s", "layover_duration_2", "layover_duration_2_s",
-        "layover_duration_sum"
-    ]
+def get_search_key(index, paths, sort_by, stops):
+    """
+    Sort key of the paths as (primary, duration) arrays, in the order of get_top_flights: departure ("dep"),
+    arrival ("arr"), stop count ("stp", given by stops) or nothing ("dur") first, then the duration. For partial
+    paths (stops = the stop count of their shortest extension) it is a lower bound of the keys of all extensions.
+    """
+    departure = index["firstseen"][paths[0]]
+    arrival = index["lastseen"][paths[-1]]
+    if sort_by == "dep":
+        primary = departure
+    elif sort_by == "arr":
+        primary = arrival
+    elif sort_by == "stp":
+        primary = np.full(len(departure), stops)
+    else:
+        primary = np.zeros(len(departure), dtype=np.int64)
+    return primary, arrival - departure
 
-    df_formatted = pd.DataFrame(columns=df_formatted_columns)
 
-    # 1st flight
-    if df_all.empty:
-        df_final = df_all
-        return df_final
-    else:
-        df_formatted["f1_airline_code"] = df_all["callsign"].str[:3]
-        df_formatted["f1_airport_from"] = df_all["origin"]
-        df_formatted["f1_airport_to"] = df_all["destination"]
-        df_formatted["f1_time_from"] = df_all["firstseen"]
-        df_formatted["f1_time_from_str"] = convert_time(df_formatted["f1_time_from"])
-        df_formatted["f1_time_to"] = df_all["lastseen"]
-        df_formatted["f1_time_to_str"] = convert_time(df_formatted["f1_time_to"])
-        df_formatted["f1_duration"] = get_timedelta(df_all["firstseen"], df_all["lastseen"], convert=True)
-        df_formatted["f1_duration_s"] = get_timedelta(df_all["firstseen"], df_all["lastseen"], convert=False)
-
-    # 2nd flight
-    df_formatted["f2_airline_code"] = get_airline_code(df_all, "callsign_1", "NaN")
-    df_formatted["f2_airport_from"] = check_if_exists(df_all, "origin_1", "NaN")
-    df_formatted["f2_airport_to"] = check_if_exists(df_all, "destination_1", "NaN")
-    df_formatted["f2_time_from"] = check_if_exists(df_all, "firstseen_1", "NaT")
-    df_formatted["f2_time_from_str"] = convert_time(df_formatted["f2_time_from"])
-    df_formatted["f2_time_to"] = check_if_exists(df_all, "lastseen_1", "NaT")
-    df_formatted["f2_time_to_str"] = convert_time(df_formatted["f2_time_to"])
-    df_formatted["f2_duration"] = get_timedelta(
-      check_if_exists(df_all, "firstseen_1", "NaT"),
-      check_if_exists(df_all, "lastseen_1", "NaT"),
-      convert=True
-    )
-    df_formatted["f2_duration_s"] = get_timedelta(
-      check_if_exists(df_all, "firstseen_1", "NaT"),
-      check_if_exists(df_all, "lastseen_1", "NaT"),
-      convert=False
-    )
+def is_beyond(key, kth):
+    """
+    Mask of the keys that sort after kth (ties are kept)
+    """
+    primary, duration = key
+    return (primary > kth[0]) | ((primary == kth[0]) & (duration > kth[1]))
 
-    # 3rd flight
-    df_formatted["f3_airline_code"] = get_airline_code(df_all, "callsign_2", "NaN")
-    df_formatted["f3_airport_from"] = check_if_exists(df_all, "origin_2", "NaN")
-    df_formatted["f3_airport_to"] = check_if_exists(df_all, "destination_2", "NaN")
-    df_formatted["f3_time_from"] = check_if_exists(df_all, "firstseen_2", "NaT")
-    df_formatted["f3_time_from_str"] = convert_time(df_formatted["f3_time_from"])
-    df_formatted["f3_time_to"] = check_if_exists(df_all, "lastseen_2", "NaT")
-    df_formatted["f3_time_to_str"] = convert_time(df_formatted["f3_time_to"])
-    df_formatted["f3_duration"] = get_timedelta(
-      check_if_exists(df_all, "firstseen_2", "NaT"),
-      check_if_exists(df_all, "lastseen_2", "NaT"),
-      convert=True
-    )
-    df_formatted["f3_duration_s"] = get_timedelta(
-      check_if_exists(df_all, "firstseen_2", "NaT"),
-      check_if_exists(df_all, "lastseen_2", "NaT"),
-      convert=False
-    )
 
-    # Duration if flight is nonstop
-    td_0stop = get_timedelta(
-        df_formatted["f1_time_from"],
-        df_formatted["f1_time_to"],
-        convert=False
-    ).reset_index(drop=True)
+def get_kth_key(index, complete, flight_filter, sort_by, limit):
+    """
+    Key of the limit-th itinerary found so far (complete has the paths per stop count), or None if there are fewer.
+    For "unique" every route counts once.
+    """
+    primaries = []
+    durations = []
+    for stops, paths in enumerate(complete):
+        if flight_filter == "unique":
+            fastest = get_fastest_per_route(index, paths)
+            paths = [path[fastest] for path in paths]
+        primary, duration = get_search_key(index, paths, sort_by, stops)
+        primaries.append(primary)
+        durations.append(duration)
+
+    primary = np.concatenate(primaries)
+    duration = np.concatenate(durations)
+    if len(primary) < limit:
+        return None
+    return get_last_key((primary, duration), limit)
+
+
+def get_last_key(key, count=None):
+    """
+    The count-th smallest of the (primary, duration) keys, the largest without count
+    """
+    primary, duration = key
+    last = np.lexsort((duration, primary))[(count or len(primary)) - 1]
+    return primary[last], duration[last]
+
 
-    # Duration if flight has 1 stop
-    if df_formatted["f2_time_to"].isnull().values.all():
-        td_1stop = np.nan
+def get_fastest_per_route(index, paths, ties=False, last_leg=False):
+    """
+    Mask of the fastest path per route (the airports of all legs), or per route and last flight with last_leg: the
+    first one of equal paths or, with ties, all of them
+    """
+    if not len(paths[0]):
+        return np.zeros(0, dtype=bool)
+    route = get_route_ids(index, paths, last_leg)
+    duration = index["lastseen"][paths[-1]] - index["firstseen"][paths[0]]
+
+    # Stable sort by route and duration, so the first path of a route is its fastest (the earliest of equal ones)
+    order = np.lexsort((duration, route))
+    route = route[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = route[1:] != route[:-1]
+
+    if ties:
+        group = np.cumsum(first) - 1
+        selected = duration[order] == duration[order][first][group]
     else:
-        td_1stop = get_timedelta(
-            df_formatted["f1_time_from"],
-            df_formatted["f2_time_to"],
-            convert=False
-        ).reset_index(drop=True)
-
-    # Duration if flight has 2 stops
-    if df_formatted["f3_time_to"].isnull().values.all():
-        td_2stop = np.nan
+        selected = first
+    mask = np.zeros(len(order), dtype=bool)
+    mask[order[selected]] = True
+    return mask
+
+
+def get_route_ids(index, paths, last_leg=False):
+    """
+    Integer per path that is equal for paths on the same route (and with last_leg, the same last flight), so that
+    routes are sorted on one key instead of one per airport
+    """
+    columns = [index["origin"][paths[0]]] + [index["destination"][path] for path in paths[:-1]]
+    columns.append(paths[-1] if last_leg else index["destination"][paths[-1]])
+    ids = np.zeros(len(paths[0]), dtype=np.int64)
+    for column in columns:
+        size = int(column.max()) + 1
+        if int(ids.max()) >= np.iinfo(np.int64).max // size:
+            # Renumber the routes so far before the ids overflow
+            ids = np.unique(ids, return_inverse=True)[1].astype(np.int64)
+        ids = ids * size + column
+    return ids
+
+
+def reduce_frontier(index, paths, leg, flight_filter, sort_by, kth):
+    """
+    Partial paths with leg + 1 legs that are worth extending: those whose extensions can still beat kth (if
+    known), for "unique" the fastest per route prefix and last flight, and at most SEARCH_MAX_PATHS with the best
+    sort keys. Paths with the same route prefix and last flight have the same extensions, and those of the fastest
+    path are faster on the same routes, so for "unique" the others never make a difference.
+    """
+    if not paths or not len(paths[0]):
+        return paths
+
+    key = get_search_key(index, paths, sort_by, leg + 1)
+    if kth is not None:
+        keep = ~is_beyond(key, kth)
+        paths = [path[keep] for path in paths]
+        key = (key[0][keep], key[1][keep])
+    if flight_filter == "unique":
+        keep = get_fastest_per_route(index, paths, last_leg=True)
+        paths = [path[keep] for path in paths]
+        key = (key[0][keep], key[1][keep])
+    if len(paths[0]) > SEARCH_MAX_PATHS:
+        keep = np.sort(np.lexsort((key[1], key[0]))[:SEARCH_MAX_PATHS])
+        paths = [path[keep] for path in paths]
+    return paths
+
+
+def get_flights(origin, destination, start, end, stop_duration, max_stops, flight_filter="unique",
+                flight_duration=None, sort_by="dur", limit=None):
+    """
+    Get the itineraries for the search parameters. With a limit, only the first limit itineraries according to
+    sort_by ("dur", "dep", "arr" or "stp") are returned, in that order.
+    """
+    # Get the flights and combine them into df_all
+    max_duration = None if flight_duration is None else flight_duration * 3600
+
+    if FLIGHT_BACKEND == "index":
+        df_all = search_connections(
+            get_flight_index(), origin, destination, start, end, stop_duration, max_stops, max_duration,
+            flight_filter, sort_by, limit
+        )
+    elif max_stops > 2:
+        # The SQL statements stop at 2 stops, so search longer connections over the legs reachable from origin
+        df_all = search_connections(
+            get_window_index(origin, start, end, stop_duration, max_stops, max_duration),
+            origin, destination, start, end, stop_duration, max_stops, max_duration, flight_filter, sort_by, limit
+        )
     else:
-        td_2stop = get_timedelta(
-            df_formatted["f1_time_from"],
-            df_formatted["f3_time_to"],
-            convert=False
-        ).reset_index(drop=True)
-
-    # Move values to dataframe to find max value
-    df_td = pd.DataFrame()
-    df_td["0stop"] = td_0stop
-    df_td["1stop"] = td_1stop
-    df_td["2stop"] = td_2stop
-
-    # Set max value to df_formatted
-    df_formatted["total_duration_s"] = df_td.max(axis=1)
-    df_formatted["total_duration"] = convert_duration(df_formatted["total_duration_s"])
-
-    # Layover Duration 1
-    if df_formatted["f2_time_from"].isnull().values.all():
-        ld_1stop = np.nan
+        # Duration limit, "unique" filter and limit are applied in the database
+        df_all = get_flights_from_sql(
+            origin, destination, start, end, stop_duration, max_stops, flight_duration, flight_filter, sort_by, limit
+        )
+        return format_flights(df_all, "all")
+
+    return get_top_flights(format_flights(df_all, flight_filter), sort_by, limit)
+
+
+def get_top_flights(df_flights, sort_by, limit):
+    """
+    Sort formatted itineraries by sort_by and keep the first limit rows
+    """
+    if limit is None or df_flights.empty:
+        return df_flights
+
+    if sort_by == "dep":
+        keys = ["f1_time_from", "total_duration_s"]
+    elif sort_by == "arr":
+        keys = ["arr_time", "total_duration_s"]
+    elif sort_by == "stp":
+        keys = ["stop_count", "total_duration_s"]
     else:
-        ld_1stop = get_timedelta(
-            df_formatted["f1_time_to"],
-            df_formatted["f2_time_from"],
-            convert=False
-        ).reset_index(drop=True)
-
-    # Layover Duration 2
-    if df_formatted["f2_time_to"].isnull().values.all():
-        ld_2stop = np.nan
-    elif df_formatted["f3_time_from"].isnull().values.all():
-        ld_2stop = np.nan
+        keys = ["total_duration_s"]
+
+    return df_flights.sort_values(keys, kind="stable").head(limit)
+
+
+def get_leg_count(df_all):
+    """
+    Number of legs of the longest itinerary in df_all (callsign, callsign_1, callsign_2, ...)
+    """
+    return 1 + sum(column.startswith("callsign_") for column in df_all.columns)
+
+
+def get_epoch(df_all, column):
+    """
+    Column of df_all as int64 epoch seconds, plus a mask of the rows that have a value
+    """
+    if column not in df_all.columns:
+        return np.zeros(len(df_all), dtype=np.int64), np.zeros(len(df_all), dtype=bool)
+
+    values = pd.to_datetime(df_all[column], utc=True, cache=False)
+    seconds = values.dt.tz_localize(None).to_numpy(dtype="datetime64[s]").astype(np.int64)
+    return seconds, values.notna().to_numpy()
+
+
+def get_column(df_all, column):
+    """
+    Column of df_all, or NaN if the column does not exist
+    """
+    if column in df_all.columns:
+        return df_all[column].to_numpy()
     else:
-        ld_2stop = get_timedelta(
-            df_formatted["f2_time_to"],
-            df_formatted["f3_time_from"],
-            convert=False
-        ).reset_index(drop=True)
-
-    # Add Layover Duration to df_formatted
-    df_formatted["layover_duration_1_s"] = ld_1stop
-    df_formatted["layover_duration_1"] = convert_duration(df_formatted["layover_duration_1_s"])
-    df_formatted["layover_duration_2_s"] = ld_2stop
-    df_formatted["layover_duration_2"] = convert_duration(df_formatted["layover_duration_2_s"])
-
-    # Add Stop Count to df_formatted
-    cond = [df_formatted["layover_duration_1_s"].isnull(), df_formatted["layover_duration_2_s"].isnull()]
-    out = ["Nonstop", "1 stop"]
-    stop_count_str = np.select(cond, out, "2 stops")
-    df_formatted["stop_count_str"] = stop_count_str
-
-    cond = [df_formatted["layover_duration_1_s"].isnull(), df_formatted["layover_duration_2_s"].isnull()]
-    out = [0, 1]
-    stop_count = np.select(cond, out, 2)
-    df_formatted["stop_count"] = stop_count
-
-    # Add arrival time
-    cond = [df_formatted["stop_count"] == 2,
-            df_formatted["stop_count"] == 1,
-            df_formatted["stop_count"] == 0]
-    out = [df_formatted["f3_time_to"], df_formatted["f2_time_to"], df_formatted["f1_time_to"]]
-    arr_time = np.select(cond, out)
-    df_formatted["arr_time"] = arr_time
+        return np.full(len(df_all), np.nan, dtype=object)
+
+
+def get_datetime(seconds, exists):
+    """
+    Convert epoch seconds to UTC datetimes (NaT where the value does not exist)
+    """
+    values = seconds.astype("datetime64[s]")
+    values[~exists] = np.datetime64("NaT")
+    return pd.to_datetime(values, utc=True, cache=False)
+
+
+def format_flights(df_all, flight_filter="unique"):
+    """
+    Format the raw legs in df_all into one row per itinerary. There are always at least 3 flight columns
+    (f1, f2, f3), longer itineraries add f4, f5, ... All durations, layovers, stop counts and arrival times
+    are computed in one pass over epoch seconds; the display strings are added by add_display_columns.
+    """
+    if df_all.empty:
+        df_final = df_all
+        return df_final
+
+    df_all = df_all.reset_index(drop=True)
+    legs = max(3, get_leg_count(df_all))
+    rows = np.arange(len(df_all))
+
+    # Departure and arrival of every flight as a (legs x rows) matrix
+    dep = np.zeros((legs, len(df_all)), dtype=np.int64)
+    arr = np.zeros((legs, len(df_all)), dtype=np.int64)
+    exists = np.zeros((legs, len(df_all)), dtype=bool)
+    for leg in range(legs):
+        suffix = "" if leg == 0 else "_" + str(leg)
+        dep[leg], dep_exists = get_epoch(df_all, "firstseen" + suffix)
+        arr[leg], arr_exists = get_epoch(df_all, "lastseen" + suffix)
+        exists[leg] = dep_exists & arr_exists
+
+    duration = np.where(exists, arr - dep, np.nan)
+    layover = np.where(exists[1:], dep[1:] - arr[:-1], np.nan)
+    stop_count = exists.sum(axis=0) - 1
+    arr_time = arr[stop_count, rows]
+
+    # 1st, 2nd, 3rd, ... flight
+    columns = {}
+    for leg in range(legs):
+        f = "f" + str(leg + 1)
+        suffix = "" if leg == 0 else "_" + str(leg)
+        callsign = get_column(df_all, "callsign" + suffix)
+        columns[f + "_airline_code"] = pd.Series(callsign, dtype=object).str[:3]
+        columns[f + "_airport_from"] = get_column(df_all, "origin" + suffix)
+        columns[f + "_airport_to"] = get_column(df_all, "destination" + suffix)
+        columns[f + "_time_from"] = get_datetime(dep[leg], exists[leg])
+        columns[f + "_time_to"] = get_datetime(arr[leg], exists[leg])
+        columns[f + "_duration_s"] = duration[leg]
+
+    columns["total_duration_s"] = (arr_time - dep[0]).astype(float)
+    columns["stop_count"] = stop_count
+    columns["arr_time"] = get_datetime(arr_time, stop_count >= 0)
+    for stop in range(1, legs):
+        columns["layover_duration_" + str(stop) + "_s"] = layover[stop - 1]
+
+    df_formatted = pd.DataFrame(columns)
 
     if flight_filter == "unique":
         # Sort duration ascending to drop longer flights flying the same route
+        route = ["f" + str(leg) + "_airport_from" for leg in range(1, legs + 1)] + ["f" + str(legs) + "_airport_to"]
         df_sorted = df_formatted.sort_values(
-            ["f1_airport_from", "f2_airport_from", "f3_airport_from", "f3_airport_to", "total_duration_s"],
-            ascending=[True, True, True, True, True]
+            route + ["total_duration_s"],
+            ascending=[True] * (len(route) + 1)
         )
         df_final = df_sorted.drop_duplicates(
-            subset=["f1_airport_from", "f2_airport_from", "f3_airport_from", "f3_airport_to"],
+            subset=route,
             keep="first"
         )
     else:
         df_final = df_formatted
 
     return df_final
+
+
+def format_time(column):
+    """
+    Convert datetime to HH:MM format
+    """
+    return column.dt.strftime("%H:%M")
+
+
+def format_duration(column):
+    """
+    Convert duration in seconds to "x hr y min" ("y min" if shorter than an hour)
+    """
+    def format_value(duration):
+        if pd.isnull(duration):
+            return np.nan
+        hrs, mins = divmod(int(duration) // 60, 60)
+        if hrs == 0:
+            return str(mins) + " min"
+        return str(hrs) + " hr " + str(mins) + " min"
+
+    return column.map(format_value)
+
+
+def add_display_columns(df_flights):
+    """
+    Add the display strings (times, durations, layovers, stops) to formatted itineraries. Only call this
+    for the rows that actually get rendered.
+    """
+    df_flights = df_flights.copy()
+    legs = sum(column.endswith("_airport_from") for column in df_flights.columns)
+
+    for leg in range(1, legs + 1):
+        f = "f" + str(leg)
+        df_flights[f + "_time_from_str"] = format_time(df_flights[f + "_time_from"])
+        df_flights[f + "_time_to_str"] = format_time(df_flights[f + "_time_to"])
+        df_flights[f + "_duration"] = format_duration(df_flights[f + "_duration_s"])
+
+    df_flights["total_duration"] = format_duration(df_flights["total_duration_s"])
+    for stop in range(1, legs):
+        layover = "layover_duration_" + str(stop)
+        df_flights[layover] = format_duration(df_flights[layover + "_s"])
+
+    cond = [df_flights["stop_count"] == 0, df_flights["stop_count"] == 1]
+    out = ["Nonstop", "1 stop"]
+    df_flights["stop_count_str"] = np.select(cond, out, df_flights["stop_count"].astype(str) + " stops")
+
+    return df_flights
@@ -1,68 +1,251 @@
-from sqlalchemy import select, func, distinct
+from sqlalchemy import select, func, distinct, delete, insert, inspect, literal_column, tuple_, BigInteger
 from sqlalchemy.orm import aliased
+from datetime import datetime, time, timedelta
+from os import environ
+from time import monotonic
 import pandas as pd
-from db import Session
-from models import Flight
+import pytz
+from db import engine, read_only_connection
+from lib.connections import get_days
+from lib.executor import read_sql, read_sql_all
+from lib.flights import get_airport_ids
+from models import Flight, FlightDaily, FlightDailyDay
+
+
+# Seconds between two reads of the days covered by flight_daily, and the last read (time, days or None if the
+# rollup does not exist), see has_gap_daily. The rollup may be refreshed by another process
+GAP_DAILY_CHECK_INTERVAL = int(environ.get("GAP_DAILY_CHECK_INTERVAL", 300))
+_gap_daily = (None, None)
+
+# Ranges longer than this many days are counted with one statement per KPI instead of the single scan: Postgres
+# cannot parallelize grouping sets and sorts all flights of the range, which is slower for large ranges
+GAP_SINGLE_SCAN_DAYS = int(environ.get("GAP_SINGLE_SCAN_DAYS", 31))
 
 
 def get_gap(origin, start, end):
+    """
+    Flights (kpi1), airlines (kpi2) and destinations (kpi3) per origin for flights departing between start
+    and end. Whole UTC days are read from the flight_daily rollup if it has been built for all of them.
+    """
+    days = get_whole_days(start, end)
+    if days is not None and has_gap_daily(*days):
+        return get_gap_daily(origin, *days)
+
     a = aliased(Flight)
-    session = Session()
+    origin_ids = get_airport_ids(origin)
+    if end - start > timedelta(days=GAP_SINGLE_SCAN_DAYS):
+        # Send the three statements at the same time
+        frames = read_sql_all(get_gap_kpi_stmts(a, origin_ids, start, end))
+        df_gap = pd.concat([df.set_index("f1_airport_from") for df in frames], axis=1)
+    else:
+        df_gap = read_sql(get_gap_stmt(a, origin_ids, start, end)).set_index("f1_airport_from")
 
-    # Get flights
-    stmt = \
+    return df_gap
+
+
+def get_gap_stmt(a, origin_ids, start, end):
+    """
+    All three KPIs per origin from one scan of the flights (a) departing from origin_ids (airport ids or a
+    statement selecting them) between start and end. The scan is
+    grouped by (origin, airline prefix) and (origin, destination) at once; counting the groups per origin gives
+    the number of airlines and destinations.
+    """
+    groups = \
         select(
-            a.origin, func.count(a.origin)
+            a.origin, func.count(a.origin).label("flights"), func.grouping(a.airline_prefix).label("by_destination")
         ).\
         where(
             a.firstseen.between(start, end),
-            a.origin.in_(origin)
+            a.origin_id.in_(origin_ids)
+        ).\
+        group_by(
+            func.grouping_sets(tuple_(a.origin, a.airline_prefix), tuple_(a.origin, a.destination_id))
+        ).\
+        subquery()
+
+    per_airline = groups.c.by_destination == 0
+    stmt = \
+        select(
+            groups.c.origin.label("f1_airport_from"),
+            func.cast(func.sum(groups.c.flights).filter(per_airline), BigInteger).label("kpi1"),
+            func.count().filter(per_airline).label("kpi2"),
+            func.count().filter(~per_airline).label("kpi3")
+        ).\
+        group_by(
+            groups.c.origin
+        )
+    return stmt
+
+
+def get_gap_kpi_stmts(a, origin_ids, start, end):
+    """
+    One statement per KPI with the same result as get_gap_stmt (all origins with flights appear in each). Each
+    statement is a plain aggregation that Postgres can run in parallel.
+    """
+    where = [
+        a.firstseen.between(start, end),
+        a.origin_id.in_(origin_ids)
+    ]
+
+    stmt_flights = \
+        select(
+            a.origin.label("f1_airport_from"), func.count(a.origin).label("kpi1")
+        ).\
+        where(
+            *where
         ).\
         group_by(
             a.origin
         )
-    gap_flights = pd.read_sql(stmt, session.bind).\
-        rename(columns={"origin": "f1_airport_from", "count_1": "kpi1"}).\
-        set_index("f1_airport_from")
 
-    # Get airlines
+    statements = [stmt_flights]
+    for column, kpi in [(a.airline_prefix, "kpi2"), (a.destination_id, "kpi3")]:
+        groups = \
+            select(
+                a.origin
+            ).\
+            where(
+                *where
+            ).\
+            group_by(
+                a.origin, column
+            ).\
+            subquery()
+        stmt = \
+            select(
+                groups.c.origin.label("f1_airport_from"), func.count().label(kpi)
+            ).\
+            group_by(
+                groups.c.origin
+            )
+        statements.append(stmt)
+
+    return statements
+
+
+def get_whole_days(start, end):
+    """
+    First and last day if start and end cover whole UTC days, otherwise None
+    """
+    start = start.astimezone(pytz.utc)
+    end = end.astimezone(pytz.utc)
+    if start.time() != time.min:
+        return None
+    if end.time() == time.min:
+        end = end - timedelta(seconds=1)
+    elif end.time() < time(23, 59, 59):
+        return None
+    return start.date(), end.date()
+
+
+def has_gap_daily(day_from=None, day_to=None):
+    """
+    Check if the flight_daily rollup exists and, with day_from and day_to, has been built for all days between
+    them. The covered days are read at most every GAP_DAILY_CHECK_INTERVAL seconds
+    """
+    global _gap_daily
+    checked_at, days = _gap_daily
+    if checked_at is None or monotonic() - checked_at >= GAP_DAILY_CHECK_INTERVAL:
+        days = load_gap_daily_days()
+        _gap_daily = (monotonic(), days)
+
+    if days is None:
+        return False
+    if day_from is None or day_to is None:
+        return True
+    return all(day_from + timedelta(days=i) in days for i in range((day_to - day_from).days + 1))
+
+
+def load_gap_daily_days():
+    """
+    Days the flight_daily rollup has been built for, or None if it does not exist
+    """
+    if not inspect(engine).has_table(FlightDailyDay.__tablename__):
+        return None
+    with read_only_connection() as connection:
+        return frozenset(connection.execute(select(FlightDailyDay.day)).scalars())
+
+
+def get_gap_daily(origin, day_from, day_to):
+    """
+    Same result as get_gap, read from the flight_daily rollup
+    """
+    r = aliased(FlightDaily)
+
     stmt = \
         select(
-            a.origin, func.substr(a.callsign, 1, 3), func.count(a.origin)
+            r.origin.label("f1_airport_from"),
+            func.sum(r.flight_count).label("kpi1"),
+            func.count(distinct(r.airline_prefix)).label("kpi2"),
+            func.count(distinct(r.destination)).label("kpi3")
         ).\
         where(
-            a.firstseen.between(start, end),
-            a.origin.in_(origin)
+            r.day.between(day_from, day_to),
+            r.origin.in_(origin)
         ).\
         group_by(
-            a.origin, func.substr(a.callsign, 1, 3)
+            r.origin
         )
-    gap_air_df = pd.read_sql(stmt, session.bind)
-    gap_air_series = gap_air_df["origin"].value_counts()
-    gap_airlines = gap_air_series.to_frame().\
-        reset_index().\
-        rename(columns={"index": "f1_airport_from", "origin": "kpi2"}).\
-        set_index("f1_airport_from")
-
-    # Get destinations
+    df_gap = read_sql(stmt).astype({"kpi1": "int64"}).set_index("f1_airport_from")
+
+    return df_gap
+
+
+def refresh_gap_daily(day_from=None, day_to=None):
+    """
+    Rebuild the flight_daily rollup for the days between day_from and day_to (all days if not set) and record them
+    as covered. Missing airline prefixes and destinations are stored as "" so that they still count as one
+    airline/destination.
+    """
+    global _gap_daily
+
+    a = aliased(Flight)
+    r = FlightDaily.__table__
+    c = FlightDailyDay.__table__
+    day = func.date(func.timezone("UTC", a.firstseen))
+    prefix = func.coalesce(a.airline_prefix, "")
+    destination = func.coalesce(a.destination, "")
+
     stmt = \
         select(
-            a.origin, a.destination, func.count(a.origin)
+            a.origin, day, prefix, destination, func.count(literal_column("*"))
         ).\
         where(
-            a.firstseen.between(start, end),
-            a.origin.in_(origin)
+            a.origin.is_not(None),
+            a.firstseen.is_not(None)
         ).\
         group_by(
-            a.origin, a.destination
+            a.origin, day, prefix, destination
         )
-    gap_dest_df = pd.read_sql(stmt, session.bind)
-    gap_dest_series = gap_dest_df["origin"].value_counts()
-    gap_destinations = gap_dest_series.to_frame().\
-        reset_index().\
-        rename(columns={"index": "f1_airport_from", "origin": "kpi3"}).\
-        set_index("f1_airport_from")
+    stmt_delete = delete(r)
+    stmt_delete_days = delete(c)
 
-    df_gap = pd.concat([gap_flights, gap_airlines, gap_destinations], axis=1)
+    if day_from is not None:
+        start = pytz.utc.localize(datetime.combine(day_from, time.min))
+        stmt = stmt.where(a.firstseen >= start)
+        stmt_delete = stmt_delete.where(r.c.day >= day_from)
+        stmt_delete_days = stmt_delete_days.where(c.c.day >= day_from)
+    if day_to is not None:
+        end = pytz.utc.localize(datetime.combine(day_to + timedelta(days=1), time.min))
+        stmt = stmt.where(a.firstseen < end)
+        stmt_delete = stmt_delete.where(r.c.day <= day_to)
+        stmt_delete_days = stmt_delete_days.where(c.c.day <= day_to)
 
-    return df_gap
+    # Days without a bound cover the flights in the table; later days are covered once they are refreshed
+    days = get_days(day_from, day_to)
+
+    # Replace the days in one transaction, so readers never see a partially refreshed rollup
+    with engine.begin() as connection:
+        r.create(connection, checkfirst=True)
+        c.create(connection, checkfirst=True)
+        connection.execute(stmt_delete)
+        connection.execute(stmt_delete_days)
+        result = connection.execute(
+            insert(r).from_select(["origin", "day", "airline_prefix", "destination", "flight_count"], stmt)
+        )
+        if days:
+            connection.execute(insert(c), [{"day": day} for day in days])
+
+    # Read the covered days again on the next check
+    _gap_daily = (None, None)
+    return result.rowcount
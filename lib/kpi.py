@@ -1,7 +1,5 @@
+import numpy as np
 import pandas as pd
-from sklearn.preprocessing import QuantileTransformer
-import warnings
-warnings.filterwarnings("ignore", category=UserWarning)
 
 
 def get_unweighted_kpi(df_odp, df_gap):
@@ -29,51 +27,111 @@ def get_unweighted_kpi(df_odp, df_gap):
     return df_kpi
 
 
-def get_weighted_kpi(df_unweighted, preference):
+KPIS = ["kpi1", "kpi2", "kpi3", "kpi4", "kpi5", "kpi6", "kpi7", "kpi8"]
+# Options of the "preference" dropdown: no preference or one preferred KPI
+PREFERENCES = ["NA"] + KPIS
+# Cost indicators (lower is better)
+COST_KPIS = ["kpi6", "kpi7", "kpi8"]
+
 
-    df = df_unweighted.copy()
-    df = df.set_index("airport")
+def get_weight_matrix():
+    """
+    KPI weights (rows: KPIs, columns: preferences) and the scaling of the weighted KPIs per preference
+    """
+    # Without preference all KPIs weigh the same, otherwise the preferred KPI gets 0.2 and the others share 0.8
+    weights = np.full((len(KPIS), len(PREFERENCES)), 0.8 / 7)
+    weights[:, 0] = 0.125
+    weights[np.arange(len(KPIS)), np.arange(1, len(PREFERENCES))] = 0.2
 
-    transformer = QuantileTransformer(output_distribution="uniform")
-    df_norm = pd.DataFrame(
-        transformer.fit_transform(df),
-        columns=["kpi1", "kpi2", "kpi3", "kpi4", "kpi5", "kpi6", "kpi7", "kpi8"]
+    # scaling so highest value is always 10
+    scale = np.full(len(PREFERENCES), 100 / 2)
+    scale[0] = 80
+
+    return weights, scale
+
+
+def get_uniform_quantiles(values, n_quantiles=1000):
+    """
+    Map every column of values to its empirical quantiles in [0, 1] (same result as scikit-learn's
+    QuantileTransformer(output_distribution="uniform").fit_transform). With at most n_quantiles rows this is the
+    rank of the value, equal values getting the mean of their ranks.
+    """
+    values = np.asarray(values, dtype=float)
+    references = np.linspace(0, 1, max(1, min(n_quantiles, len(values))))
+    quantiles = np.nanpercentile(values, references * 100, axis=0)
+
+    # Interpolate upwards and downwards and take the mean, so that equal values get the same quantile
+    norm = 0.5 * (
+        interp_columns(values, quantiles, references) -
+        interp_columns(-values, -quantiles[::-1], -references[::-1])
     )
 
+    norm[values == quantiles[-1]] = 1
+    norm[values == quantiles[0]] = 0
+    return norm
+
+
+def interp_columns(x, xp, fp):
+    """
+    np.interp(x[:, i], xp[:, i], fp) for all columns i at once (xp ascending per column)
+    """
+    n = len(xp)
+
+    # Number of xp values <= x, from one stable sort of xp and x per column (xp first, so it wins ties)
+    order = np.argsort(np.concatenate([xp, x]), axis=0, kind="stable")
+    counts = np.empty_like(order)
+    np.put_along_axis(counts, order, np.cumsum(order < n, axis=0), axis=0)
+    below = counts[n:] - 1
+
+    lower = np.clip(below, 0, n - 1)
+    upper = np.clip(below + 1, 0, n - 1)
+    xp_lower = np.take_along_axis(xp, lower, axis=0)
+    xp_upper = np.take_along_axis(xp, upper, axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = (fp[upper] - fp[lower]) / (xp_upper - xp_lower)
+        y = slope * (x - xp_lower) + fp[lower]
+
+    # Outside of xp, np.interp returns the first or last fp
+    y = np.where(below < 0, fp[0], np.where(below >= n - 1, fp[-1], y))
+    return np.where(np.isnan(x), np.nan, y)
+
+
+def get_normalized_kpi(df_unweighted):
+    """
+    KPIs mapped to uniform quantiles (0 = worst, 1 = best) as an airports x KPIs matrix
+    """
+    norm = get_uniform_quantiles(df_unweighted[KPIS])
+
     # switch cost indicators
-    df_norm["kpi6"] = 1 - df_norm["kpi6"]
-    df_norm["kpi7"] = 1 - df_norm["kpi7"]
-    df_norm["kpi8"] = 1 - df_norm["kpi8"]
-
-    # Determine the weight per KPI
-    if preference == "NA":
-        weight = 0.125
-    else:
-        weight = 0.8 / 7
-
-    # compute weighted KPIs
-    df_weighted = pd.DataFrame()
-    for column in df_norm:
-        if column == preference:
-            df_weighted[(column + "_weighted")] = df_norm[column] * 0.2
-        else:
-            df_weighted[(column + "_weighted")] = df_norm[column] * weight
-
-    # create rating sum
-    df_rating = pd.DataFrame()
-    df_rating["rating"] = df_weighted.sum(axis=1) * 10
+    cost = np.isin(KPIS, COST_KPIS)
+    norm[:, cost] = 1 - norm[:, cost]
+
+    return norm
 
-    # scaling so highest value is always 10
-    x = 100 / 2
-    if preference == "NA":
-        df_weighted = df_weighted * 80
-    else:
-        df_weighted = df_weighted * x
 
-    # copy rating sum
-    df_weighted["rating"] = df_rating["rating"]
+def get_all_weighted_kpi(df_unweighted):
+    """
+    Weighted KPIs and rating of every preference, from a single normalization: {preference: df} in the format
+    of get_weighted_kpi
+    """
+    df = df_unweighted.reset_index(drop=True)
+    norm = get_normalized_kpi(df)
+    weights, scale = get_weight_matrix()
 
-    df = df.reset_index()
-    df_final = pd.concat([df, df_weighted], axis=1)
+    # airports x preferences
+    rating = norm @ weights * 10
+    # airports x KPIs x preferences
+    weighted = norm[:, :, np.newaxis] * (weights * scale)
 
-    return df_final
+    columns = [kpi + "_weighted" for kpi in KPIS]
+    df_all = {}
+    for i, preference in enumerate(PREFERENCES):
+        df_weighted = pd.DataFrame(weighted[:, :, i], columns=columns)
+        df_weighted["rating"] = rating[:, i]
+        df_all[preference] = pd.concat([df, df_weighted], axis=1)
+
+    return df_all
+
+
+def get_weighted_kpi(df_unweighted, preference):
+    return get_all_weighted_kpi(df_unweighted)[preference]
@@ -0,0 +1,154 @@
+from collections import OrderedDict
+from os import environ
+import io
+import os
+import re
+import secrets
+import stat
+import tempfile
+import threading
+import time
+import pandas as pd
+
+
+# Server-side store for intermediate results (DataFrames): callbacks keep only the token in a dcc.Store. Entries
+# are written as Parquet files into RESULT_STORE_DIR, so all gunicorn workers on a host share them (use a directory
+# in /dev/shm to keep them in memory). The directory must belong to the user of the app and be accessible only by
+# it (mode 0700), otherwise the store refuses to use it. Entries expire RESULT_STORE_TTL seconds after their last
+# use, and the oldest entries are dropped once the directory grows beyond RESULT_STORE_MAX_MB. Recently used entries
+# are also kept per process.
+STORE_DIR = environ.get("RESULT_STORE_DIR", os.path.join(tempfile.gettempdir(), "flightexplorer-results"))
+STORE_TTL = int(environ.get("RESULT_STORE_TTL", 3600))
+STORE_MAX_BYTES = int(environ.get("RESULT_STORE_MAX_MB", 256)) * 1024 * 1024
+CACHE_SIZE = int(environ.get("RESULT_STORE_CACHE_SIZE", 32))
+
+TOKEN_PATTERN = re.compile(r"[A-Za-z0-9_-]{22}")
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+_last_cleanup = 0
+_checked_dir = None
+
+
+def put(df):
+    """
+    Store a DataFrame and return its token
+    """
+    token = secrets.token_urlsafe(16)
+    data = df.to_parquet()
+
+    check_store_dir()
+    path = get_path(token)
+    with open(path + ".tmp", "wb") as file:
+        file.write(data)
+    os.replace(path + ".tmp", path)
+
+    remember(token, data)
+    clean_store()
+    return token
+
+
+def get(token):
+    """
+    Return a fresh copy of the DataFrame stored under token, or None if the token is unknown or expired
+    """
+    if not token or not TOKEN_PATTERN.fullmatch(token):
+        return None
+    check_store_dir()
+
+    with _lock:
+        entry = _cache.get(token)
+        if entry is not None and time.time() - entry[1] <= STORE_TTL:
+            _cache.move_to_end(token)
+            _cache[token] = (entry[0], time.time())
+            data = entry[0]
+        else:
+            data = None
+
+    path = get_path(token)
+    try:
+        if data is None:
+            if time.time() - os.path.getmtime(path) > STORE_TTL:
+                return None
+            with open(path, "rb") as file:
+                data = file.read()
+            remember(token, data)
+        # Mark the entry as used, so it expires STORE_TTL seconds after its last use
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+
+    return pd.read_parquet(io.BytesIO(data)) if data is not None else None
+
+
+def get_path(token):
+    return os.path.join(STORE_DIR, token + ".parquet")
+
+
+def check_store_dir():
+    """
+    Create the store directory (mode 0700) if needed, and make sure that it is a directory of the current user
+    that no one else can access, so no other user can read the results or plant entries. Checked once per process
+    """
+    global _checked_dir
+    if _checked_dir == STORE_DIR:
+        return
+
+    os.makedirs(STORE_DIR, mode=0o700, exist_ok=True)
+    status = os.lstat(STORE_DIR)
+    if not stat.S_ISDIR(status.st_mode) or status.st_uid != os.getuid() or stat.S_IMODE(status.st_mode) != 0o700:
+        raise RuntimeError(
+            f"Result store {STORE_DIR} must be a directory owned by the current user with mode 0700 "
+            f"(set RESULT_STORE_DIR or run chmod 700)"
+        )
+    _checked_dir = STORE_DIR
+
+
+def remember(token, data):
+    """
+    Keep the Parquet data in the per-process cache (least recently used entries are dropped first)
+    """
+    with _lock:
+        _cache[token] = (data, time.time())
+        _cache.move_to_end(token)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def clean_store(interval=60):
+    """
+    Delete expired entries and, if the store is still too large, the least recently used ones. Runs at most
+    once per interval seconds per process
+    """
+    global _last_cleanup
+    now = time.time()
+    if now - _last_cleanup < interval:
+        return
+    _last_cleanup = now
+
+    entries = []
+    for entry in os.scandir(STORE_DIR):
+        if not entry.name.endswith(".parquet"):
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        if now - stat.st_mtime > STORE_TTL:
+            remove(entry.path)
+        else:
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    size = sum(entry[1] for entry in entries)
+    for mtime, entry_size, path in sorted(entries):
+        if size <= STORE_MAX_BYTES:
+            break
+        remove(path)
+        size -= entry_size
+
+
+def remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
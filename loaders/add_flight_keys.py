@@ -0,0 +1,73 @@
+import argparse
+import time
+from sqlalchemy import select, update, func, text
+from db import engine
+from models import Flight, Airport
+
+
+# Add origin_id, destination_id and airline_prefix to a flight table loaded before these columns existed and
+# fill them in batches of flight ids. Safe to run again, e.g. for flights loaded by an older loader:
+#   python -m loaders.add_flight_keys
+#   python -m loaders.add_flight_keys --batch 500000 --missing-only
+parser = argparse.ArgumentParser(description="Add and fill the airport ids and airline prefix of the flights")
+parser.add_argument("--batch", type=int, default=1000000, help="flight ids per transaction")
+parser.add_argument("--missing-only", action="store_true", help="only fill flights without airline prefix")
+args = parser.parse_args()
+
+with engine.begin() as connection:
+    connection.execute(text(
+        "alter table flight "
+        "add column if not exists origin_id smallint references airport (airport_id), "
+        "add column if not exists destination_id smallint references airport (airport_id), "
+        "add column if not exists airline_prefix varchar(3)"
+    ))
+
+f = Flight.__table__
+with engine.connect() as connection:
+    first, last = connection.execute(select(func.min(f.c.flight_id), func.max(f.c.flight_id))).one()
+
+# First airport id per ICAO code
+ids = \
+    select(Airport.airport_ident, func.min(Airport.airport_id).label("airport_id")).\
+    group_by(Airport.airport_ident).\
+    subquery()
+o = ids.alias("o")
+d = ids.alias("d")
+x = f.alias("x")
+
+start = time.perf_counter()
+rows = 0
+for batch_from in range(first or 0, (last or -1) + 1, args.batch):
+    keys = \
+        select(x.c.flight_id, o.c.airport_id.label("origin_id"), d.c.airport_id.label("destination_id")).\
+        select_from(
+            x.outerjoin(o, o.c.airport_ident == x.c.origin).outerjoin(d, d.c.airport_ident == x.c.destination)
+        ).\
+        where(
+            x.c.flight_id.between(batch_from, batch_from + args.batch - 1)
+        )
+    if args.missing_only:
+        keys = keys.where(x.c.airline_prefix.is_(None))
+    keys = keys.subquery()
+
+    stmt = \
+        update(f).\
+        values(
+            origin_id=keys.c.origin_id,
+            destination_id=keys.c.destination_id,
+            airline_prefix=func.substr(f.c.callsign, 1, 3)
+        ).\
+        where(
+            f.c.flight_id == keys.c.flight_id
+        )
+    with engine.begin() as connection:
+        rows += connection.execute(stmt).rowcount
+    print("Flights up to id", batch_from + args.batch - 1, "done,", rows, "updated")
+
+# Indexes of the searches on the new columns (see Flight.__table_args__)
+with engine.begin() as connection:
+    for index in f.indexes:
+        index.create(connection, checkfirst=True)
+with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+    connection.execute(text("analyze flight"))
+print("Rows updated:", rows, "in", round(time.perf_counter() - start, 1), "s")
@@ -0,0 +1,27 @@
+import argparse
+import time
+from db import engine
+from indexes import create_indexes, verify_indexes, check_indexes
+
+
+# Create or verify the indexes declared in models.py and update the planner statistics. Run from the project root:
+#   python -m loaders.create_indexes              (create missing indexes, ANALYZE)
+#   python -m loaders.create_indexes --rebuild    (also recreate indexes with an outdated definition)
+#   python -m loaders.create_indexes --check      (only report, as the check at startup does)
+parser = argparse.ArgumentParser(description="Create or verify the indexes declared in models.py")
+parser.add_argument("--rebuild", action="store_true", help="recreate indexes with another definition")
+parser.add_argument("--check", action="store_true", help="only report missing indexes and sequential scans")
+args = parser.parse_args()
+
+start = time.perf_counter()
+if args.check:
+    with engine.connect() as connection:
+        for index, state in verify_indexes(connection).items():
+            print(f"{index.table.name}.{index.name}: {state}")
+    print("\n".join(check_indexes()) or "No problems found")
+else:
+    status = create_indexes(args.rebuild)
+    for index, state in status.items():
+        if state == "different" and not args.rebuild:
+            print(f"{index.name} differs from models.py, run with --rebuild to recreate it")
+print("Done in", round(time.perf_counter() - start, 1), "s")
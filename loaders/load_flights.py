@@ -1,117 +1,445 @@
-import csv
-from models import Flight
-from db import Session
+import argparse
+import io
+import itertools
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+import pandas as pd
+import pytz
+from models import Flight, FlightLoad, FlightConnection, Airport
+from db import engine
+from lib.connections import refresh_connections, MAX_LAYOVER
+from lib.gap import refresh_gap_daily, has_gap_daily
+from partitions import FIRST_MONTH, LAST_MONTH, is_partitioned, create_partitions, get_partitions
+from staging import SKIP_REASONS, get_checksum, get_staged_paths, read_baseline, read_csv, read_source, read_staged, \
+    validate
+from sqlalchemy import select, insert, update, delete, func, inspect, text
 
 
-airport_fix = {"KS67", "LSMF", "LTFG", "SCTJ", "YADY", "YPEC", "YSCH", "LSZM"}
+# Load the flight lists (CSV) or the staged flights (Parquet, see staging.py) into the flight table. The files are
+# processed by a pool of worker processes; each one validates the rows of a file (staged flights are validated
+# already) and streams them into the database with COPY FROM STDIN, in chunks of --chunk rows and in one transaction
+# per flight list. Every flight list is recorded in the flight_load manifest, by its file name and checksum, whether
+# it is loaded from the CSV file or from its staged files (a staged file stands for all staged files of its flight
+# list): flight lists that are loaded already are skipped, and the flights of a changed flight list are replaced.
+# Then the derived tables (flight_daily, flight_connection) are refreshed for the affected days. Flights loaded
+# before the manifest existed are recorded as one load (LEGACY_FILE_NAME); while it has flights, files are only
+# loaded with --replace-legacy. Run from the project root:
+#   python -m loaders.load_flights
+#   python -m loaders.load_flights --replace-legacy ../data/flights/flightlist_2022*.csv
+#   python -m loaders.load_flights --workers 4 --from 2022-01 --to 2022-06 ../data/flights/flightlist_2022*.csv
+#   python -m loaders.load_flights ../data/staging/month=2022-*/*.parquet
 
+# Columns written by COPY
+COPY_COLUMNS = [
+    "callsign", "number", "icao24", "registration", "typecode", "origin", "destination", "origin_id",
+    "destination_id", "airline_prefix", "load_id", "firstseen", "lastseen", "day", "latitude_1", "longitude_1",
+    "altitude_1", "latitude_2", "longitude_2", "altitude_2"
+]
 
-def change_to_null(x):
-    if x == "":
+# In the CSV format of COPY, an empty value is NULL; the text columns keep it as "" (like the rows of the ORM loader)
+COPY_SQL = \
+    f"copy {Flight.__tablename__} ({', '.join(COPY_COLUMNS)}) from stdin with (format csv, force_not_null (" \
+    f"callsign, number, icao24, registration, typecode, origin, destination, airline_prefix))"
+
+# Validation data of a worker, set by init_worker
+airport_baseline = set()
+airline_baseline = set()
+airport_ids = {}
+months = None
+
+# Manifest entry of the flights loaded before the manifest existed, from unknown files
+LEGACY_FILE_NAME = "(loaded before the manifest)"
+
+# Connections whose first flight departs up to this many days before a changed flight can include it as second
+# flight (first flight of up to a day, then a layover of up to MAX_LAYOVER)
+CONNECTION_DAYS = 1 + MAX_LAYOVER.days
+
+
+def get_airport_ids():
+    """
+    Airport ids for origin_id/destination_id (the first id if an ICAO code appears more than once)
+    """
+    ids = {}
+    with engine.connect() as connection:
+        for airport_id, airport_ident in connection.execute(select(Airport.airport_id, Airport.airport_ident)):
+            if airport_ident not in ids or airport_id < ids[airport_ident]:
+                ids[airport_ident] = airport_id
+    return ids
+
+
+def get_partition_months():
+    """
+    Months ("YYYY-MM") with a partition of the flight table, or None if the table is not partitioned
+    """
+    with engine.connect() as connection:
+        if not is_partitioned(connection):
+            return None
+        return {name[-7:].replace("_", "-") for name in get_partitions(connection)}
+
+
+def init_worker(airports, airlines, ids, partition_months):
+    global airport_baseline, airline_baseline, airport_ids, months
+    airport_baseline, airline_baseline, airport_ids, months = airports, airlines, ids, partition_months
+    # The pooled connections of the parent process must not be used by the (forked) workers
+    engine.dispose(close=False)
+
+
+def copy_rows(cursor, flights):
+    buffer = io.StringIO()
+    flights.to_csv(buffer, columns=COPY_COLUMNS, index=False, header=False)
+    buffer.seek(0)
+    cursor.copy_expert(COPY_SQL, buffer)
+
+
+def get_days(first, last):
+    """
+    First and last day (UTC) of a firstseen range, or None if the range is empty
+    """
+    if first is None:
         return None
+    return first.astimezone(pytz.utc).date(), last.astimezone(pytz.utc).date()
+
+
+def get_source(path):
+    """
+    Flight list of a file (its file name, the key of the manifest), its checksum and the files to load: a flight list
+    (CSV) is loaded itself, and its checksum is left to the worker; a staged file (Parquet) names its flight list
+    and checksum, and all staged files of that flight list are loaded.
+    """
+    if not path.endswith(".parquet"):
+        return os.path.basename(path), None, [path]
+
+    file_name, checksum = read_source(path)
+    paths = get_staged_paths(file_name, os.path.dirname(os.path.dirname(path)))
+    for staged in paths:
+        if read_source(staged) != (file_name, checksum):
+            raise ValueError(f"The staged files of {file_name} are from different versions, stage it again")
+    return file_name, checksum, paths
+
+
+def get_chunks(path, chunk_rows):
+    """
+    Valid flights of a file in chunks of chunk_rows, with the flights skipped per reason. Flight lists (CSV) are
+    validated here; staged files (Parquet, see staging.py) contain validated flights only.
+    """
+    if path.endswith(".parquet"):
+        for flights in read_staged(path, chunk_rows):
+            yield flights, dict.fromkeys(SKIP_REASONS, 0)
     else:
-        return x
-
-
-def check_airport(airport):
-    if airport in airport_fix:
-        if airport == "KS67":
-            return "KMAN"
-        elif airport == "LSMF":
-            return "LSZM"
-        elif airport == "LTFG":
-            return "LTGP"
-        elif airport == "SCTJ":
-            return "SBAE"
-        elif airport == "YADY":
-            return "YADI"
-        elif airport == "YPEC":
-            return "YLMQ"
-        elif airport == "YSCH":
-            return "YCFS"
-        elif airport == "LSZM":
-            return "LFSB"
+        for chunk in read_csv(path, chunk_rows):
+            valid, skipped = validate(chunk, airport_baseline, airline_baseline)
+            yield chunk[valid], skipped
+
+
+def get_flight_months(firstseen):
+    """
+    Months ("YYYY-MM") of firstseen, in UTC: strings in the flight lists ("2019-01-01 00:00:18+00:00"), timestamps
+    in the staged files
+    """
+    if pd.api.types.is_datetime64_any_dtype(firstseen):
+        months = (firstseen.dt.year * 100 + firstseen.dt.month).unique()
+        return {f"{month // 100}-{month % 100:02d}" for month in months}
+    return set(firstseen.str[0:7].unique())
+
+
+def load_file(file_name, paths, checksum, chunk_rows, legacy_id=None):
+    """
+    Validate the flights of a flight list (file_name, loaded from paths, see get_source) and copy them in chunks of
+    chunk_rows, unless the manifest has the flight list with the same checksum (computed here if None). The flights
+    of an earlier version of the flight list are replaced in the same transaction, so it is loaded completely or not
+    at all; so are the flights loaded before the manifest (legacy_id) that departed between its first and its last
+    flight. Returns the status ("unchanged", "loaded" or "replaced"), the
+    rows inserted, the rows skipped per reason, the duration in seconds, the day ranges whose flights changed and
+    the number of legacy flights deleted.
+    """
+    start = time.perf_counter()
+    if checksum is None:
+        checksum = get_checksum(paths[0])
+    m = FlightLoad.__table__
+    f = Flight.__table__
+
+    count_insert = 0
+    count_skip = dict.fromkeys(SKIP_REASONS, 0)
+    first = None
+    last = None
+
+    with engine.begin() as connection:
+        # The manifest row is locked until the file is committed
+        previous = connection.execute(select(m).where(m.c.file_name == file_name).with_for_update()).first()
+        if previous is not None and previous.checksum == checksum:
+            return "unchanged", 0, count_skip, time.perf_counter() - start, [], 0
+
+        if previous is None:
+            load_id = connection.execute(
+                insert(m).values(file_name=file_name).returning(m.c.load_id)
+            ).scalar()
         else:
-            return airport
-    else:
-        return airport
+            load_id = previous.load_id
+            if previous.firstseen_from is not None:
+                stmt = \
+                    delete(f).\
+                    where(
+                        f.c.load_id == load_id,
+                        f.c.firstseen.between(previous.firstseen_from, previous.firstseen_to)
+                    )
+                connection.execute(stmt)
 
+        cursor = connection.connection.cursor()
+        chunks = itertools.chain.from_iterable(get_chunks(path, chunk_rows) for path in paths)
+        for number, (flights, skipped) in enumerate(chunks, 1):
+            # Creating a partition would wait for the other workers' transactions, so the partitions are created
+            # before the load (see --from and --to)
+            if months is not None:
+                missing = get_flight_months(flights["firstseen"]) - months
+                if missing:
+                    raise ValueError(
+                        f"No partition for the flights of {', '.join(sorted(missing))}, extend --from/--to"
+                    )
 
-# Create list of valid airports
-airport_baseline = set()
-with open("../data/airport_baseline.csv") as file:
-    reader = csv.reader(file, delimiter=",")
-    next(reader)  # skip header
-    for row in reader:
-        airport_baseline.add(row[0])
+            if len(flights):
+                chunk_first = pd.Timestamp(flights["firstseen"].min())
+                chunk_last = pd.Timestamp(flights["firstseen"].max())
+                first = chunk_first if first is None else min(first, chunk_first)
+                last = chunk_last if last is None else max(last, chunk_last)
+                flights = flights.assign(
+                    origin_id=flights["origin"].map(airport_ids).astype("Int64"),
+                    destination_id=flights["destination"].map(airport_ids).astype("Int64"),
+                    load_id=load_id
+                )
+                copy_rows(cursor, flights)
 
+            count_insert += len(flights)
+            for reason, count in skipped.items():
+                count_skip[reason] += count
+            print(f"{file_name} chunk {number}: {len(flights)} inserted, skipped "
+                  + ", ".join(f"{reason} {count}" for reason, count in skipped.items()))
 
-# Create list of valid airlines
-airline_baseline = set()
-with open("../data/airline_baseline.csv") as file:
-    reader = csv.reader(file, delimiter=",")
-    next(reader)  # skip header
-    for row in reader:
-        airline_baseline.add(row[3])
-
-# Set directory and initialize statistics
-directory = "../data/flights/"
-count_insert_total = 0
-count_skip_total = 0
-
-# Iterate over all files and import relevant flights into table
-session = Session()
-for filename in os.listdir(directory):
-    print("------------------------------\nProcessing file:", filename)
-
-    with open(os.path.join(directory, filename)) as file:
-        reader = csv.reader(file, delimiter=",")
-        next(reader)  # skip header
-
-        count_insert = 0
-        count_skip = 0
-
-        for row in reader:
-
-            # Some flights have the wrong airports assigned (mainly due to renaming of airports), so
-            # we have to change this first before validating against the already cleaned list of airports
-            row[5] = check_airport(row[5])
-            row[6] = check_airport(row[6])
-
-            # Check if airline, origin and destination are valid
-            if row[0][0:3] in airline_baseline and row[5] in airport_baseline and row[6] in airport_baseline:
-                flight = Flight(
-                    callsign=row[0],
-                    number=row[1],
-                    icao24=row[2],
-                    registration=row[3],
-                    typecode=row[4],
-                    origin=row[5],
-                    destination=row[6],
-                    firstseen=row[7],
-                    lastseen=row[8],
-                    day=row[9],
-                    latitude_1=change_to_null(row[10]),
-                    longitude_1=change_to_null(row[11]),
-                    altitude_1=change_to_null(row[12]),
-                    latitude_2=change_to_null(row[13]),
-                    longitude_2=change_to_null(row[14]),
-                    altitude_2=change_to_null(row[15])
+        first = first.to_pydatetime() if first is not None else None
+        last = last.to_pydatetime() if last is not None else None
+        count_legacy = 0
+        if legacy_id is not None and first is not None:
+            stmt = \
+                delete(f).\
+                where(
+                    f.c.load_id == legacy_id,
+                    f.c.firstseen.between(first, last)
                 )
-                session.add(flight)
-                count_insert += 1
-                if count_insert % 100000 == 0:
-                    print(count_insert)
-            else:
-                count_skip += 1
-
-    print("Committing " + str(count_insert) + " records...")
-    session.commit()
-    print("Done!\n")
-    count_insert_total = count_insert_total + count_insert
-    count_skip_total = count_skip_total + count_skip
-
-print("\nSummary\n------------------------------")
-print("Rows inserted:\t", count_insert_total)
-print("Rows skipped:\t", count_skip_total)
+            count_legacy = connection.execute(stmt).rowcount
+
+        stmt = \
+            update(m).\
+            values(
+                checksum=checksum,
+                rows_read=count_insert + sum(count_skip.values()),
+                rows_inserted=count_insert,
+                rows_skipped=sum(count_skip.values()),
+                firstseen_from=first,
+                firstseen_to=last,
+                loaded_at=func.now()
+            ).\
+            where(
+                m.c.load_id == load_id
+            )
+        connection.execute(stmt)
+
+    days = [get_days(first, last)]
+    if previous is not None:
+        days.append(get_days(previous.firstseen_from, previous.firstseen_to))
+    status = "loaded" if previous is None else "replaced"
+    days = [day for day in days if day is not None]
+    return status, count_insert, count_skip, time.perf_counter() - start, days, count_legacy
+
+
+def add_legacy_load(connection):
+    """
+    Record the flights of a flight table that was loaded before the manifest existed as one load, LEGACY_FILE_NAME,
+    and return it (None if there are no such flights). Adds load_id to flight tables created before it.
+    """
+    m = FlightLoad.__table__
+    f = Flight.__table__
+
+    legacy = connection.execute(select(m).where(m.c.file_name == LEGACY_FILE_NAME)).first()
+    if legacy is not None:
+        return legacy
+
+    has_load_id = "load_id" in {column["name"] for column in inspect(connection).get_columns(f.name)}
+    loaded = connection.execute(select(func.count(m.c.load_id))).scalar()
+    if has_load_id and loaded:
+        return None
+    if not connection.execute(select(select(f.c.flight_id).exists())).scalar():
+        if not has_load_id:
+            connection.execute(text(f"alter table {f.name} add column load_id integer"))
+        return None
+
+    # The manifest is empty, so all flights were loaded before it
+    stmt = \
+        select(
+            func.count(), func.min(f.c.firstseen), func.max(f.c.firstseen)
+        )
+    if has_load_id:
+        stmt = stmt.where(f.c.load_id.is_(None))
+    rows, first, last = connection.execute(stmt).first()
+    if not rows:
+        return None
+    load_id = connection.execute(
+        insert(m).values(
+            file_name=LEGACY_FILE_NAME, rows_read=rows, rows_inserted=rows, rows_skipped=0, firstseen_from=first,
+            firstseen_to=last, loaded_at=func.now()
+        ).returning(m.c.load_id)
+    ).scalar()
+    if has_load_id:
+        connection.execute(update(f).values(load_id=load_id).where(f.c.load_id.is_(None)))
+    else:
+        # A constant default fills the existing rows without rewriting the table
+        connection.execute(text(f"alter table {f.name} add column load_id integer default {int(load_id)}"))
+        connection.execute(text(f"alter table {f.name} alter column load_id drop default"))
+
+    return connection.execute(select(m).where(m.c.load_id == load_id)).first()
+
+
+def remove_legacy_flights(legacy, count):
+    """
+    Deduct count deleted flights from the legacy load, and drop it from the manifest once it has no flights left
+    """
+    m = FlightLoad.__table__
+    stmt = \
+        update(m).\
+        values(
+            rows_inserted=m.c.rows_inserted - count
+        ).\
+        where(
+            m.c.load_id == legacy.load_id
+        ).\
+        returning(m.c.rows_inserted)
+    with engine.begin() as connection:
+        rows = connection.execute(stmt).scalar()
+        if rows is not None and rows <= 0:
+            connection.execute(delete(m).where(m.c.load_id == legacy.load_id))
+    return max(rows or 0, 0)
+
+
+def merge_days(ranges):
+    """
+    Merge overlapping and adjacent (first day, last day) ranges
+    """
+    merged = []
+    for day_from, day_to in sorted(ranges):
+        if merged and day_from <= merged[-1][1] + timedelta(days=1):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], day_to))
+        else:
+            merged.append((day_from, day_to))
+    return merged
+
+
+def parse_month(value):
+    return datetime.strptime(value, "%Y-%m").date()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load the flight lists into the flight table")
+    parser.add_argument("files", nargs="*",
+                        help="flight lists (CSV) or staged files (Parquet) to load (default: ../data/flights/*)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="files loaded in parallel")
+    parser.add_argument("--chunk", type=int, default=50000, help="rows per COPY")
+    parser.add_argument("--from", dest="month_from", type=parse_month, default=FIRST_MONTH,
+                        help="first month (YYYY-MM) of the partitions to create before the load")
+    parser.add_argument("--to", dest="month_to", type=parse_month, default=LAST_MONTH,
+                        help="last month (YYYY-MM) of the partitions to create before the load")
+    parser.add_argument("--replace-legacy", action="store_true",
+                        help="delete the flights loaded before the manifest in the time range of each loaded file")
+    args = parser.parse_args()
+
+    directory = "../data/flights/"
+    files = args.files or sorted(os.path.join(directory, filename) for filename in os.listdir(directory))
+
+    # One task per flight list, however many of its staged files are given
+    sources = {}
+    for path in files:
+        try:
+            file_name, checksum, paths = get_source(path)
+        except ValueError as error:
+            parser.error(str(error))
+        if sources.get(file_name, (checksum, paths)) != (checksum, paths):
+            parser.error(f"{file_name} is given more than once (as flight list or staged files), load it once")
+        sources[file_name] = (checksum, paths)
+
+    # Create lists of valid airports and airlines
+    airport_baseline = read_baseline("../data/airport_baseline.csv", 0)
+    airline_baseline = read_baseline("../data/airline_baseline.csv", 3)
+
+    # Manifest, and the flights loaded before it: loading files over them would duplicate their flights
+    with engine.begin() as connection:
+        FlightLoad.__table__.create(connection, checkfirst=True)
+        legacy = add_legacy_load(connection)
+    if legacy is not None and not args.replace_legacy:
+        parser.error(
+            f"{legacy.rows_inserted} flights ({legacy.firstseen_from} - {legacy.firstseen_to}) were loaded before "
+            f"the manifest existed; load the flight lists of that time with --replace-legacy to replace them"
+        )
+
+    # The flights are routed to the monthly partitions of the flight table, which have to exist before the load
+    with engine.connect() as connection:
+        partitioned = is_partitioned(connection)
+    if partitioned:
+        create_partitions(args.month_from, args.month_to)
+
+    start = time.perf_counter()
+    count_insert_total = 0
+    count_skip_total = dict.fromkeys(SKIP_REASONS, 0)
+    count_unchanged = 0
+    changed_days = []
+    count_legacy_total = 0
+    failed = []
+
+    with ProcessPoolExecutor(
+        args.workers, initializer=init_worker,
+        initargs=(airport_baseline, airline_baseline, get_airport_ids(), get_partition_months())
+    ) as pool:
+        legacy_id = legacy.load_id if legacy is not None else None
+        futures = {
+            pool.submit(load_file, file_name, paths, checksum, args.chunk, legacy_id): file_name
+            for file_name, (checksum, paths) in sources.items()
+        }
+        for future in as_completed(futures):
+            filename = futures[future]
+            try:
+                status, count_insert, count_skip, seconds, days, count_legacy = future.result()
+            except Exception as error:
+                print(f"Failed: {filename}: {error}")
+                failed.append(filename)
+                continue
+            if status == "unchanged":
+                count_unchanged += 1
+                continue
+            print(f"{status.capitalize()}: {filename}: {count_insert} inserted, {sum(count_skip.values())} skipped, "
+                  f"{count_insert / max(seconds, 1e-9):,.0f} rows/s")
+            count_insert_total = count_insert_total + count_insert
+            for reason, count in count_skip.items():
+                count_skip_total[reason] += count
+            changed_days.extend(days)
+            count_legacy_total += count_legacy
+    seconds = time.perf_counter() - start
+
+    if legacy is not None:
+        count_legacy_left = remove_legacy_flights(legacy, count_legacy_total)
+
+    # Refresh the derived tables that exist for the days with changed flights only
+    if has_gap_daily():
+        for day_from, day_to in merge_days(changed_days):
+            print(f"Refreshed flight_daily {day_from} - {day_to}:", refresh_gap_daily(day_from, day_to), "rows")
+    if inspect(engine).has_table(FlightConnection.__tablename__):
+        for day_from, day_to in merge_days([(d - timedelta(days=CONNECTION_DAYS), t) for d, t in changed_days]):
+            rows = refresh_connections(day_from, day_to)
+            print(f"Refreshed flight_connection {day_from} - {day_to}:", sum(rows.values()), "rows")
+
+    print("\nSummary\n------------------------------")
+    print("Rows inserted:\t", count_insert_total)
+    print("Rows skipped:\t", sum(count_skip_total.values()),
+          "(" + ", ".join(f"{reason} {count}" for reason, count in count_skip_total.items()) + ")")
+    print("Files unchanged:", count_unchanged)
+    if legacy is not None:
+        print("Legacy deleted:\t", count_legacy_total, f"({count_legacy_left} left)")
+    print("Files failed:\t", len(failed), "(" + ", ".join(failed) + ")" if failed else "")
+    print("Rows/s:\t\t", f"{count_insert_total / max(seconds, 1e-9):,.0f}", "in", round(seconds, 1), "s")
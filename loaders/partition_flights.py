@@ -0,0 +1,38 @@
+import argparse
+import time
+from datetime import datetime
+from db import engine
+from partitions import FIRST_MONTH, LAST_MONTH, create_partitions, compact_partition, migrate_flight_table, \
+    get_partitions, get_partition_name, get_months
+
+
+# Manage the monthly partitions of the flight table. Run from the project root:
+#   python -m loaders.partition_flights migrate                  (move an unpartitioned flight table)
+#   python -m loaders.partition_flights create --from 2022-07 --to 2022-12
+#   python -m loaders.partition_flights compact --from 2019-01 --to 2019-12
+#   python -m loaders.partition_flights list
+def parse_month(value):
+    return datetime.strptime(value, "%Y-%m").date()
+
+
+parser = argparse.ArgumentParser(description="Manage the monthly partitions of the flight table")
+parser.add_argument("command", choices=["migrate", "create", "compact", "list"])
+parser.add_argument("--from", dest="month_from", type=parse_month, default=FIRST_MONTH, help="first month (YYYY-MM)")
+parser.add_argument("--to", dest="month_to", type=parse_month, default=LAST_MONTH, help="last month (YYYY-MM)")
+args = parser.parse_args()
+
+start = time.perf_counter()
+if args.command == "migrate":
+    print("Rows copied:", migrate_flight_table())
+elif args.command == "create":
+    print("Partitions:", ", ".join(create_partitions(args.month_from, args.month_to)))
+elif args.command == "compact":
+    with engine.connect() as connection:
+        partitions = set(get_partitions(connection))
+    for month in get_months(args.month_from, args.month_to):
+        if get_partition_name(month) in partitions:
+            print("Compacted", compact_partition(month))
+else:
+    with engine.connect() as connection:
+        print("\n".join(get_partitions(connection)))
+print("Done in", round(time.perf_counter() - start, 1), "s")
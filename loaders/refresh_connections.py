@@ -0,0 +1,19 @@
+import argparse
+import time
+from datetime import date
+from lib.connections import refresh_connections
+
+
+# Build or refresh the flight_connection table used by FLIGHT_BACKEND=connections. Run from the project root:
+#   python -m loaders.refresh_connections                                  (all days)
+#   python -m loaders.refresh_connections --from 2022-03-01 --to 2022-03-31
+parser = argparse.ArgumentParser(description="Build or refresh the one-stop connections")
+parser.add_argument("--from", dest="day_from", type=date.fromisoformat, help="first departure day (UTC) to refresh")
+parser.add_argument("--to", dest="day_to", type=date.fromisoformat, help="last departure day (UTC) to refresh")
+args = parser.parse_args()
+
+start = time.perf_counter()
+rows = refresh_connections(args.day_from, args.day_to)
+for day, count in rows.items():
+    print(day, count)
+print("Connections written:", sum(rows.values()), "in", round(time.perf_counter() - start, 1), "s")
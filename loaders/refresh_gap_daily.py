@@ -0,0 +1,17 @@
+import argparse
+import time
+from datetime import date
+from lib.gap import refresh_gap_daily
+
+
+# Build or refresh the flight_daily rollup used by get_gap. Run from the project root:
+#   python -m loaders.refresh_gap_daily                                  (all days)
+#   python -m loaders.refresh_gap_daily --from 2022-03-01 --to 2022-03-31
+parser = argparse.ArgumentParser(description="Build or refresh the flight_daily rollup")
+parser.add_argument("--from", dest="day_from", type=date.fromisoformat, help="first day (UTC) to refresh")
+parser.add_argument("--to", dest="day_to", type=date.fromisoformat, help="last day (UTC) to refresh")
+args = parser.parse_args()
+
+start = time.perf_counter()
+rows = refresh_gap_daily(args.day_from, args.day_to)
+print("Rows written:", rows, "in", round(time.perf_counter() - start, 1), "s")
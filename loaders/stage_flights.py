@@ -0,0 +1,58 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from staging import STAGING_DIR, SKIP_REASONS, read_baseline, stage_file
+
+
+# Convert the flight lists to Parquet files by month (see staging.py), validated like in loaders/load_flights.py.
+# The staged files can be loaded instead of the flight lists and read directly with staging.read_flights. Run from
+# the project root:
+#   python -m loaders.stage_flights
+#   python -m loaders.stage_flights --workers 4 ../data/flights/flightlist_2022*.csv
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert the flight lists to Parquet files by month")
+    parser.add_argument("files", nargs="*", help="CSV files to convert (default: all files in ../data/flights/)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="files converted in parallel")
+    parser.add_argument("--chunk", type=int, default=200000, help="rows per chunk (and Parquet row group)")
+    parser.add_argument("--output", default=STAGING_DIR, help=f"staging directory (default: {STAGING_DIR})")
+    args = parser.parse_args()
+
+    directory = "../data/flights/"
+    files = args.files or sorted(os.path.join(directory, filename) for filename in os.listdir(directory))
+
+    # Create lists of valid airports and airlines
+    airport_baseline = read_baseline("../data/airport_baseline.csv", 0)
+    airline_baseline = read_baseline("../data/airline_baseline.csv", 3)
+
+    start = time.perf_counter()
+    count_write_total = 0
+    count_skip_total = dict.fromkeys(SKIP_REASONS, 0)
+    failed = []
+
+    with ProcessPoolExecutor(args.workers) as pool:
+        futures = {
+            pool.submit(stage_file, path, args.chunk, airport_baseline, airline_baseline, args.output): path
+            for path in files
+        }
+        for future in as_completed(futures):
+            filename = os.path.basename(futures[future])
+            try:
+                count_write, count_skip, months = future.result()
+            except Exception as error:
+                print(f"Failed: {filename}: {error}")
+                failed.append(filename)
+                continue
+            print(f"Staged: {filename}: {count_write} written, {sum(count_skip.values())} skipped, "
+                  f"months {', '.join(months)}")
+            count_write_total = count_write_total + count_write
+            for reason, count in count_skip.items():
+                count_skip_total[reason] += count
+
+    seconds = time.perf_counter() - start
+    print("\nSummary\n------------------------------")
+    print("Rows written:\t", count_write_total)
+    print("Rows skipped:\t", sum(count_skip_total.values()),
+          "(" + ", ".join(f"{reason} {count}" for reason, count in count_skip_total.items()) + ")")
+    print("Files failed:\t", len(failed), "(" + ", ".join(failed) + ")" if failed else "")
+    print("Rows/s:\t\t", f"{count_write_total / max(seconds, 1e-9):,.0f}", "in", round(seconds, 1), "s")
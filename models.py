@@ -1,11 +1,28 @@
-from sqlalchemy import Column, String, DateTime, Float, Integer
+from sqlalchemy import Column, String, DateTime, Date, Float, Integer, SmallInteger, ForeignKey, Index
 from db import Base
 
 
 class Flight(Base):
+    """
+    Flights, partitioned by month of firstseen (the partitions are managed in partitions.py)
+    """
     __tablename__ = "flight"
+    __table_args__ = (
+        # Departures per airport: the first leg of a search, the next legs of the connection join (covering, so
+        # the joined legs are read from the index) and the airport KPIs
+        Index(
+            "ix_flight_origin_id_firstseen", "origin_id", "firstseen",
+            postgresql_include=["destination_id", "lastseen", "airline_prefix", "callsign", "origin", "destination"]
+        ),
+        # Arrivals per airport: the last leg of a search
+        Index("ix_flight_destination_id_firstseen", "destination_id", "firstseen"),
+        # Time ranges over all airports (flight index, rollup refreshes); small since firstseen follows the load order
+        Index("ix_flight_firstseen_brin", "firstseen", postgresql_using="brin"),
+        {"postgresql_partition_by": "RANGE (firstseen)"}
+    )
 
-    flight_id = Column(Integer, primary_key=True)
+    # The partition key has to be part of the primary key
+    flight_id = Column(Integer, primary_key=True, autoincrement=True)
     callsign = Column(String)
     number = Column(String)
     icao24 = Column(String)
@@ -13,7 +30,13 @@ class Flight(Base):
     typecode = Column(String)
     origin = Column(String)
     destination = Column(String)
-    firstseen = Column(DateTime(timezone=True))
+    # Airport ids of origin/destination and the airline (ICAO) prefix of the callsign, filled by the loaders
+    origin_id = Column(SmallInteger, ForeignKey("airport.airport_id"))
+    destination_id = Column(SmallInteger, ForeignKey("airport.airport_id"))
+    airline_prefix = Column(String(3))
+    # File the flight was loaded from (flight_load); no foreign key, which would be checked for every copied row
+    load_id = Column(Integer)
+    firstseen = Column(DateTime(timezone=True), primary_key=True)
     lastseen = Column(DateTime(timezone=True))
     day = Column(DateTime)
     latitude_1 = Column(Float)
@@ -24,6 +47,66 @@ class Flight(Base):
     altitude_2 = Column(Float)
 
 
+class FlightDaily(Base):
+    """
+    Flights per origin, day (UTC), airline prefix and destination. Derived from flight, see refresh_gap_daily
+    """
+    __tablename__ = "flight_daily"
+
+    origin = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)
+    airline_prefix = Column(String, primary_key=True)
+    destination = Column(String, primary_key=True)
+    flight_count = Column(Integer)
+
+
+class FlightDailyDay(Base):
+    """
+    Days (UTC) the flight_daily rollup has been built for, see refresh_gap_daily
+    """
+    __tablename__ = "flight_daily_day"
+
+    day = Column(Date, primary_key=True)
+
+
+class FlightConnection(Base):
+    """
+    Feasible one-stop connections (layover between 1 and 24 hours). Derived from flight, see refresh_connections.
+    The flight ids cannot reference the partitioned flight table; refresh the days of changed flights instead.
+    """
+    __tablename__ = "flight_connection"
+    __table_args__ = (
+        Index("ix_flight_connection_origin_firstseen", "origin", "firstseen"),
+        Index("ix_flight_connection_destination", "destination")
+    )
+
+    first_flight_id = Column(Integer, primary_key=True)
+    second_flight_id = Column(Integer, primary_key=True)
+    origin = Column(String)
+    hub = Column(String)
+    destination = Column(String)
+    firstseen = Column(DateTime(timezone=True))
+    layover_s = Column(Integer)
+    total_s = Column(Integer)
+
+
+class FlightLoad(Base):
+    """
+    Manifest of the flight files loaded by loaders/load_flights.py: checksum, row counts and firstseen range
+    """
+    __tablename__ = "flight_load"
+
+    load_id = Column(Integer, primary_key=True, autoincrement=True)
+    file_name = Column(String, unique=True)
+    checksum = Column(String)
+    rows_read = Column(Integer)
+    rows_inserted = Column(Integer)
+    rows_skipped = Column(Integer)
+    firstseen_from = Column(DateTime(timezone=True))
+    firstseen_to = Column(DateTime(timezone=True))
+    loaded_at = Column(DateTime(timezone=True))
+
+
 class Airport(Base):
     __tablename__ = "airport"
 
@@ -16,9 +16,11 @@ from figures.heatmap import create_heatmap
 from figures.viz_bar import create_viz_bar
 from layout.appshell import create_form
 from layout.utils import create_kpi, create_display_diff, create_period_selector
+from lib.executor import run_all
 from lib.flights import get_flights
 from lib.gap import get_gap
-from lib.kpi import get_unweighted_kpi, get_weighted_kpi
+from lib.kpi import get_unweighted_kpi, get_all_weighted_kpi, PREFERENCES
+from lib import store
 from utils.airport_utils import get_airports_from, get_airports_to, get_airports_by_key, get_airport_details_ap
 
 
@@ -125,8 +127,8 @@ page_content = dmc.Container(
                     ],
                     id="ap_content"
                 ),
-                dcc.Store(id="df_unweighted_kpi"),
-                dcc.Store(id="df_unweighted_kpi_prev"),
+                dcc.Store(id="df_weighted_kpi_all"),
+                dcc.Store(id="df_weighted_kpi_all_prev"),
                 dcc.Store(id="df_weighted_kpi"),
                 dcc.Store(id="df_weighted_kpi_prev"),
             ],
@@ -151,9 +153,18 @@ dash.register_page(
 )
 
 
+def get_stored(token):
+    # The stores only hold tokens of the server-side result store (see lib/store.py); every call returns a fresh
+    # copy, so the figures may modify it. Expired results leave the page as it is until the form changes.
+    df = store.get(token)
+    if df is None:
+        raise PreventUpdate
+    return df
+
+
 @callback(
-    Output("df_unweighted_kpi", "data"),
-    Output("df_unweighted_kpi_prev", "data"),
+    Output("df_weighted_kpi_all", "data"),
+    Output("df_weighted_kpi_all_prev", "data"),
     Output("ap_404", "children"),
     Input("ap_airport_from", "value"),
     Input("ap_airport_to", "value"),
@@ -188,32 +199,30 @@ def get_unweighted_data(ap_from, ap_to, flight_date, period,
     # max stop count
     stop_cnt = int(max_stops)
 
-    # get flights + kpi for selected period
-    df_flights = get_flights(origin, destination, datetime_from, datetime_to, layover_duration, stop_cnt, "all")
-    df_gap = get_gap(origin, datetime_from, datetime_to)
-
-    # get flights + kpi for previous period
+    # previous period
     period_int = int(period)
     delta = timedelta(days=period_int)
-    datetime_from = datetime_from - delta
-    datetime_to = datetime_to - delta
-    df_flights_prev = get_flights(origin, destination, datetime_from, datetime_to, layover_duration, stop_cnt, "all")
-    df_gap_prev = get_gap(origin, datetime_from, datetime_to)
+    datetime_from_prev = datetime_from - delta
+    datetime_to_prev = datetime_to - delta
+
+    # get flights + kpi for selected and previous period at the same time
+    df_flights, df_gap, df_flights_prev, df_gap_prev = run_all([
+        (get_flights, (origin, destination, datetime_from, datetime_to, layover_duration, stop_cnt, "all",
+                       flight_duration)),
+        (get_gap, (origin, datetime_from, datetime_to)),
+        (get_flights, (origin, destination, datetime_from_prev, datetime_to_prev, layover_duration, stop_cnt, "all",
+                       flight_duration)),
+        (get_gap, (origin, datetime_from_prev, datetime_to_prev))
+    ])
 
     if not df_flights.empty and not df_flights_prev.empty:
-        # drop flights from df that take longer than flight_duration
-        flight_duration_s = flight_duration * 3600
-        df_flights = df_flights.\
-            drop(df_flights[df_flights.total_duration_s > flight_duration_s].index)
-        df_flights_prev = df_flights_prev.\
-            drop(df_flights_prev[df_flights_prev.total_duration_s > flight_duration_s].index)
-
         # Get unweighted KPIs
         df_kpi = get_unweighted_kpi(df_flights, df_gap)
         df_kpi_prev = get_unweighted_kpi(df_flights_prev, df_gap_prev)
 
         if len(df_kpi) > 1 and len(df_kpi_prev) > 1:
-            return df_kpi.to_json(orient="split"), df_kpi_prev.to_json(orient="split"), []
+            # Weight the KPIs for every preference at once, so that changing the preference is a lookup
+            return *put_weighted_data(df_kpi, df_kpi_prev), []
 
     return dash.no_update, \
            dash.no_update, \
@@ -233,62 +242,78 @@ def get_unweighted_data(ap_from, ap_to, flight_date, period,
     Output("df_weighted_kpi", "data"),
     Output("df_weighted_kpi_prev", "data"),
     Output("ap_preference", "data"),
-    Input("df_unweighted_kpi", "data"),
-    Input("df_unweighted_kpi_prev", "data"),
+    Input("df_weighted_kpi_all", "data"),
+    Input("df_weighted_kpi_all_prev", "data"),
     Input("ap_weight", "value"),
     prevent_initial_call=True
 )
-def get_weighted_data(df, df_prev, weight):
-    df_kpi = pd.read_json(df, orient="split")
-    df_kpi_prev = pd.read_json(df_prev, orient="split")
-
-    # Get weighted KPIs
-    df_weighted_kpi = get_weighted_kpi(df_kpi, weight)
-    df_weighted_kpi_prev = get_weighted_kpi(df_kpi_prev, weight)
-
-    # Align dataframes to fill missing airports with 0
-    df_weighted_kpi = df_weighted_kpi.set_index("airport")
-    df_weighted_kpi_prev = df_weighted_kpi_prev.set_index("airport")
-    df_weighted_kpi, df_weighted_kpi_prev = df_weighted_kpi.align(
-        df_weighted_kpi_prev,
-        join="outer",
-        axis=0,
-        fill_value=0
-    )
+def get_weighted_data(tokens, tokens_prev, weight):
+    # The weighted KPIs of all preferences are stored by get_unweighted_data
+    if not tokens or not tokens_prev or weight not in tokens:
+        raise PreventUpdate
 
-    # get airport details
-    df_airports = get_airport_details_ap(df_weighted_kpi)
+    return tokens[weight], tokens_prev[weight], weight
+
+
+def put_weighted_data(df_kpi, df_kpi_prev):
+    """
+    Weight the KPIs of both periods for every preference and store the results. Returns the store tokens per
+    preference for both periods
+    """
+    df_all = get_all_weighted_kpi(df_kpi)
+    df_all_prev = get_all_weighted_kpi(df_kpi_prev)
+
+    df_airports = None
+    tokens = {}
+    tokens_prev = {}
+    for preference in PREFERENCES:
+        # Align dataframes to fill missing airports with 0
+        df_weighted_kpi = df_all[preference].set_index("airport")
+        df_weighted_kpi_prev = df_all_prev[preference].set_index("airport")
+        df_weighted_kpi, df_weighted_kpi_prev = df_weighted_kpi.align(
+            df_weighted_kpi_prev,
+            join="outer",
+            axis=0,
+            fill_value=0
+        )
 
-    # replace ICAO code with IATA code (e.g. EGKK -> LGW for London Gatwick)
-    df_weighted_kpi = pd.concat(
-        [
-            df_weighted_kpi,
-            df_airports[["airport_iata_code", "airport_name"]]
-        ],
-        axis=1
-    )
-    df_weighted_kpi = df_weighted_kpi. \
-        reset_index(drop=True). \
-        rename(columns={"airport_iata_code": "airport"}). \
-        set_index("airport")
+        # get airport details (the airports are the same for all preferences)
+        if df_airports is None:
+            df_airports = get_airport_details_ap(df_weighted_kpi)
 
-    df_weighted_kpi_prev = pd.concat(
-        [
-            df_weighted_kpi_prev,
-            df_airports[["airport_iata_code", "airport_name"]]
-        ],
-        axis=1
-    )
-    df_weighted_kpi_prev = df_weighted_kpi_prev. \
-        reset_index(drop=True). \
-        rename(columns={"airport_iata_code": "airport"}). \
-        set_index("airport")
+        # replace ICAO code with IATA code (e.g. EGKK -> LGW for London Gatwick)
+        df_weighted_kpi = pd.concat(
+            [
+                df_weighted_kpi,
+                df_airports[["airport_iata_code", "airport_name"]]
+            ],
+            axis=1
+        )
+        df_weighted_kpi = df_weighted_kpi. \
+            reset_index(drop=True). \
+            rename(columns={"airport_iata_code": "airport"}). \
+            set_index("airport")
+
+        df_weighted_kpi_prev = pd.concat(
+            [
+                df_weighted_kpi_prev,
+                df_airports[["airport_iata_code", "airport_name"]]
+            ],
+            axis=1
+        )
+        df_weighted_kpi_prev = df_weighted_kpi_prev. \
+            reset_index(drop=True). \
+            rename(columns={"airport_iata_code": "airport"}). \
+            set_index("airport")
 
-    # Sort by rating
-    df_weighted_kpi = df_weighted_kpi.reset_index().sort_values("rating", ascending=False)
-    df_weighted_kpi_prev = df_weighted_kpi_prev.reset_index().sort_values("rating", ascending=False)
+        # Sort by rating
+        df_weighted_kpi = df_weighted_kpi.reset_index().sort_values("rating", ascending=False)
+        df_weighted_kpi_prev = df_weighted_kpi_prev.reset_index().sort_values("rating", ascending=False)
 
-    return df_weighted_kpi.to_json(orient="split"), df_weighted_kpi_prev.to_json(orient="split"), weight
+        tokens[preference] = store.put(df_weighted_kpi)
+        tokens_prev[preference] = store.put(df_weighted_kpi_prev)
+
+    return tokens, tokens_prev
 
 
 @callback(
@@ -300,8 +325,8 @@ def get_weighted_data(df, df_prev, weight):
     prevent_initial_call=True
 )
 def get_ap_content(df, df_prev, weight, active_tab):
-    df_kpi = pd.read_json(df, orient="split")
-    df_kpi_prev = pd.read_json(df_prev, orient="split")
+    df_kpi = get_stored(df)
+    df_kpi_prev = get_stored(df_prev)
 
     # page content
     content = []
@@ -930,17 +955,25 @@ def get_ap_content(df, df_prev, weight, active_tab):
 
 @callback(
     Output("ap_airport_to", "data"),
-    Input("ap_airport_to", "value")
+    Input("ap_airport_to", "value"),
+    State("ap_airport_to", "data")
 )
-def get_airport_to(value):
+def get_airport_to(value, data):
+    if data:
+        # The options are already in the browser, no need to send them again on every selection
+        raise PreventUpdate
     return get_airports_to()
 
 
 @callback(
     Output("ap_airport_from", "data"),
-    Input("ap_airport_from", "value")
+    Input("ap_airport_from", "value"),
+    State("ap_airport_from", "data")
 )
-def get_airport_from(value):
+def get_airport_from(value, data):
+    if data:
+        # The options are already in the browser, no need to send them again on every selection
+        raise PreventUpdate
     return get_airports_from("ap")
 
 
@@ -962,10 +995,7 @@ def put_active_tab(active_tab):
     prevent_initial_call=True
 )
 def update_viz_bar(period, kpi, df, df_prev):
-    if period == "sp":
-        df_kpi = pd.read_json(df, orient="split")
-    else:
-        df_kpi = pd.read_json(df_prev, orient="split")
+    df_kpi = get_stored(df if period == "sp" else df_prev)
 
     return create_viz_bar(df_kpi, kpi)
 
@@ -978,10 +1008,7 @@ def update_viz_bar(period, kpi, df, df_prev):
     prevent_initial_call=True
 )
 def update_viz_heatmap(period, df, df_prev):
-    if period == "sp":
-        df_kpi = pd.read_json(df, orient="split")
-    else:
-        df_kpi = pd.read_json(df_prev, orient="split")
+    df_kpi = get_stored(df if period == "sp" else df_prev)
 
     return create_heatmap(df_kpi)
 
@@ -995,10 +1022,7 @@ def update_viz_heatmap(period, df, df_prev):
     prevent_initial_call=True
 )
 def update_viz_heatmap(period, method, df, df_prev):
-    if period == "sp":
-        df_kpi = pd.read_json(df, orient="split")
-    else:
-        df_kpi = pd.read_json(df_prev, orient="split")
+    df_kpi = get_stored(df if period == "sp" else df_prev)
 
     return create_corr_heatmap(df_kpi, method)
 
@@ -1012,9 +1036,6 @@ def update_viz_heatmap(period, method, df, df_prev):
     prevent_initial_call=True
 )
 def update_viz_bar(period, kpi, df, df_prev):
-    if period == "sp":
-        df_kpi = pd.read_json(df, orient="split")
-    else:
-        df_kpi = pd.read_json(df_prev, orient="split")
+    df_kpi = get_stored(df if period == "sp" else df_prev)
 
     return create_dist(df_kpi, kpi)
@@ -2,7 +2,7 @@ import dash
 import pytz
 import dash_mantine_components as dmc
 
-from dash import html, callback, Input, Output
+from dash import html, callback, Input, Output, State
 from dash.exceptions import PreventUpdate
 from dash_iconify import DashIconify
 from datetime import datetime, timedelta
@@ -10,7 +10,7 @@ from itertools import islice
 
 from figures.map import create_map
 from layout.appshell import create_form
-from lib.flights import get_flights
+from lib.flights import get_flights, add_display_columns
 from utils.airport_utils import get_airports_from, get_airports_to, get_airports_by_key, get_airport_details_fl
 from utils.airline_utils import get_airline_details
 
@@ -190,12 +190,9 @@ def get_flightplan(ap_from, ap_to, flight_date, dep_time,
     stop_cnt = int(max_stops)
 
     # get flights
-    df_flights = get_flights(origin, destination, datetime_from, datetime_to, layover_duration, stop_cnt, "unique")
-
-    if not df_flights.empty:
-        # drop flights that take longer than flight_duration
-        flight_duration_s = flight_duration * 3600
-        df_flights = df_flights.drop(df_flights[df_flights.total_duration_s > flight_duration_s].index)
+    # get the first 10 flights according to sort_by
+    df_flights = get_flights(origin, destination, datetime_from, datetime_to, layover_duration, stop_cnt, "unique",
+                             flight_duration, sort_by, 10)
 
     if not df_flights.empty:
         # sort df_flights according to input value
@@ -221,6 +218,9 @@ def get_flightplan(ap_from, ap_to, flight_date, dep_time,
                    ]
                )
 
+    # display strings only for the rendered flights
+    df_flights = add_display_columns(df_flights.head(10))
+
     # page content
     content = []
 
@@ -254,627 +254,251 @@ def get_flightplan(ap_from, ap_to, flight_date, dep_time,
 
     # iterate over all flights in df_flights
     for index, row in islice(df_flights.iterrows(), 10):
+        legs = row.stop_count + 1
 
-        # Flight with 0 stops
-        if row.stop_count == 0:
-            # create accordion label
-            accordion_label = [dmc.Grid(
-                [
-                    # Airlines
-                    dmc.Col(
-                        [
-                            html.Div(
-                                [
-                                    dmc.Text(
-                                        row.f1_airline_code,
-                                        style={"fontSize": 20, "fontWeight": 400}
-                                    ),
-                                    dmc.Text(
-                                        "Airline",
-                                        color="dimmed",
-                                        style={"fontSize": 14, "fontWeight": 400})
-                                ],
-                            )
-                        ],
-                        lg=3,
-                        md=3,
-                        sm=6,
-                        xs=6,
-                    ),
-                    # Time + Departure/Destination Airports
-                    dmc.Col(
-                        [
-                            html.Div(
-                                [
-                                    dmc.Text(
-                                        (row.f1_time_from_str, " – ", row.f1_time_to_str),
-                                        style={"fontSize": 20, "fontWeight": 500}
-                                    ),
-                                    dmc.Text(
-                                        (
-                                            df_airports.loc[row.f1_airport_from, "airport_iata_code"],
-                                            " – ",
-                                            df_airports.loc[row.f1_airport_to, "airport_iata_code"]
-                                        ),
-                                        color="dimmed",
-                                        style={"fontSize": 14, "fontWeight": 400}
-                                    )
-                                ],
-                            )
-                        ],
-                        lg=3,
-                        md=3,
-                        sm=6,
-                        xs=6
-                    ),
-                    # Duration
-                    dmc.Col(
-                        [
-                            html.Div(
-                                [
-                                    dmc.Text(
-                                        row.total_duration,
-                                        style={"fontSize": 20, "fontWeight": 400}
-                                    ),
-                                    dmc.Text(
-                                        "Total travel time",
-                                        color="dimmed",
-                                        style={"fontSize": 14, "fontWeight": 400}
-                                    ),
-                                ],
-                            )
-                        ],
-                        lg=3,
-                        md=3,
-                        sm=6,
-                        xs=6
-                    ),
-                    # Stops
-                    dmc.Col(
-                        [
-                            html.Div(
-                                [
-                                    dmc.Text(
-                                        row.stop_count_str,
-                                        style={"fontSize": 20, "fontWeight": 400}
-                                    ),
-                                ],
-                            )
-                        ],
-                        lg=3,
-                        md=3,
-                        sm=6,
-                        xs=6
-                    ),
-                ],
-            )]
+        # create accordion label
+        accordion_label = create_accordion_label(row, legs, df_airports)
 
-            # create accordion content
-            accordion_content = dmc.Container(
-                [
-                    # 1st flight
-                    dmc.Timeline(
-                        [
-                            dmc.TimelineItem(
-                                dmc.Text(("Flight duration: ", row.f1_duration), color="dimmed"),
-                                lineVariant="dotted",
-                                title=(
-                                    row.f1_time_from_str,
-                                    " · ",
-                                    df_airports.loc[row.f1_airport_from, "airport_name"],
-                                    " (",
-                                    df_airports.loc[row.f1_airport_from, "airport_iata_code"],
-                                    ")"
-                                ),
-                            ),
-                            dmc.TimelineItem(
-                                dmc.Text(
-                                    df_airlines.loc[row.f1_airline_code, "airline_name"],
-                                    color="dimmed"
-                                ),
-                                lineVariant="dotted",
-                                title=(
-                                    row.f1_time_to_str,
-                                    " · ",
-                                    df_airports.loc[row.f1_airport_to, "airport_name"],
-                                    " (",
-                                    df_airports.loc[row.f1_airport_to, "airport_iata_code"],
-                                    ")"
-                                ),
-                            )
-                        ],
-                        bulletSize=22,
-                        lineWidth=3,
-                        active=1
-                    ),
-                ],
-                px=0,
-                mt=20,
+        # create accordion content: one timeline per flight, separated by the layover information
+        flights = []
+        for leg in range(1, legs + 1):
+            if leg > 1:
+                flights.append(create_layover(row, leg - 1, df_airports))
+            flights.append(create_timeline(row, leg, df_airports, df_airlines))
+
+        accordion_content = dmc.Container(
+            flights,
+            px=0,
+            mt=20,
+        )
+
+        # add accordion item
+        accordion_item = dmc.AccordionItem(children=accordion_content, label=accordion_label)
+        accordion_items.append(accordion_item)
+
+    # create and add map
+    fig_map = create_map(df_flights, df_airports)
+    content.append(fig_map)
+
+    # add accordion
+    subcontent = dmc.Accordion(children=accordion_items, multiple=True, iconPosition="right")
+
+    # add subcontent
+    content.append(subcontent)
+
+    return content, sort_by, dep_time, max_stops, []
+
+
+def create_accordion_label(row, legs, df_airports):
+    """
+    Accordion label of an itinerary with the given number of legs (airlines, times, duration, stops)
+    """
+    last = "f" + str(legs)
+
+    # Airlines, e.g. "SWR, DLH"
+    if legs == 1:
+        airlines = row.f1_airline_code
+    else:
+        airlines = []
+        for leg in range(1, legs + 1):
+            if leg > 1:
+                airlines.append(", ")
+            airlines.append(row["f" + str(leg) + "_airline_code"])
+        airlines = tuple(airlines)
+
+    # Stops, e.g. "1 hr 5 min in ZRH, 2 hr in FRA"
+    stops = [
+        dmc.Text(
+            row.stop_count_str,
+            style={"fontSize": 20, "fontWeight": 400}
+        ),
+    ]
+    if legs > 1:
+        layovers = []
+        for stop in range(1, legs):
+            if stop > 1:
+                layovers.append(", ")
+            layovers += [
+                row["layover_duration_" + str(stop)],
+                " in ",
+                df_airports.loc[row["f" + str(stop) + "_airport_to"], "airport_iata_code"],
+            ]
+        stops.append(
+            dmc.Text(
+                tuple(layovers),
+                color="dimmed",
+                style={"fontSize": 14, "fontWeight": 400}
             )
+        )
 
-        # Flight with 1 stop
-        elif row.stop_count == 1:
-            # create accordion label
-            accordion_label = [dmc.Grid(
+    return [dmc.Grid(
+        [
+            # Airlines
+            dmc.Col(
                 [
-                    # Airlines
-                    dmc.Col(
-                        [
-                            html.Div(
-                                [
-                                    dmc.Text(
-                                        (row.f1_airline_code, ", ", row.f2_airline_code),
-                                        style={"fontSize": 20, "fontWeight": 400}
-                                    ),
-                                    dmc.Text(
-                                        "Airlines",
-                                        color="dimmed",
-                                        style={"fontSize": 14, "fontWeight": 400})
-                                ],
-                            )
-                        ],
-                        lg=3,
-                        md=3,
-                        sm=6,
-                        xs=6,
-                    ),
-                    # Time + Departure/Destination Airports
-                    dmc.Col(
-                        [
-                            html.Div(
-                                [
-                                    dmc.Text(
-                                        (row.f1_time_from_str, " – ", row.f2_time_to_str),
-                                        style={"fontSize": 20, "fontWeight": 500}
-                                    ),
-                                    dmc.Text(
-                                        (
-                                            df_airports.loc[row.f1_airport_from, "airport_iata_code"],
-                                            " – ",
-                                            df_airports.loc[row.f2_airport_to, "airport_iata_code"]
-                                        ),
-                                        color="dimmed",
-                                        style={"fontSize": 14, "fontWeight": 400}
-                                    )
-                                ],
-                            )
-                        ],
-                        lg=3,
-                        md=3,
-                        sm=6,
-                        xs=6
-                    ),
-                    # Duration
-                    dmc.Col(
-                        [
-                            html.Div(
-                                [
-                                    dmc.Text(
-                                        row.total_duration,
-                                        style={"fontSize": 20, "fontWeight": 400}
-                                    ),
-                                    dmc.Text(
-                                        "Total travel time",
-                                        color="dimmed",
-                                        style={"fontSize": 14, "fontWeight": 400}
-                                    ),
-                                ],
-                            )
-                        ],
-                        lg=3,
-                        md=3,
-                        sm=6,
-                        xs=6
-                    ),
-                    # Stops
-                    dmc.Col(
+                    html.Div(
                         [
-                            html.Div(
-                                [
-                                    dmc.Text(
-                                        row.stop_count_str,
-                                        style={"fontSize": 20, "fontWeight": 400}
-                                    ),
-                                    dmc.Text(
-                                        (
-                                            row.layover_duration_1,
-                                            " in ",
-                                            df_airports.loc[row.f1_airport_to, "airport_iata_code"],
-                                        ),
-                                        color="dimmed",
-                                        style={"fontSize": 14, "fontWeight": 400}
-                                    )
-                                ],
-                            )
+                            dmc.Text(
+                                airlines,
+                                style={"fontSize": 20, "fontWeight": 400}
+                            ),
+                            dmc.Text(
+                                "Airline" if legs == 1 else "Airlines",
+                                color="dimmed",
+                                style={"fontSize": 14, "fontWeight": 400})
                         ],
-                        lg=3,
-                        md=3,
-                        sm=6,
-                        xs=6
-                    ),
+                    )
                 ],
-            )]
-
-            # create accordion content
-            accordion_content = dmc.Container(
+                lg=3,
+                md=3,
+                sm=6,
+                xs=6,
+            ),
+            # Time + Departure/Destination Airports
+            dmc.Col(
                 [
-                    # 1st flight
-                    dmc.Timeline(
+                    html.Div(
                         [
-                            dmc.TimelineItem(
-                                dmc.Text(("Flight duration: ", row.f1_duration), color="dimmed"),
-                                lineVariant="dotted",
-                                title=(
-                                    row.f1_time_from_str,
-                                    " · ",
-                                    df_airports.loc[row.f1_airport_from, "airport_name"],
-                                    " (",
-                                    df_airports.loc[row.f1_airport_from, "airport_iata_code"],
-                                    ")"
-                                ),
+                            dmc.Text(
+                                (row.f1_time_from_str, " – ", row[last + "_time_to_str"]),
+                                style={"fontSize": 20, "fontWeight": 500}
                             ),
-                            dmc.TimelineItem(
-                                dmc.Text(
-                                    df_airlines.loc[row.f1_airline_code, "airline_name"],
-                                    color="dimmed"
-                                ),
-                                lineVariant="dotted",
-                                title=(
-                                    row.f1_time_to_str,
-                                    " · ",
-                                    df_airports.loc[row.f1_airport_to, "airport_name"],
-                                    " (",
-                                    df_airports.loc[row.f1_airport_to, "airport_iata_code"],
-                                    ")"
-                                ),
-                            )
-                        ],
-                        bulletSize=22,
-                        lineWidth=3,
-                        active=1
-                    ),
-
-                    # Layover information
-                    dmc.Group(
-                        [
                             dmc.Text(
                                 (
-                                    row.layover_duration_1,
-                                    " layover in ",
-                                    df_airports.loc[row.f1_airport_to, "airport_name"]
-                                ),
-                                inline=True,
-                                style={"lineHeight": 1.6}
-                            )
-                        ],
-                        class_name="group-layover"
-                    ),
-
-                    # 2nd flight
-                    dmc.Timeline(
-                        [
-                            dmc.TimelineItem(
-                                dmc.Text(("Flight duration: ", row.f2_duration), color="dimmed"),
-                                lineVariant="dotted",
-                                title=(
-                                    row.f2_time_from_str,
-                                    " · ",
-                                    df_airports.loc[row.f2_airport_from, "airport_name"],
-                                    " (",
-                                    df_airports.loc[row.f2_airport_from, "airport_iata_code"],
-                                    ")"
-                                ),
-                            ),
-                            dmc.TimelineItem(
-                                dmc.Text(
-                                    df_airlines.loc[row.f2_airline_code, "airline_name"],
-                                    color="dimmed"
-                                ),
-                                lineVariant="dotted",
-                                title=(
-                                    row.f2_time_to_str,
-                                    " · ",
-                                    df_airports.loc[row.f2_airport_to, "airport_name"],
-                                    " (",
-                                    df_airports.loc[row.f2_airport_to, "airport_iata_code"],
-                                    ")"
+                                    df_airports.loc[row.f1_airport_from, "airport_iata_code"],
+                                    " – ",
+                                    df_airports.loc[row[last + "_airport_to"], "airport_iata_code"]
                                 ),
+                                color="dimmed",
+                                style={"fontSize": 14, "fontWeight": 400}
                             )
                         ],
-                        bulletSize=22,
-                        lineWidth=3,
-                        active=1
                     )
                 ],
-                px=0,
-                mt=20,
-            )
-
-        # Flight with 2 stops
-        elif row.stop_count == 2:
-            # create accordion label
-            accordion_label = [dmc.Grid(
-                [
-                    # Airlines
-                    dmc.Col(
-                        [
-                            html.Div(
-                                [
-                                    dmc.Text(
-                                        (row.f1_airline_code, ", ", row.f2_airline_code, ", ", row.f3_airline_code),
-                                        style={"fontSize": 20, "fontWeight": 400}
-                                    ),
-                                    dmc.Text(
-                                        "Airlines",
-                                        color="dimmed",
-                                        style={"fontSize": 14, "fontWeight": 400})
-                                ],
-                            )
-                        ],
-                        lg=3,
-                        md=3,
-                        sm=6,
-                        xs=6,
-                    ),
-                    # Time + Departure/Destination Airports
-                    dmc.Col(
-                        [
-                            html.Div(
-                                [
-                                    dmc.Text(
-                                        (row.f1_time_from_str, " – ", row.f3_time_to_str),
-                                        style={"fontSize": 20, "fontWeight": 500}
-                                    ),
-                                    dmc.Text(
-                                        (
-                                            df_airports.loc[row.f1_airport_from, "airport_iata_code"],
-                                            " – ",
-                                            df_airports.loc[row.f3_airport_to, "airport_iata_code"]
-                                        ),
-                                        color="dimmed",
-                                        style={"fontSize": 14, "fontWeight": 400}
-                                    )
-                                ],
-                            )
-                        ],
-                        lg=3,
-                        md=3,
-                        sm=6,
-                        xs=6
-                    ),
-                    # Duration
-                    dmc.Col(
-                        [
-                            html.Div(
-                                [
-                                    dmc.Text(
-                                        row.total_duration,
-                                        style={"fontSize": 20, "fontWeight": 400}
-                                    ),
-                                    dmc.Text(
-                                        "Total travel time",
-                                        color="dimmed",
-                                        style={"fontSize": 14, "fontWeight": 400}
-                                    ),
-                                ],
-                            )
-                        ],
-                        lg=3,
-                        md=3,
-                        sm=6,
-                        xs=6
-                    ),
-                    # Stops
-                    dmc.Col(
-                        [
-                            html.Div(
-                                [
-                                    dmc.Text(
-                                        row.stop_count_str,
-                                        style={"fontSize": 20, "fontWeight": 400}
-                                    ),
-                                    dmc.Text(
-                                        (
-                                            row.layover_duration_1,
-                                            " in ",
-                                            df_airports.loc[row.f1_airport_to, "airport_iata_code"],
-                                            ", ",
-                                            row.layover_duration_2,
-                                            " in ",
-                                            df_airports.loc[row.f2_airport_to, "airport_iata_code"],
-                                        ),
-                                        color="dimmed",
-                                        style={"fontSize": 14, "fontWeight": 400}
-                                    )
-                                ],
-                            )
-                        ],
-                        lg=3,
-                        md=3,
-                        sm=6,
-                        xs=6
-                    ),
-                ],
-            )]
-
-            # create accordion content
-            accordion_content = dmc.Container(
+                lg=3,
+                md=3,
+                sm=6,
+                xs=6
+            ),
+            # Duration
+            dmc.Col(
                 [
-                    # 1st flight
-                    dmc.Timeline(
-                        [
-                            dmc.TimelineItem(
-                                dmc.Text(("Flight duration: ", row.f1_duration), color="dimmed"),
-                                lineVariant="dotted",
-                                title=(
-                                    row.f1_time_from_str,
-                                    " · ",
-                                    df_airports.loc[row.f1_airport_from, "airport_name"],
-                                    " (",
-                                    df_airports.loc[row.f1_airport_from, "airport_iata_code"],
-                                    ")"
-                                ),
-                            ),
-                            dmc.TimelineItem(
-                                dmc.Text(
-                                    df_airlines.loc[row.f1_airline_code, "airline_name"],
-                                    color="dimmed"
-                                ),
-                                lineVariant="dotted",
-                                title=(
-                                    row.f1_time_to_str,
-                                    " · ",
-                                    df_airports.loc[row.f1_airport_to, "airport_name"],
-                                    " (",
-                                    df_airports.loc[row.f1_airport_to, "airport_iata_code"],
-                                    ")"
-                                ),
-                            )
-                        ],
-                        bulletSize=22,
-                        lineWidth=3,
-                        active=1
-                    ),
-
-                    # 1st layover information
-                    dmc.Group(
+                    html.Div(
                         [
                             dmc.Text(
-                                (
-                                    row.layover_duration_1,
-                                    " layover in ",
-                                    df_airports.loc[row.f1_airport_to, "airport_name"]
-                                ),
-                                inline=True,
-                                style={"lineHeight": 1.6}
-                            ),
-                        ],
-                        class_name="group-layover"
-                    ),
-
-                    # 2nd flight
-                    dmc.Timeline(
-                        [
-                            dmc.TimelineItem(
-                                dmc.Text(("Flight duration: ", row.f2_duration), color="dimmed"),
-                                lineVariant="dotted",
-                                title=(
-                                    row.f2_time_from_str,
-                                    " · ",
-                                    df_airports.loc[row.f2_airport_from, "airport_name"],
-                                    " (",
-                                    df_airports.loc[row.f2_airport_from, "airport_iata_code"],
-                                    ")"
-                                ),
+                                row.total_duration,
+                                style={"fontSize": 20, "fontWeight": 400}
                             ),
-                            dmc.TimelineItem(
-                                dmc.Text(
-                                    df_airlines.loc[row.f2_airline_code, "airline_name"],
-                                    color="dimmed"
-                                ),
-                                lineVariant="dotted",
-                                title=(
-                                    row.f2_time_to_str,
-                                    " · ",
-                                    df_airports.loc[row.f2_airport_to, "airport_name"],
-                                    " (",
-                                    df_airports.loc[row.f2_airport_to, "airport_iata_code"],
-                                    ")"
-                                ),
-                            )
-                        ],
-                        bulletSize=22,
-                        lineWidth=3,
-                        active=1
-                    ),
-
-                    # 2nd layover information
-                    dmc.Group(
-                        [
                             dmc.Text(
-                                (
-                                    row.layover_duration_2,
-                                    " layover in ",
-                                    df_airports.loc[row.f2_airport_to, "airport_name"]
-                                ),
-                                inline=True,
-                                style={"lineHeight": 1.6}
-                            )
-                        ],
-                        class_name="group-layover"
-                    ),
-
-                    # 3rd flight
-                    dmc.Timeline(
-                        [
-                            dmc.TimelineItem(
-                                dmc.Text(("Flight duration: ", row.f3_duration), color="dimmed"),
-                                lineVariant="dotted",
-                                title=(
-                                    row.f3_time_from_str,
-                                    " · ",
-                                    df_airports.loc[row.f3_airport_from, "airport_name"],
-                                    " (",
-                                    df_airports.loc[row.f3_airport_from, "airport_iata_code"],
-                                    ")"
-                                ),
+                                "Total travel time",
+                                color="dimmed",
+                                style={"fontSize": 14, "fontWeight": 400}
                             ),
-                            dmc.TimelineItem(
-                                dmc.Text(
-                                    df_airlines.loc[row.f3_airline_code, "airline_name"],
-                                    color="dimmed"
-                                ),
-                                lineVariant="dotted",
-                                title=(
-                                    row.f3_time_to_str,
-                                    " · ",
-                                    df_airports.loc[row.f3_airport_to, "airport_name"],
-                                    " (",
-                                    df_airports.loc[row.f3_airport_to, "airport_iata_code"],
-                                    ")"
-                                ),
-                            )
                         ],
-                        bulletSize=22,
-                        lineWidth=3,
-                        active=1
-                    ),
+                    )
                 ],
-                px=0,
-                mt=20,
-            )
-
-        else:
-            continue
+                lg=3,
+                md=3,
+                sm=6,
+                xs=6
+            ),
+            # Stops
+            dmc.Col(
+                [
+                    html.Div(
+                        stops,
+                    )
+                ],
+                lg=3,
+                md=3,
+                sm=6,
+                xs=6
+            ),
+        ],
+    )]
 
-        # add accordion item
-        accordion_item = dmc.AccordionItem(children=accordion_content, label=accordion_label)
-        accordion_items.append(accordion_item)
 
-    # create and add map
-    fig_map = create_map(df_flights, df_airports)
-    content.append(fig_map)
+def create_timeline(row, leg, df_airports, df_airlines):
+    """
+    Timeline (departure and arrival) of the given flight of an itinerary
+    """
+    f = "f" + str(leg)
 
-    # add accordion
-    subcontent = dmc.Accordion(children=accordion_items, multiple=True, iconPosition="right")
+    return dmc.Timeline(
+        [
+            dmc.TimelineItem(
+                dmc.Text(("Flight duration: ", row[f + "_duration"]), color="dimmed"),
+                lineVariant="dotted",
+                title=(
+                    row[f + "_time_from_str"],
+                    " · ",
+                    df_airports.loc[row[f + "_airport_from"], "airport_name"],
+                    " (",
+                    df_airports.loc[row[f + "_airport_from"], "airport_iata_code"],
+                    ")"
+                ),
+            ),
+            dmc.TimelineItem(
+                dmc.Text(
+                    df_airlines.loc[row[f + "_airline_code"], "airline_name"],
+                    color="dimmed"
+                ),
+                lineVariant="dotted",
+                title=(
+                    row[f + "_time_to_str"],
+                    " · ",
+                    df_airports.loc[row[f + "_airport_to"], "airport_name"],
+                    " (",
+                    df_airports.loc[row[f + "_airport_to"], "airport_iata_code"],
+                    ")"
+                ),
+            )
+        ],
+        bulletSize=22,
+        lineWidth=3,
+        active=1
+    )
 
-    # add subcontent
-    content.append(subcontent)
 
-    return content, sort_by, dep_time, max_stops, []
+def create_layover(row, stop, df_airports):
+    """
+    Layover information after the given flight of an itinerary
+    """
+    return dmc.Group(
+        [
+            dmc.Text(
+                (
+                    row["layover_duration_" + str(stop)],
+                    " layover in ",
+                    df_airports.loc[row["f" + str(stop) + "_airport_to"], "airport_name"]
+                ),
+                inline=True,
+                style={"lineHeight": 1.6}
+            )
+        ],
+        class_name="group-layover"
+    )
 
 
 @callback(
     Output("fl_airport_to", "data"),
-    Input("fl_airport_to", "value")
+    Input("fl_airport_to", "value"),
+    State("fl_airport_to", "data")
 )
-def get_airport_to(value):
+def get_airport_to(value, data):
+    if data:
+        # The options are already in the browser, no need to send them again on every selection
+        raise PreventUpdate
     return get_airports_to()
 
 
 @callback(
     Output("fl_airport_from", "data"),
-    Input("fl_airport_from", "value")
+    Input("fl_airport_from", "value"),
+    State("fl_airport_from", "data")
 )
-def get_airport_from(value):
+def get_airport_from(value, data):
+    if data:
+        # The options are already in the browser, no need to send them again on every selection
+        raise PreventUpdate
     return get_airports_from("fl")
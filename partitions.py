@@ -0,0 +1,175 @@
+from datetime import date, datetime
+from sqlalchemy import select, func, text
+import pytz
+from db import engine
+from models import Flight
+
+
+# Monthly partitions of the flight table (see Flight.__table_args__), named flight_YYYY_MM. The months of the
+# DatePicker (layout/appshell.py) are created by create_partitions; the loaders add further months as needed.
+FIRST_MONTH = date(2019, 1, 1)
+LAST_MONTH = date(2022, 6, 1)
+
+# Months whose partition is known to exist, per process (see create_partition)
+_created = set()
+
+
+def get_month(value):
+    """
+    First day of the (UTC) month of a date or datetime
+    """
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        value = value.astimezone(pytz.utc)
+    return date(value.year, value.month, 1)
+
+
+def get_next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def get_months(month_from, month_to):
+    """
+    First days of all months between month_from and month_to (both included)
+    """
+    months = []
+    month = get_month(month_from)
+    while month <= get_month(month_to):
+        months.append(month)
+        month = get_next_month(month)
+    return months
+
+
+def get_partition_name(month, table=Flight.__tablename__):
+    return f"{table}_{month.year}_{month.month:02d}"
+
+
+def is_partitioned(connection, table=Flight.__tablename__):
+    """
+    Check if table is a partitioned table (flight tables created before the partitioning are not)
+    """
+    stmt = text("select relkind = 'p' from pg_class where oid = to_regclass(:table)")
+    return bool(connection.execute(stmt, {"table": table}).scalar())
+
+
+def create_partition(connection, month, table=Flight.__tablename__):
+    """
+    Create the partition of table for the month of month unless it exists. Returns the partition name.
+    """
+    month = get_month(month)
+    name = get_partition_name(month, table)
+    if (table, month) not in _created:
+        start = pytz.utc.localize(datetime.combine(month, datetime.min.time()))
+        end = pytz.utc.localize(datetime.combine(get_next_month(month), datetime.min.time()))
+        connection.execute(text(
+            f"create table if not exists {name} partition of {table} "
+            f"for values from ('{start.isoformat()}') to ('{end.isoformat()}')"
+        ))
+        _created.add((table, month))
+    return name
+
+
+def create_partitions(month_from=FIRST_MONTH, month_to=LAST_MONTH):
+    """
+    Create the missing partitions between month_from and month_to, each in its own short transaction (creating a
+    partition locks the flight table). Returns the partition names.
+    """
+    names = []
+    for month in get_months(month_from, month_to):
+        with engine.begin() as connection:
+            names.append(create_partition(connection, month))
+    return names
+
+
+def get_partitions(connection):
+    """
+    Names of the existing flight partitions, oldest first
+    """
+    stmt = text(
+        "select c.relname from pg_inherits i join pg_class c on c.oid = i.inhrelid "
+        "where i.inhparent = to_regclass(:table) order by c.relname"
+    )
+    return list(connection.execute(stmt, {"table": Flight.__tablename__}).scalars())
+
+
+def compact_partition(month):
+    """
+    Rewrite the partition of month in (origin_id, firstseen) order and refresh its statistics. This removes
+    dead rows and keeps the flights of an airport together; only the one partition is locked.
+    """
+    name = get_partition_name(get_month(month))
+
+    # The partition's part of the (origin_id, firstseen) index
+    stmt = text(
+        "select c.relname from pg_inherits i join pg_class c on c.oid = i.inhrelid "
+        "join pg_index x on x.indexrelid = c.oid "
+        "where i.inhparent = to_regclass('ix_flight_origin_id_firstseen') and x.indrelid = to_regclass(:name)"
+    )
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        index = connection.execute(stmt, {"name": name}).scalar()
+        if index is None:
+            connection.execute(text(f"vacuum (full, analyze) {name}"))
+        else:
+            connection.execute(text(f"cluster {name} using {index}"))
+            connection.execute(text(f"analyze {name}"))
+    return name
+
+
+def migrate_flight_table():
+    """
+    Move the rows of an unpartitioned flight table into a partitioned one, month by month, then replace the old
+    table. Needs the columns added by loaders.add_flight_keys. Flights without firstseen cannot be partitioned
+    and are left out. Run it while nothing writes to flight; readers keep using the old table until the switch.
+    Returns the number of rows copied.
+    """
+    with engine.begin() as connection:
+        if is_partitioned(connection):
+            return 0
+        first, last = connection.execute(select(func.min(Flight.firstseen), func.max(Flight.firstseen))).one()
+
+        # Same columns and defaults (the flight_id sequence is shared), partitioned by firstseen
+        connection.execute(text(
+            "create table flight_partitioned (like flight including defaults) partition by range (firstseen)"
+        ))
+        connection.execute(text("alter table flight_partitioned alter column firstseen set not null"))
+        connection.execute(text(
+            "alter table flight_partitioned add constraint flight_partitioned_pkey primary key (flight_id, firstseen)"
+        ))
+
+    rows = 0
+    if first is not None:
+        for month in get_months(first, last):
+            with engine.begin() as connection:
+                name = create_partition(connection, month, "flight_partitioned")
+                bounds = {
+                    "start": pytz.utc.localize(datetime.combine(month, datetime.min.time())),
+                    "end": pytz.utc.localize(datetime.combine(get_next_month(month), datetime.min.time()))
+                }
+                rows += connection.execute(text(
+                    f"insert into {name} select * from flight where firstseen >= :start and firstseen < :end"
+                ), bounds).rowcount
+            print("Copied", name)
+
+    # Switch the tables; the foreign keys of flight_connection (if any) are dropped with the old table
+    with engine.begin() as connection:
+        connection.execute(text("alter sequence if exists flight_flight_id_seq owned by none"))
+        connection.execute(text("drop table flight cascade"))
+        connection.execute(text("alter table flight_partitioned rename to flight"))
+        connection.execute(text("alter table flight rename constraint flight_partitioned_pkey to flight_pkey"))
+        for month in get_months(first, last) if first is not None else []:
+            connection.execute(text(
+                f"alter table {get_partition_name(month, 'flight_partitioned')} rename to {get_partition_name(month)}"
+            ))
+        connection.execute(text("alter sequence if exists flight_flight_id_seq owned by flight.flight_id"))
+        connection.execute(text(
+            "alter table flight "
+            "add foreign key (origin_id) references airport (airport_id), "
+            "add foreign key (destination_id) references airport (airport_id)"
+        ))
+    _created.clear()
+
+    # Indexes of the model, built once the rows are in place
+    with engine.begin() as connection:
+        for index in Flight.__table__.indexes:
+            index.create(connection, checkfirst=True)
+
+    return rows
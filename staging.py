@@ -0,0 +1,243 @@
+import csv
+import glob
+import hashlib
+import os
+from os import environ
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+# Validated flights in Parquet, one directory per month of firstseen (month=YYYY-MM) with one file per flight list,
+# written by loaders/stage_flights.py. The staged files are read by the flight loader and by read_flights. Their
+# metadata names the flight list (FLIGHT_LIST_KEY) and its checksum (CHECKSUM_KEY), so the loader records staged
+# flights under the flight list they came from.
+STAGING_DIR = environ.get("STAGING_DIR", "../data/staging")
+
+# Airports that were renamed, by the code in the flight lists
+AIRPORT_FIX = {
+    "KS67": "KMAN", "LSMF": "LSZM", "LTFG": "LTGP", "SCTJ": "SBAE", "YADY": "YADI", "YPEC": "YLMQ", "YSCH": "YCFS",
+    "LSZM": "LFSB"
+}
+
+# Columns of the flight lists, by position (the header is skipped)
+CSV_COLUMNS = [
+    "callsign", "number", "icao24", "registration", "typecode", "origin", "destination", "firstseen", "lastseen",
+    "day", "latitude_1", "longitude_1", "altitude_1", "latitude_2", "longitude_2", "altitude_2"
+]
+
+# Checks of a flight, in this order; a skipped flight is counted for the first check it fails
+SKIP_REASONS = ["airline", "origin", "destination"]
+
+# Columns of the staged flights. Airports and airline prefixes have few distinct values and are dictionary-encoded
+# (categories in pandas); day is in UTC like firstseen, but without time zone as in the flight table.
+SCHEMA = pa.schema([
+    ("callsign", pa.string()),
+    ("number", pa.string()),
+    ("icao24", pa.string()),
+    ("registration", pa.string()),
+    ("typecode", pa.string()),
+    ("origin", pa.dictionary(pa.int16(), pa.string())),
+    ("destination", pa.dictionary(pa.int16(), pa.string())),
+    ("airline_prefix", pa.dictionary(pa.int16(), pa.string())),
+    ("firstseen", pa.timestamp("us", tz="UTC")),
+    ("lastseen", pa.timestamp("us", tz="UTC")),
+    ("day", pa.timestamp("us")),
+    ("latitude_1", pa.float64()),
+    ("longitude_1", pa.float64()),
+    ("altitude_1", pa.float64()),
+    ("latitude_2", pa.float64()),
+    ("longitude_2", pa.float64()),
+    ("altitude_2", pa.float64())
+])
+
+# Directories of the months: month=YYYY-MM
+PARTITIONING = ds.partitioning(pa.schema([("month", pa.string())]), flavor="hive")
+
+# Keys of the Parquet metadata
+FLIGHT_LIST_KEY = b"flight_list"
+CHECKSUM_KEY = b"checksum"
+
+
+def get_checksum(path):
+    """
+    SHA-256 of a file, read in blocks of 1 MB
+    """
+    checksum = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+def read_baseline(path, column):
+    """
+    Values of one column of a baseline file (valid airports or airlines)
+    """
+    baseline = set()
+    with open(path) as file:
+        reader = csv.reader(file, delimiter=",")
+        next(reader)  # skip header
+        for row in reader:
+            baseline.add(row[column])
+    return baseline
+
+
+def read_csv(path, chunk_rows):
+    """
+    Chunks of chunk_rows flights of a flight list, all columns as strings ("" if empty)
+    """
+    return pd.read_csv(
+        path, header=None, skiprows=1, names=CSV_COLUMNS, usecols=range(len(CSV_COLUMNS)), dtype=str,
+        na_filter=False, chunksize=chunk_rows
+    )
+
+
+def fix_airports(airports):
+    """
+    Airports of a column with the renamed airports replaced by their current code (in one step: LSMF becomes LSZM)
+    """
+    fix = airports.isin(AIRPORT_FIX.keys())
+    return airports.mask(fix, airports[fix].map(AIRPORT_FIX))
+
+
+def validate(chunk, airport_baseline, airline_baseline):
+    """
+    Fix the airports of a chunk of flights and check the airline prefix and both airports against the baselines.
+    Returns the mask of the valid flights and the number of skipped flights per reason.
+    """
+    # Some flights have the wrong airports assigned (mainly due to renaming of airports), so
+    # we have to change this first before validating against the already cleaned list of airports
+    chunk["origin"] = fix_airports(chunk["origin"])
+    chunk["destination"] = fix_airports(chunk["destination"])
+    # Converting to strings of length 3 cuts the callsigns much faster than .str[0:3]
+    chunk["airline_prefix"] = chunk["callsign"].to_numpy().astype("U3")
+
+    checks = {
+        "airline": chunk["airline_prefix"].isin(airline_baseline),
+        "origin": chunk["origin"].isin(airport_baseline),
+        "destination": chunk["destination"].isin(airport_baseline)
+    }
+    valid = pd.Series(True, index=chunk.index)
+    skipped = {}
+    for reason in SKIP_REASONS:
+        skipped[reason] = int((valid & ~checks[reason]).sum())
+        valid &= checks[reason]
+    return valid, skipped
+
+
+def get_table(flights):
+    """
+    Arrow table with the types of SCHEMA from validated flights as read by read_csv
+    """
+    columns = {}
+    for field in SCHEMA:
+        values = flights[field.name]
+        if pa.types.is_timestamp(field.type):
+            values = pd.to_datetime(values, utc=True)
+            if field.type.tz is None:
+                values = values.dt.tz_localize(None)
+        elif pa.types.is_floating(field.type):
+            values = pd.to_numeric(values.mask(values == ""))
+        columns[field.name] = values
+    return pa.Table.from_pandas(pd.DataFrame(columns), schema=SCHEMA, preserve_index=False)
+
+
+def get_staged_path(month, name, directory=STAGING_DIR):
+    """
+    Staged file of a flight list (name without extension) for a month ("YYYY-MM")
+    """
+    return os.path.join(directory, f"month={month}", f"{name}_{month}.parquet")
+
+
+def get_staged_paths(file_name, directory=STAGING_DIR):
+    """
+    Staged files of a flight list (file name with extension), all months
+    """
+    name = os.path.splitext(file_name)[0]
+    return sorted(glob.glob(os.path.join(directory, "month=*", f"{glob.escape(name)}_????-??.parquet")))
+
+
+def get_temporary_path(path):
+    # Hidden until complete: files starting with "." are ignored by read_flights
+    return os.path.join(os.path.dirname(path), "." + os.path.basename(path))
+
+
+def stage_file(path, chunk_rows, airport_baseline, airline_baseline, directory=STAGING_DIR):
+    """
+    Validate the flights of a flight list in chunks of chunk_rows and write them to one Parquet file per month.
+    The files replace those of an earlier version of the flight list once they are complete, and name the flight
+    list and its checksum in their metadata. Returns the rows written and skipped per reason and the months.
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    schema = SCHEMA.with_metadata({FLIGHT_LIST_KEY: os.path.basename(path), CHECKSUM_KEY: get_checksum(path)})
+    writers = {}
+    count_write = 0
+    count_skip = dict.fromkeys(SKIP_REASONS, 0)
+
+    try:
+        for chunk in read_csv(path, chunk_rows):
+            valid, skipped = validate(chunk, airport_baseline, airline_baseline)
+            flights = chunk[valid]
+            for reason, count in skipped.items():
+                count_skip[reason] += count
+
+            # firstseen is in UTC ("2019-01-01 00:00:18+00:00")
+            for month, rows in flights.groupby(flights["firstseen"].str[0:7]):
+                if month not in writers:
+                    staged = get_staged_path(month, name, directory)
+                    os.makedirs(os.path.dirname(staged), exist_ok=True)
+                    writers[month] = pq.ParquetWriter(get_temporary_path(staged), schema)
+                writers[month].write_table(get_table(rows))
+            count_write += len(flights)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    # Remove the months that the earlier version had, then move the new files in place
+    staged = {get_staged_path(month, name, directory) for month in writers}
+    for old in get_staged_paths(os.path.basename(path), directory):
+        if old not in staged:
+            os.remove(old)
+    for path in staged:
+        os.replace(get_temporary_path(path), path)
+
+    return count_write, count_skip, sorted(writers)
+
+
+def read_source(path):
+    """
+    Flight list (file name) and checksum of the flight list that a staged file was written from
+    """
+    metadata = pq.read_schema(path).metadata or {}
+    if FLIGHT_LIST_KEY not in metadata:
+        raise ValueError(f"{path} does not name its flight list, stage the flight list again")
+    return metadata[FLIGHT_LIST_KEY].decode(), metadata[CHECKSUM_KEY].decode()
+
+
+def read_staged(path, chunk_rows):
+    """
+    Chunks of chunk_rows flights of a staged file, as pandas DataFrames with typed timestamps and floats and the
+    dictionary-encoded columns decoded to strings
+    """
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+        flights = batch.to_pandas()
+        for column in ["origin", "destination", "airline_prefix"]:
+            flights[column] = flights[column].astype(object)
+        yield flights
+
+
+def read_flights(month_from=None, month_to=None, columns=None, where=None, directory=STAGING_DIR):
+    """
+    Staged flights of the months between month_from and month_to ("YYYY-MM", all months if not set) for analyses
+    without the database. columns selects the columns and where is a pyarrow.dataset expression, e.g.
+    ds.field("origin") == "LSZH"; both are applied while reading. The dictionary-encoded columns are categories.
+    """
+    dataset = ds.dataset(directory, format="parquet", partitioning=PARTITIONING)
+    month = ds.field("month")
+    if month_from is not None:
+        where = month >= month_from if where is None else where & (month >= month_from)
+    if month_to is not None:
+        where = month <= month_to if where is None else where & (month <= month_to)
+    return dataset.to_table(columns=columns, filter=where).to_pandas()
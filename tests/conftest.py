@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The tests run without a database: db.py only needs a URL to create the (unconnected) engine
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/flightexplorer_test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,43 @@
+import pandas as pd
+from utils.airport_utils import build_airport_index
+
+
+def get_airports():
+    # The US and Russia have airports on two continents each
+    rows = [
+        ("KJFK", "JFK", "NA", "US", "US-NY", "New York"),
+        ("KLGA", "LGA", "NA", "US", "US-NY", "New York"),
+        ("KLAX", "LAX", "NA", "US", "US-CA", "Los Angeles"),
+        ("PHNL", "HNL", "OC", "US", "US-HI", "Honolulu"),
+        ("UUEE", "SVO", "EU", "RU", "RU-MOS", "Moscow"),
+        ("UHWW", "VVO", "AS", "RU", "RU-PRI", "Vladivostok"),
+        ("LSZH", "ZRH", "EU", "CH", "CH-ZH", "Zurich"),
+        ("LSZM", None, "EU", "CH", "CH-BS", None)
+    ]
+    columns = [
+        "airport_ident", "airport_iata_code", "airport_continent", "airport_iso_country", "airport_iso_region",
+        "airport_municipality"
+    ]
+    return pd.DataFrame(rows, columns=columns)
+
+
+def test_country_on_two_continents():
+    index = build_airport_index(get_airports())
+
+    assert index["cou#US"] == ("KJFK", "KLAX", "KLGA", "PHNL")
+    assert index["cou#RU"] == ("UHWW", "UUEE")
+    assert index["con#EU"] == ("LSZH", "LSZM", "UUEE")
+    assert index["con#OC"] == ("PHNL",)
+
+
+def test_regions_municipalities_and_airports():
+    index = build_airport_index(get_airports())
+
+    assert index["reg#US-NY"] == ("KJFK", "KLGA")
+    assert index["reg#CH-BS"] == ("LSZM",)
+    assert index["mun#US#US-NY#New York"] == ("KJFK", "KLGA")
+    assert index["mun#RU#RU-PRI#Vladivostok"] == ("UHWW",)
+    assert index["air#HNL"] == ("PHNL",)
+    # Airports without a municipality or IATA code have no mun#/air# key
+    assert not any(key.startswith("mun#CH#CH-BS") for key in index)
+    assert len([key for key in index if key.startswith("air#")]) == 7
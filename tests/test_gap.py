@@ -0,0 +1,32 @@
+from datetime import date, datetime, timezone
+from time import monotonic
+import lib.gap as gap
+
+
+def test_partial_rollup(monkeypatch):
+    # Built with --from 2022-03-02 --to 2022-03-03 only
+    monkeypatch.setattr(gap, "_gap_daily", (monotonic(), frozenset([date(2022, 3, 2), date(2022, 3, 3)])))
+
+    assert gap.has_gap_daily()
+    assert gap.has_gap_daily(date(2022, 3, 2), date(2022, 3, 3))
+    assert not gap.has_gap_daily(date(2022, 3, 1), date(2022, 3, 3))
+    assert not gap.has_gap_daily(date(2022, 3, 3), date(2022, 3, 4))
+
+
+def test_missing_rollup_is_cached(monkeypatch):
+    checks = []
+    monkeypatch.setattr(gap, "_gap_daily", (None, None))
+    monkeypatch.setattr(gap, "load_gap_daily_days", lambda: checks.append(1))
+
+    assert not gap.has_gap_daily()
+    assert not gap.has_gap_daily(date(2022, 3, 1), date(2022, 3, 1))
+    assert len(checks) == 1
+
+
+def test_whole_days():
+    utc = timezone.utc
+    assert gap.get_whole_days(datetime(2022, 3, 1, tzinfo=utc), datetime(2022, 3, 2, 23, 59, 59, tzinfo=utc)) == \
+        (date(2022, 3, 1), date(2022, 3, 2))
+    assert gap.get_whole_days(datetime(2022, 3, 1, tzinfo=utc), datetime(2022, 3, 3, tzinfo=utc)) == \
+        (date(2022, 3, 1), date(2022, 3, 2))
+    assert gap.get_whole_days(datetime(2022, 3, 1, 6, tzinfo=utc), datetime(2022, 3, 3, tzinfo=utc)) is None
@@ -0,0 +1,59 @@
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+import pytest
+from lib.flight_index import build_flight_index
+from lib.flights import search_connections, format_flights, get_top_flights
+
+START = datetime(2022, 3, 1, 12, tzinfo=timezone.utc)
+END = datetime(2022, 3, 1, 17, 59, 59, tzinfo=timezone.utc)
+
+
+def get_index(n_flights=3000, n_airports=30, days=3, seed=1):
+    # Random legs of 1 to 5 hours between 30 airports over 3 days, so that long connections are plentiful
+    rng = np.random.default_rng(seed)
+    airports = np.array(["A%03d" % i for i in range(n_airports)])
+    origin = rng.integers(0, n_airports, n_flights)
+    destination = (origin + rng.integers(1, n_airports, n_flights)) % n_airports
+    departure = pd.Timestamp("2022-03-01", tz="UTC") + pd.to_timedelta(rng.integers(0, days * 86400, n_flights), "s")
+    duration = pd.to_timedelta(rng.integers(3600, 5 * 3600, n_flights), "s")
+    df = pd.DataFrame({
+        "airline": ["X%02d" % airline for airline in rng.integers(0, 20, n_flights)],
+        "origin": airports[origin],
+        "destination": airports[destination],
+        "firstseen": departure,
+        "lastseen": departure + duration
+    })
+    return build_flight_index([df])
+
+
+def search(index, stop_duration, max_stops, max_duration, flight_filter, sort_by=None, limit=None):
+    df = search_connections(
+        index, ["A000", "A001"], ["A007"], START, END, stop_duration, max_stops, max_duration * 3600,
+        flight_filter, sort_by or "dur", limit
+    )
+    return get_top_flights(format_flights(df, flight_filter), sort_by or "dur", limit).reset_index(drop=True)
+
+
+@pytest.mark.parametrize("sort_by", ["dur", "dep", "arr", "stp"])
+def test_form_defaults(sort_by):
+    # 9 stops, 24 h layovers and 48 h duration used to expand every partial path and run out of memory
+    flights = search(get_index(), 24, 9, 48, "unique", sort_by, 10)
+
+    assert len(flights) == 10
+    assert (flights["total_duration_s"] <= 48 * 3600).all()
+
+
+@pytest.mark.parametrize("flight_filter", ["all", "unique"])
+@pytest.mark.parametrize("sort_by", ["dur", "dep", "arr", "stp"])
+def test_limit_keeps_top_flights(flight_filter, sort_by):
+    index = get_index()
+    expected = get_top_flights(search(index, 8, 4, 30, flight_filter), sort_by, 10).reset_index(drop=True)
+    flights = search(index, 8, 4, 30, flight_filter, sort_by, 10)
+
+    # The limited search may stop at fewer legs, and for "unique" pick another itinerary of equal duration on a route
+    if flight_filter == "unique":
+        columns = ["total_duration_s", "stop_count"]
+    else:
+        columns = [column for column in expected.columns if column in flights.columns]
+    pd.testing.assert_frame_equal(flights[columns], expected[columns])
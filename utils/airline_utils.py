@@ -1,24 +1,75 @@
+import numpy as np
 import pandas as pd
+import threading
 
 from models import Airline
-from db import Session
+from db import read_only_connection
 from sqlalchemy import select
 from sqlalchemy.orm import aliased
 
 
-def get_airline_details(df):
-    f1_airline = pd.Series(df["f1_airline_code"].dropna().unique())
-    f2_airline = pd.Series(df["f2_airline_code"].dropna().unique())
-    f3_airline = pd.Series(df["f3_airline_code"].dropna().unique())
-    airlines = pd.concat([f1_airline, f2_airline, f3_airline]).tolist()
+# Airline details, loaded once per process (see get_airline_table)
+_airlines = None
+_airlines_lock = threading.Lock()
+
+
+def get_airline_table():
+    """
+    Airline details as arrays indexed by airline id (icao, name) plus the ICAO code -> id dict
+    """
+    table = _airlines
+    if table is None:
+        with _airlines_lock:
+            if _airlines is None:
+                load_airline_table()
+            table = _airlines
+    return table
+
+
+def load_airline_table():
+    """
+    Load all airlines with an ICAO code into the arrays of get_airline_table
+    """
+    global _airlines
 
-    session = Session()
     a = aliased(Airline)
     stmt = \
         select(a.airline_icao, a.airline_name).\
         where(
-            a.airline_icao.in_(airlines)
+            a.airline_icao.is_not(None)
+        ).\
+        order_by(
+            a.airline_id
         )
-    airline_df = pd.read_sql(stmt, session.bind).set_index("airline_icao")
+    with read_only_connection() as connection:
+        airlines = pd.read_sql(stmt, connection).drop_duplicates(subset=["airline_icao"])
+
+    _airlines = {
+        "ids": {icao: airline_id for airline_id, icao in enumerate(airlines["airline_icao"])},
+        "airline_icao": airlines["airline_icao"].to_numpy(dtype=object),
+        "airline_name": airlines["airline_name"].to_numpy(dtype=object)
+    }
+
+
+def get_airline_ids(airlines):
+    """
+    Airline ids of the ICAO codes in airlines (-1 if unknown)
+    """
+    ids = pd.Series(airlines, dtype=object).map(get_airline_table()["ids"])
+    return ids.fillna(-1).to_numpy(dtype=np.int64)
+
+
+def get_airline_details(df):
+    # f1_airline_code, f2_airline_code, ... (one column per flight of the itinerary)
+    columns = [column for column in df.columns if column.endswith("_airline_code")]
+    airlines = pd.concat([pd.Series(df[column].dropna().unique()) for column in columns]).unique()
+
+    table = get_airline_table()
+    ids = get_airline_ids(airlines)
+    ids = ids[ids >= 0]
+    airline_df = pd.DataFrame(
+        {"airline_name": table["airline_name"][ids]},
+        index=pd.Index(table["airline_icao"][ids], name="airline_icao")
+    )
 
     return airline_df
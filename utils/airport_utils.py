@@ -1,14 +1,97 @@
+import json
+import numpy as np
 import pandas as pd
+import plotly
+import threading
+import time
 
 from models import Airport, Country, Region
-from db import Session
-from sqlalchemy import select
+from db import read_only_connection
+from os import environ
+from sqlalchemy import select, func
 from sqlalchemy.orm import aliased
 
 
+# Option lists of the airport dropdowns ("from_fl", "from_ap" and "to") and their JSON, the key index of
+# get_airports_by_key and the airport details. Built on first use and rebuilt when the airport tables change (see
+# check_airport_tables)
+_options = {}
+_options_json = {}
+_index = None
+_details = None
+_options_lock = threading.Lock()
+
+# Seconds between two checks of the airport tables, and the last check (time, fingerprint)
+AIRPORT_CHECK_INTERVAL = int(environ.get("AIRPORT_CHECK_INTERVAL", 300))
+_checked = (0, None)
+
+
+def get_airport_options(name):
+    """
+    Cached option list of an airport dropdown: "from_fl", "from_ap" or "to". Only the first call per airport
+    data reads the database
+    """
+    check_airport_tables()
+    if name not in _options:
+        with _options_lock:
+            if name not in _options:
+                options = load_airports_to() if name == "to" else load_airports_from(name[-2:])
+                _options_json[name] = json.dumps(options, cls=plotly.utils.PlotlyJSONEncoder)
+                _options[name] = options
+    return _options[name]
+
+
+def get_airport_options_json(name):
+    """
+    Same as get_airport_options, serialized to JSON once
+    """
+    get_airport_options(name)
+    return _options_json[name]
+
+
+def clear_airport_cache():
+    """
+    Drop the cached airport data, e.g. after loading new airports
+    """
+    global _index, _details
+    with _options_lock:
+        _options.clear()
+        _options_json.clear()
+        _index = None
+        _details = None
+
+
+def check_airport_tables():
+    """
+    Clear the cached airport data if the airport, country or region table changed since the last check. The
+    tables are checked at most every AIRPORT_CHECK_INTERVAL seconds
+    """
+    global _checked
+    checked_at, fingerprint = _checked
+    if time.monotonic() - checked_at < AIRPORT_CHECK_INTERVAL:
+        return
+
+    columns = []
+    for key in [Airport.airport_id, Country.country_id, Region.region_id]:
+        columns += [select(func.count(key)).scalar_subquery(), select(func.max(key)).scalar_subquery()]
+    stmt = select(*columns)
+    with read_only_connection() as connection:
+        new_fingerprint = tuple(connection.execute(stmt).one())
+
+    if fingerprint is not None and new_fingerprint != fingerprint:
+        clear_airport_cache()
+    _checked = (time.monotonic(), new_fingerprint)
+
+
 def get_airports_from(page):
-    session = Session()
+    return get_airport_options("from_" + page)
+
 
+def get_airports_to():
+    return get_airport_options("to")
+
+
+def load_airports_from(page):
     a = aliased(Airport)
     b = aliased(Country)
     c = aliased(Region)
@@ -24,7 +107,8 @@ def get_airports_from(page):
             a.airport_type.in_(["large_airport", "medium_airport"]),
             a.airport_scheduled_service == "yes"
         )
-    airports = pd.read_sql(airport_stmt, session.bind)
+    with read_only_connection() as connection:
+        airports = pd.read_sql(airport_stmt, connection)
 
     # Continents
     df_con = pd.DataFrame(columns=["label", "value", "group"])
@@ -84,9 +168,7 @@ def get_airports_from(page):
     return df_from.to_dict("records")
 
 
-def get_airports_to():
-    session = Session()
-
+def load_airports_to():
     a = aliased(Airport)
     airport_stmt = \
         select(a.airport_iata_code, a.airport_name).\
@@ -94,7 +176,8 @@ def get_airports_to():
             a.airport_type.in_(["large_airport", "medium_airport"]),
             a.airport_scheduled_service == "yes"
         )
-    airports = pd.read_sql(airport_stmt, session.bind)
+    with read_only_connection() as connection:
+        airports = pd.read_sql(airport_stmt, connection)
 
     df_air = pd.DataFrame(columns=["label", "value"])
     df_air["label"] = (airports["airport_name"] + " (" + airports["airport_iata_code"] + ")").drop_duplicates()
@@ -105,101 +188,149 @@ def get_airports_to():
 
 
 def get_airports_by_key(selected_value):
-    session = Session()
-    search_string = selected_value.split("#")
-    search_level = search_string[0]
-    search_value = search_string[1]
+    """
+    Resolve a dropdown value (con#, cou#, reg#, mun# or air# key) to the ICAO idents of its airports. The result
+    is a shared tuple from the in-memory airport index and must not be modified.
+    """
+    index = get_airport_index()
+    if selected_value.split("#")[0] not in ["con", "cou", "reg", "mun", "air"]:
+        # Should never happen, but in the worst case fall back to Zurich
+        selected_value = "air#ZRH"
+    return index.get(selected_value, ())
 
-    a = aliased(Airport)
 
-    if search_level == "con":
-        stmt = \
-            select(a.airport_ident).\
-            where(
-                a.airport_continent == search_value,
-                a.airport_type.in_(["large_airport", "medium_airport"]),
-                a.airport_scheduled_service == "yes"
-            )
-    elif search_level == "cou":
-        stmt = \
-            select(a.airport_ident).\
-            where(
-                a.airport_iso_country == search_value,
-                a.airport_type.in_(["large_airport", "medium_airport"]),
-                a.airport_scheduled_service == "yes"
-            )
-    elif search_level == "reg":
-        stmt = \
-            select(a.airport_ident).\
-            where(
-                a.airport_iso_region == search_value,
-                a.airport_type.in_(["large_airport", "medium_airport"]),
-                a.airport_scheduled_service == "yes"
-            )
-    elif search_level == "mun":
-        iso_region = search_string[2]
-        municipality = search_string[3]
-        stmt = \
-            select(a.airport_ident).\
-            where(
-                a.airport_iso_country == search_value,
-                a.airport_iso_region == iso_region,
-                a.airport_municipality == municipality,
-                a.airport_type.in_(["large_airport", "medium_airport"]),
-                a.airport_scheduled_service == "yes"
-            )
-    elif search_level == "air":
-        stmt = \
-            select(a.airport_ident).\
-            where(
-                a.airport_iata_code == search_value,
-                a.airport_type.in_(["large_airport", "medium_airport"]),
-                a.airport_scheduled_service == "yes"
-            )
-    else:
-        # Should never happen, but in the worst case mock an SQL statement
-        stmt = \
-            select(a.airport_ident). \
-            where(
-                a.airport_iata_code == "ZRH",
-                a.airport_type.in_(["large_airport", "medium_airport"]),
-                a.airport_scheduled_service == "yes"
-            )
+def get_airport_index():
+    """
+    Map every con#, cou#, reg#, mun# and air# key to the airports it contains, built once per airport data
+    """
+    check_airport_tables()
+    index = _index
+    if index is None:
+        with _options_lock:
+            if _index is None:
+                load_airport_index()
+            index = _index
+    return index
 
-    airports = pd.read_sql(stmt, session.bind)
-    airport_list = airports["airport_ident"].values.tolist()
-    return airport_list
 
+def load_airport_index():
+    """
+    Build the key index from the airports (see build_airport_index)
+    """
+    global _index
 
-def get_airport_details_fl(df):
-    f1_airport_from = pd.Series(df["f1_airport_from"].dropna().unique())
-    f1_airport_to = pd.Series(df["f1_airport_to"].dropna().unique())
-    f2_airport_to = pd.Series(df["f2_airport_to"].dropna().unique())
-    f3_airport_to = pd.Series(df["f3_airport_to"].dropna().unique())
-    airports = pd.concat([f1_airport_from, f1_airport_to, f2_airport_to, f3_airport_to]).tolist()
-
-    session = Session()
     a = aliased(Airport)
     stmt = \
-        select(a.airport_ident, a.airport_iata_code, a.airport_name, a.airport_latitude_deg, a.airport_longitude_deg).\
+        select(
+            a.airport_ident, a.airport_iata_code, a.airport_continent, a.airport_iso_country,
+            a.airport_iso_region, a.airport_municipality
+        ).\
         where(
-            a.airport_ident.in_(airports)
+            a.airport_type.in_(["large_airport", "medium_airport"]),
+            a.airport_scheduled_service == "yes"
         )
-    airport_df = pd.read_sql(stmt, session.bind).set_index("airport_ident")
+    with read_only_connection() as connection:
+        airports = pd.read_sql(stmt, connection)
 
-    return airport_df
+    _index = build_airport_index(airports)
 
 
-def get_airport_details_ap(df):
-    airports = pd.Series(df.index).tolist()
+def build_airport_index(airports):
+    """
+    Key index of a dataframe of airports (airport_ident, airport_iata_code, airport_continent, airport_iso_country,
+    airport_iso_region, airport_municipality). Every level is grouped over all airports, so a country or region
+    that spans several continents keeps all of its airports.
+    """
+    levels = [
+        ("con#", ["airport_continent"]),
+        ("cou#", ["airport_iso_country"]),
+        ("reg#", ["airport_iso_region"]),
+        ("mun#", ["airport_iso_country", "airport_iso_region", "airport_municipality"]),
+        ("air#", ["airport_iata_code"])
+    ]
+
+    index = {}
+    for prefix, columns in levels:
+        for key, df in airports.groupby(columns if len(columns) > 1 else columns[0]):
+            key = "#".join(key) if len(columns) > 1 else key
+            index[prefix + key] = tuple(sorted(df["airport_ident"]))
+
+    return index
+
+
+def get_airport_table():
+    """
+    Airport details as arrays (ident, iata, name, latitude, longitude) plus the ident -> array position dict,
+    built once per airport data
+    """
+    check_airport_tables()
+    table = _details
+    if table is None:
+        with _options_lock:
+            if _details is None:
+                load_airport_table()
+            table = _details
+    return table
+
+
+def load_airport_table():
+    """
+    Load all airports into the arrays of get_airport_table
+    """
+    global _details
 
-    session = Session()
     a = aliased(Airport)
     stmt = \
-        select(a.airport_ident, a.airport_iata_code, a.airport_name). \
-        where(
-            a.airport_ident.in_(airports)
+        select(a.airport_ident, a.airport_iata_code, a.airport_name, a.airport_latitude_deg, a.airport_longitude_deg).\
+        order_by(
+            a.airport_id
         )
-    airport_df = pd.read_sql(stmt, session.bind).set_index("airport_ident")
+    with read_only_connection() as connection:
+        airports = pd.read_sql(stmt, connection).drop_duplicates(subset=["airport_ident"])
+
+    _details = {
+        "positions": {ident: position for position, ident in enumerate(airports["airport_ident"])},
+        "airport_ident": airports["airport_ident"].to_numpy(dtype=object),
+        "airport_iata_code": airports["airport_iata_code"].to_numpy(dtype=object),
+        "airport_name": airports["airport_name"].to_numpy(dtype=object),
+        "airport_latitude_deg": airports["airport_latitude_deg"].to_numpy(dtype=float),
+        "airport_longitude_deg": airports["airport_longitude_deg"].to_numpy(dtype=float)
+    }
+
+
+def get_airport_positions(airports):
+    """
+    Positions of the ICAO idents in airports in the arrays of get_airport_table (-1 if unknown). These are array
+    positions, not airport_id values of the airport table
+    """
+    positions = pd.Series(airports, dtype=object).map(get_airport_table()["positions"])
+    return positions.fillna(-1).to_numpy(dtype=np.int64)
+
+
+def get_airport_details(airports, columns):
+    """
+    Dataframe with the given detail columns of the known airports, indexed by airport_ident
+    """
+    table = get_airport_table()
+    positions = get_airport_positions(pd.unique(pd.Series(airports, dtype=object)))
+    positions = positions[positions >= 0]
+    return pd.DataFrame(
+        {column: table[column][positions] for column in columns},
+        index=pd.Index(table["airport_ident"][positions], name="airport_ident")
+    )
+
+
+def get_airport_details_fl(df):
+    # f1_airport_from and f1_airport_to, f2_airport_to, ... (one column per flight of the itinerary)
+    columns = ["f1_airport_from"] + [column for column in df.columns if column.endswith("_airport_to")]
+    airports = pd.concat([pd.Series(df[column].dropna().unique()) for column in columns]).tolist()
+
+    return get_airport_details(
+        airports, ["airport_iata_code", "airport_name", "airport_latitude_deg", "airport_longitude_deg"]
+    )
+
+
+def get_airport_details_ap(df):
+    airports = pd.Series(df.index).tolist()
 
-    return airport_df
+    return get_airport_details(airports, ["airport_iata_code", "airport_name"])
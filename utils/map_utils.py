@@ -1,116 +1,69 @@
-import pandas as pd
-from itertools import islice
-
-
-def get_map_lines(df_flights, df_airports):
-
-    lod_map_lines = []
-    colors = [
-        "#6a3d9a", "#cab2d6", "#ff7f00", "#fdbf6f", "#e31a1c",
-        "#fb9a99", "#33a02c", "#b2df8a", "#1f78b4", "#a6cee3"
+import numpy as np
+
+
+COLORS = [
+    "#6a3d9a", "#cab2d6", "#ff7f00", "#fdbf6f", "#e31a1c",
+    "#fb9a99", "#33a02c", "#b2df8a", "#1f78b4", "#a6cee3"
+]
+
+
+def get_map_lines(df_flights, df_airports, top=10):
+    """
+    One row per airport of the first top itineraries, in flight order: itinerary number, seq (0 = origin,
+    k = destination of the k-th flight), airport, flight (route name), lon, lat, iata and color. Works for any
+    stop count; the coordinates are joined once for all itineraries.
+    """
+    df_top = df_flights.head(top).reset_index(drop=True)
+    columns = {"f1_airport_from": 0}
+    for column in df_top.columns:
+        if column.startswith("f") and column.endswith("_airport_to"):
+            columns[column] = int(column[1:-len("_airport_to")])
+
+    # Melt the legs into a long (itinerary, seq, airport) frame
+    df_lines = df_top[list(columns)].\
+        rename(columns=columns).\
+        rename_axis("itinerary").\
+        reset_index().\
+        melt(id_vars="itinerary", var_name="seq", value_name="airport").\
+        dropna(subset=["airport"]).\
+        sort_values(["itinerary", "seq"], kind="stable").\
+        reset_index(drop=True)
+
+    df_lines = df_lines.join(
+        df_airports[["airport_longitude_deg", "airport_latitude_deg", "airport_iata_code"]],
+        on="airport"
+    ).rename(columns={"airport_longitude_deg": "lon", "airport_latitude_deg": "lat", "airport_iata_code": "iata"})
+
+    names = df_lines["iata"].astype(str).groupby(df_lines["itinerary"]).agg("–".join)
+    df_lines.insert(3, "flight", df_lines["itinerary"].map(names))
+    df_lines["color"] = np.array(COLORS, dtype=object)[df_lines["itinerary"].to_numpy() % len(COLORS)]
+
+    return df_lines
+
+
+def get_map_traces(df_map_lines):
+    """
+    Split the map lines into one set of trace-ready arrays (flight, lon, lat, color) per itinerary
+    """
+    itinerary = df_map_lines["itinerary"].to_numpy()
+    starts = np.flatnonzero(np.r_[True, itinerary[1:] != itinerary[:-1]]) if len(itinerary) else []
+    lon = np.split(df_map_lines["lon"].to_numpy(), starts[1:])
+    lat = np.split(df_map_lines["lat"].to_numpy(), starts[1:])
+
+    flights = df_map_lines["flight"].to_numpy()
+    colors = df_map_lines["color"].to_numpy()
+    return [
+        {"flight": flights[start], "lon": lon[i], "lat": lat[i], "color": colors[start]}
+        for i, start in enumerate(starts)
     ]
-    i = 0
-
-    for index, row in islice(df_flights.iterrows(), 10):
-        color = colors[i]
-        i += 1
-        if row.stop_count == 0:
-            flight = "{}–{}".format(
-                df_airports.loc[row.f1_airport_from, "airport_iata_code"],
-                df_airports.loc[row.f1_airport_to, "airport_iata_code"]
-            )
-            # From 1
-            lon = df_airports.loc[row.f1_airport_from, "airport_longitude_deg"]
-            lat = df_airports.loc[row.f1_airport_from, "airport_latitude_deg"]
-            iata = df_airports.loc[row.f1_airport_from, "airport_iata_code"]
-            lod_map_lines = append_to_lod(lod_map_lines, flight, lon, lat, iata, color)
-
-            # To 1
-            lon = df_airports.loc[row.f1_airport_to, "airport_longitude_deg"]
-            lat = df_airports.loc[row.f1_airport_to, "airport_latitude_deg"]
-            iata = df_airports.loc[row.f1_airport_to, "airport_iata_code"]
-            lod_map_lines = append_to_lod(lod_map_lines, flight, lon, lat, iata, color)
-        elif row.stop_count == 1:
-            flight = "{}–{}–{}".format(
-                df_airports.loc[row.f1_airport_from, "airport_iata_code"],
-                df_airports.loc[row.f1_airport_to, "airport_iata_code"],
-                df_airports.loc[row.f2_airport_to, "airport_iata_code"]
-            )
-            # From 1
-            lon = df_airports.loc[row.f1_airport_from, "airport_longitude_deg"]
-            lat = df_airports.loc[row.f1_airport_from, "airport_latitude_deg"]
-            iata = df_airports.loc[row.f1_airport_from, "airport_iata_code"]
-            lod_map_lines = append_to_lod(lod_map_lines, flight, lon, lat, iata, color)
-
-            # To 1
-            lon = df_airports.loc[row.f1_airport_to, "airport_longitude_deg"]
-            lat = df_airports.loc[row.f1_airport_to, "airport_latitude_deg"]
-            iata = df_airports.loc[row.f1_airport_to, "airport_iata_code"]
-            lod_map_lines = append_to_lod(lod_map_lines, flight, lon, lat, iata, color)
-
-            # To 2
-            lon = df_airports.loc[row.f2_airport_to, "airport_longitude_deg"]
-            lat = df_airports.loc[row.f2_airport_to, "airport_latitude_deg"]
-            iata = df_airports.loc[row.f2_airport_to, "airport_iata_code"]
-            lod_map_lines = append_to_lod(lod_map_lines, flight, lon, lat, iata, color)
-        elif row.stop_count == 2:
-            flight = "{}–{}–{}–{}".format(
-                df_airports.loc[row.f1_airport_from, "airport_iata_code"],
-                df_airports.loc[row.f1_airport_to, "airport_iata_code"],
-                df_airports.loc[row.f2_airport_to, "airport_iata_code"],
-                df_airports.loc[row.f3_airport_to, "airport_iata_code"]
-            )
-            # From 1
-            lon = df_airports.loc[row.f1_airport_from, "airport_longitude_deg"]
-            lat = df_airports.loc[row.f1_airport_from, "airport_latitude_deg"]
-            iata = df_airports.loc[row.f1_airport_from, "airport_iata_code"]
-            lod_map_lines = append_to_lod(lod_map_lines, flight, lon, lat, iata, color)
-
-            # To 1
-            lon = df_airports.loc[row.f1_airport_to, "airport_longitude_deg"]
-            lat = df_airports.loc[row.f1_airport_to, "airport_latitude_deg"]
-            iata = df_airports.loc[row.f1_airport_to, "airport_iata_code"]
-            lod_map_lines = append_to_lod(lod_map_lines, flight, lon, lat, iata, color)
 
-            # To 2
-            lon = df_airports.loc[row.f2_airport_to, "airport_longitude_deg"]
-            lat = df_airports.loc[row.f2_airport_to, "airport_latitude_deg"]
-            iata = df_airports.loc[row.f2_airport_to, "airport_iata_code"]
-            lod_map_lines = append_to_lod(lod_map_lines, flight, lon, lat, iata, color)
 
-            # To 3
-            lon = df_airports.loc[row.f3_airport_to, "airport_longitude_deg"]
-            lat = df_airports.loc[row.f3_airport_to, "airport_latitude_deg"]
-            iata = df_airports.loc[row.f3_airport_to, "airport_iata_code"]
-            lod_map_lines = append_to_lod(lod_map_lines, flight, lon, lat, iata, color)
-        else:
-            continue
-
-    return pd.DataFrame(lod_map_lines)
-
-
-def get_map_markers(df_map_lines, df_airports):
-
-    iata_codes = df_map_lines["iata"].drop_duplicates().reset_index(drop=True)
-
-    df_map_markers = pd.DataFrame(columns=["iata", "lon", "lat"])
-    df_map_markers["iata"] = iata_codes
-    df_map_markers = df_map_markers.set_index("iata")
-
-    df_airports = df_airports.set_index("airport_iata_code")
-    df_map_markers["lon"] = df_airports.loc[df_map_markers.index, "airport_longitude_deg"]
-    df_map_markers["lat"] = df_airports.loc[df_map_markers.index, "airport_latitude_deg"]
+def get_map_markers(df_map_lines):
+    """
+    One marker per airport on the map lines, indexed by IATA code
+    """
+    df_map_markers = df_map_lines.\
+        drop_duplicates(subset=["iata"])[["iata", "lon", "lat"]].\
+        set_index("iata")
 
     return df_map_markers
-
-
-def append_to_lod(list_, flight, lon, lat, iata, color):
-    dict_ = {
-        "flight": flight,
-        "lon": lon,
-        "lat": lat,
-        "iata": iata,
-        "color": color
-    }
-    list_.append(dict_)
-    return list_